@@ -1,46 +1,203 @@
 import numpy as np
-import networkx as nx
 import scipy as sp
-from collections import Counter
+import scipy.sparse
+import scipy.sparse.linalg
+import scipy.sparse.csgraph
+import scipy.linalg
 
+# Algebraic multigrid preconditioner for the Laplacian solves, if available (otherwise, Jacobi is used)
+try:
+    import pyamg
+except ImportError:
+    pyamg = None
 
-# Given a graph G (as an adjacency matrix A) and threshold eps, returns a spectral sparsifier H such that
-# (1-eps)L_G <= L_H <= (1+eps)L_G, in the sense of PSD ordering.
-def spectral_sparsifier(A, eps, zero_threshold=0):
-    # Find the incidence matrix B, edge weight matrix W, Laplacian L and its pseudoinverse Lp.
-    H = nx.from_numpy_matrix(A)
-    B = nx.linalg.incidence_matrix(H, oriented=True).T
-    W = sp.sparse.diags([e[-1] for e in H.edges.data("weight", default=1)])
-    L = B.T @ W @ B
-    Lp = np.linalg.pinv(L.todense())
 
-    # Compute effective resistance of the edges
-    R_e = np.diag(B @ Lp @ B.T)
+# Edges (i < j) and weights of a graph given as a (dense or scipy sparse) symmetric adjacency matrix A, along with its
+# signed incidence matrix B (edges x nodes) and Laplacian L = B^T W B, both sparse
+def edge_incidence(A):
+    A = sp.sparse.triu(sp.sparse.csr_matrix(A), k=1).tocoo()
+    rows, cols, weights = A.row, A.col, A.data.astype(np.float64)
+    m, n = len(weights), A.shape[0]
+    B = sp.sparse.csr_matrix((np.concatenate((np.ones(m), -np.ones(m))),
+                              (np.tile(np.arange(m), 2), np.concatenate((rows, cols)))), shape=(m, n))
+    L = (B.T @ sp.sparse.diags(weights) @ B).tocsr()
+    return rows, cols, weights, B, L
+
+
+# Approximate effective resistances of the edges of a graph with signed incidence matrix B, edge weights w and
+# Laplacian L, following Spielman and Srivastava: R_e = ||W^1/2 B L^+ (e_u - e_v)||^2 is kept (up to a factor of
+# 1 +- jl_eps) by a random projection Q (k x m) with k = 24 log(n) / jl_eps^2 rows, so instead of the pseudoinverse of L,
+# only the k systems L z = (Q W^1/2 B)^T are solved, with (preconditioned) conjugate gradients.
+def approximate_effective_resistances(B, weights, L, jl_eps=1., tol=1e-6, rng=None):
+    if rng is None:
+        rng = np.random.default_rng(0)
+    m, n = B.shape
+    k = int(np.ceil(24 * np.log(n) / jl_eps ** 2))
+    # Random +-1/sqrt(k) projection of the weighted edges, Y = Q W^1/2 B (k x n)
+    Q = (rng.integers(0, 2, size=(k, m)) * 2 - 1) / np.sqrt(k)
+    Y = (sp.sparse.csr_matrix(B.T.multiply(np.sqrt(weights))) @ Q.T).T
+    if pyamg is not None:
+        M = pyamg.smoothed_aggregation_solver(L).aspreconditioner()
+    else:
+        degrees = L.diagonal()
+        inverse_degrees = np.zeros(n)
+        inverse_degrees[degrees > 0] = 1 / degrees[degrees > 0]
+        M = sp.sparse.diags(inverse_degrees)
+    Z = np.zeros((k, n))
+    for i in range(k):
+        # Each row of Y sums to zero over each connected component, so the (singular) system is consistent
+        Z[i], _ = sp.sparse.linalg.cg(L, Y[i], rtol=tol, M=M)
+    D = B @ Z.T  # m x k, row e is Z (e_u - e_v)
+    return np.sum(D ** 2, axis=1)
+
+
+# Given a graph G (as an adjacency matrix A, dense or scipy sparse) and threshold eps, returns a spectral sparsifier H
+# such that (1-eps)L_G <= L_H <= (1+eps)L_G, in the sense of PSD ordering, as a scipy sparse adjacency matrix. The edges
+# are sampled with probabilities proportional to their weights times their (approximate) effective resistances.
+def spectral_sparsifier(A, eps, zero_threshold=0, jl_eps=1., tol=1e-6, seed=0):
+    rng = np.random.default_rng(seed)
+    # Edges, incidence matrix and Laplacian
+    rows, cols, weights, B, L = edge_incidence(A)
+    n, m = L.shape[0], len(weights)
+
+    # Compute (approximate) effective resistance of the edges
+    R_e = approximate_effective_resistances(B, weights, L, jl_eps, tol, rng)
 
     # Parameters for selection of edges
     c = 1
-    n = len(H.nodes)
-    m = W.shape[0]
     q = np.ceil(9 * c ** 2 * n * np.log(n) / eps ** 2).astype('int')
     print('Sampled {:.1f} times the number of edges'.format(q/m))
 
     # Selection probabilities, proportional to edge weights and effective resistances
-    probs = W @ R_e / np.sum(W @ R_e)
+    probs = weights * R_e / np.sum(weights * R_e)
 
     # Sample to obtain new edge weights, which are zero if an edge was never selected.
-    rng = np.random.default_rng(0)
-    edge_indices = rng.choice(m, size=q, replace=True, p=probs, axis=1)
-    W_vals = [e[-1] for e in H.edges.data("weight", default=1)] / (probs*q)
-    edge_counts = Counter(edge_indices)
-    edge_ids = [(a,b) for a,b in G.edges()]
-
-    W_H = {edge_ids[ei]: W_vals[ei] * edge_counts[ei] for ei in range(m)}
-
-    # Set edge weights accordingly and return the resulting adjacency matrix, removing edges with weights that are
-    # close to zero
-    nx.set_edge_attributes(H, W_H, "weight")
-    zero_edge_ids = [(a, b) for a, b, attrs in H.edges(data=True) if attrs["weight"] <= zero_threshold]
-    H.remove_edges_from(zero_edge_ids)
-    print('Removed {} edges which were not sampled'.format(len(zero_edge_ids)))
-
-    return H
+    edge_counts = np.bincount(rng.choice(m, size=q, replace=True, p=probs), minlength=m)
+    W_H = weights * edge_counts / (probs * q)
+
+    # Return the resulting adjacency matrix, removing edges with weights that are close to zero
+    kept = W_H > zero_threshold
+    print('Removed {} edges which were not sampled'.format(m - np.sum(kept)))
+    H = sp.sparse.csr_matrix((W_H[kept], (rows[kept], cols[kept])), shape=(n, n))
+    return (H + H.T).tocsr()
+
+
+# Positive vector u in the null space of a GSO S that is a (combinatorial or normalized) graph Laplacian, on each
+# connected component: for L = D - A it is constant, and for D^-1/2 (D - A) D^-1/2 it is (proportional to) sqrt(d).
+# It is the top eigenvector of c I - S, with c = 2 max S_ii an upper bound of the spectrum of S.
+def laplacian_null_vector(S):
+    S = sp.sparse.csr_matrix(S)
+    n = S.shape[0]
+    u = np.ones(n)
+    n_components, labels = sp.sparse.csgraph.connected_components(S, directed=False)
+    for component in range(n_components):
+        nodes = np.nonzero(labels == component)[0]
+        if len(nodes) == 1:
+            continue
+        S_c = S[nodes][:, nodes]
+        c = 2 * S_c.diagonal().max()
+        if len(nodes) <= 64:
+            _, vectors = np.linalg.eigh(c * np.eye(len(nodes)) - S_c.toarray())
+            v = vectors[:, -1]
+        else:
+            _, vectors = sp.sparse.linalg.eigsh(c * sp.sparse.eye(len(nodes)) - S_c, k=1, which='LA', tol=1e-10)
+            v = vectors[:, 0]
+        u[nodes] = np.abs(v) / np.max(np.abs(v))
+    return u
+
+
+# Given a GSO S that is a (combinatorial or normalized) graph Laplacian, as a dense or scipy sparse matrix, returns a
+# spectral sparsifier S_H such that (1-eps)S <= S_H <= (1+eps)S, as a scipy sparse matrix. With u the null vector of S,
+# U S U (U = diag(u)) is the combinatorial Laplacian of the graph with weights -u_i S_ij u_j, which is sparsified with
+# spectral_sparsifier, and S_H = U^-1 L_H U^-1 keeps the bounds, since it is a congruence.
+def laplacian_sparsifier(S, eps, zero_threshold=0, jl_eps=1., tol=1e-6, seed=0):
+    S = sp.sparse.csr_matrix(S)
+    u = laplacian_null_vector(S)
+    U = sp.sparse.diags(u)
+    A = -(U @ S @ U)
+    A.setdiag(0)
+    A.eliminate_zeros()
+    if A.nnz == 0:
+        return S
+    A_H = spectral_sparsifier(A, eps, zero_threshold, jl_eps, tol, seed)
+    L_H = sp.sparse.diags(np.asarray(A_H.sum(axis=1)).flatten()) - A_H
+    # Isolated nodes keep their diagonal entry (0 in the normalized Laplacian of networkx)
+    isolated = np.asarray(abs(A).sum(axis=1)).flatten() == 0
+    U_inv = sp.sparse.diags(1 / u)
+    return (U_inv @ L_H @ U_inv + sp.sparse.diags(S.diagonal() * isolated)).tocsr()
+
+
+# A matrix given as a dense numpy array, a scipy sparse matrix or a (dense or sparse) torch tensor, as a scipy sparse
+# CSR matrix
+def as_scipy_sparse(X):
+    if hasattr(X, 'is_sparse'):
+        if X.is_sparse:
+            X = X.coalesce()
+            indices = X.indices().cpu().numpy()
+            return sp.sparse.csr_matrix((X.values().detach().cpu().numpy(), (indices[0], indices[1])), shape=X.shape)
+        X = X.detach().cpu().numpy()
+    return sp.sparse.csr_matrix(X)
+
+
+# Orthonormal basis (n x c) of the null space of a graph Laplacian (combinatorial or normalized), one vector per
+# connected component (see laplacian_null_vector). Isolated nodes are only in it if their diagonal entry is zero.
+def laplacian_null_space(S):
+    S = sp.sparse.csr_matrix(S)
+    u = laplacian_null_vector(S)
+    _, labels = sp.sparse.csgraph.connected_components(S, directed=False)
+    sizes = np.bincount(labels)
+    kept = (sizes[labels] > 1) | (S.diagonal() == 0)
+    components = np.unique(labels[kept])
+    Y = np.zeros((S.shape[0], len(components)))
+    Y[np.nonzero(kept)[0], np.searchsorted(components, labels[kept])] = u[kept]
+    return Y / np.linalg.norm(Y, axis=0)
+
+
+# Computes the spectral similarity between two square, symmetric, positive semi-definite matrices A and B of the same
+# size (dense numpy arrays, scipy sparse matrices or torch tensors, dense or sparse), as the smallest eps such that
+#   method = 'generalized': (1 - eps) x^T A x <= x^T B x <= (1 + eps) x^T A x for all x outside the null space of A,
+#       i.e. eps = max(lambda_max - 1, 1 - lambda_min) over the generalized eigenvalues B x = lambda A x. This is the
+#       bound given by the spectral sparsifiers, and A has to be a graph Laplacian (combinatorial or normalized), whose
+#       null space is known (see laplacian_null_space). For more than dense_size nodes, only the two extremal
+#       eigenvalues are computed, with LOBPCG (on the complement of that null space, with a Jacobi preconditioner),
+#       so it scales to sparse graphs with 10^5+ nodes.
+#   method = 'eigenvalues' (default): (1 - eps) lambda_i(A) <= lambda_i(B) <= (1 + eps) lambda_i(A) for the eigenvalues
+#       of A and B in ascending order, ignoring those of A that are zero (up to zero_threshold). This needs all the
+#       eigenvalues, so A and B are always made dense. It is never larger than the generalized one.
+def spectral_similarity(A, B, zero_threshold=1e-10, method='eigenvalues', dense_size=2000, tol=1e-6, maxiter=500,
+                        seed=0):
+    A, B = as_scipy_sparse(A), as_scipy_sparse(B)
+    assert A.ndim == 2 and B.ndim == 2
+    assert A.shape == B.shape and A.shape[0] == A.shape[1]
+    n = A.shape[0]
+
+    if method == 'eigenvalues':
+        # Compute eigenvalues
+        eigs_A = np.linalg.eigvalsh(A.toarray())
+        eigs_B = np.linalg.eigvalsh(B.toarray())
+        # Ignoring the eigenvalues that are zero (up to the given precision)
+        first_nonzero_eig_ind = np.min(np.where(eigs_A > zero_threshold))
+        eigs_A = eigs_A[first_nonzero_eig_ind:]
+        eigs_B = eigs_B[first_nonzero_eig_ind:]
+        # For each pair in ascending order, compute the lower bound for epsilon, and pick the greatest one
+        return np.max(np.abs((eigs_B - eigs_A) / eigs_A))
+    elif method != 'generalized':
+        raise ValueError('method {} not available'.format(method))
+
+    Y = laplacian_null_space(A)
+    if n <= dense_size:
+        # Restrict both to the range of A, where A is positive definite, and take all the generalized eigenvalues
+        eigs, V = np.linalg.eigh(A.toarray())
+        P = V[:, eigs > zero_threshold]
+        eigs = sp.linalg.eigh(P.T @ (B @ P), P.T @ (A @ P), eigvals_only=True)
+        return max(np.max(eigs) - 1, 1 - np.min(eigs))
+    # A + Y Y^T is positive definite and the same as A outside of its null space, where LOBPCG is constrained to stay
+    M = sp.sparse.linalg.LinearOperator(A.shape, matvec=lambda x: A @ x + Y @ (Y.T @ x),
+                                        matmat=lambda x: A @ x + Y @ (Y.T @ x), dtype=np.float64)
+    diagonal = A.diagonal()
+    preconditioner = sp.sparse.diags(1 / np.where(diagonal > 0, diagonal, 1))
+    X = np.random.default_rng(seed).standard_normal((n, 4))
+    Y = Y if Y.shape[1] > 0 else None
+    eigs_max, _ = sp.sparse.linalg.lobpcg(B, X, B=M, M=preconditioner, Y=Y, tol=tol, maxiter=maxiter, largest=True)
+    eigs_min, _ = sp.sparse.linalg.lobpcg(B, X, B=M, M=preconditioner, Y=Y, tol=tol, maxiter=maxiter, largest=False)
+    return max(np.max(eigs_max) - 1, 1 - np.min(eigs_min))
@@ -0,0 +1,275 @@
+import sys
+import os
+import argparse
+import json
+import time
+import platform
+import datetime
+import re
+import gc
+import ctypes
+import tracemalloc
+import numpy as np
+import torch
+import torch.nn as nn
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Synthetic_Data_Generation'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Learning'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Data'))
+
+import alegnn.utils.graphML as gml
+from Hypergraphs import Hypergraph
+from Simplicial_Complexes import CechComplex
+from Source_Localization import hypergraphSources
+from Random_Hypergraphs import random_hypergraph
+from architectures import PoolCliqueToLine, LocalGNNCliqueLine
+
+# Example usage
+# python Benchmarks.py -o results.json --sizes 100 1000 10000 --repeats 5
+#
+# Times (and records the peak memory of) the steps of the pipeline, from building the hypergraphs and their operators
+# to one training step of a LocalGNN, on synthetic hypergraphs of each of the given sizes, and writes the results as
+# JSON, so that they can be compared across commits (see compare_results) and plotted as scaling curves.
+#
+# Each benchmark is a pair of functions: prepare(size, rng), which builds its inputs (not timed), and run(state), which
+# is timed. The size is the number of nodes, with as many hyperedges of 3 nodes each. Benchmarks whose run changes or
+# caches something in its state (e.g. the Laplacians kept by the Hypergraph) are prepared again before each repeat.
+# Those that scale quadratically or worse (or build dense matrices) have a largest size, and are skipped above it.
+
+parser = argparse.ArgumentParser(description="Benchmarks of the hypergraph learning pipeline")
+parser.add_argument('-o', '--output', dest='output', type=str)
+parser.add_argument('--sizes', dest='sizes', type=int, nargs='+')
+parser.add_argument('--repeats', dest='repeats', type=int)
+parser.add_argument('--benchmarks', dest='benchmarks', type=str, nargs='+')
+parser.add_argument('--seed', dest='seed', type=int)
+# Previous results to compare against, and the slowdown (ratio of the median times) flagged as a regression
+parser.add_argument('--compare', dest='compare', type=str)
+parser.add_argument('--tolerance', dest='tolerance', type=float)
+parser.set_defaults(output='results.json', sizes=[100, 300, 1000, 3000, 10000], repeats=3, benchmarks=None, seed=0,
+                    compare=None, tolerance=1.5)
+
+torch.set_default_dtype(torch.float64)
+
+
+# Random hypergraph with size nodes and size hyperedges of 3 nodes each
+def synthetic_hypergraph(size, rng):
+    return random_hypergraph(size, size, 3, seed=rng)
+
+
+# Random points in the unit square, with the radius of the Cech complex such that each point has about 6 neighbors
+def synthetic_points(size, rng):
+    return rng.random((size, 2)), np.sqrt(6 / (np.pi * size))
+
+
+def prepare_hyperedges(size, rng):
+    return synthetic_hypergraph(size, rng).hyperedges
+
+
+def prepare_hypergraph(size, rng):
+    return synthetic_hypergraph(size, rng)
+
+
+def prepare_diffusion(size, rng):
+    H = synthetic_hypergraph(size, rng)
+    return H, rng.random(H.N)
+
+
+def prepare_points(size, rng):
+    return synthetic_points(size, rng)
+
+
+def prepare_complex(size, rng):
+    points, epsilon = synthetic_points(size, rng)
+    return CechComplex(points, epsilon)
+
+
+def prepare_sources(size, rng):
+    return synthetic_hypergraph(size, rng), list(range(5))
+
+
+# dhgData only needs the features of the nodes (and their sizes) to make the signals, so it is made without a dataset
+def prepare_dhg_signals(size, rng):
+    from DHG_datasets import dhgData
+    data = dhgData.__new__(dhgData)
+    data.N, data.F = size, 64
+    data.dataType, data.device = torch.float64, 'cpu'
+    data.d = {'features': torch.as_tensor((rng.random((size, data.F)) < 0.1).astype(np.float64))}
+    return data, torch.arange(size)
+
+
+def prepare_pooling(size, rng):
+    B = torch.as_tensor(synthetic_hypergraph(size, rng).incidence.toarray())
+    return PoolCliqueToLine(B), torch.as_tensor(rng.standard_normal((32, 16, size)))
+
+
+def prepare_train_step(size, rng):
+    H = synthetic_hypergraph(size, rng)
+    GSOs = H.expansion_gsos(['clique', 'line'])
+    model = LocalGNNCliqueLine([[4, 8], [8, 8]], [[2], [2]], True, nn.ReLU, None, gml.NoPool, [[1], [1]], [3], GSOs,
+                               [H.incidence_matrix(as_tensor=True)], do_sparse=True)
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+    x = torch.as_tensor(rng.standard_normal((16, 4, H.N)))
+    return model, optimizer, x
+
+
+def run_train_step(state):
+    model, optimizer, x = state
+    model.zero_grad()
+    loss = torch.mean(model(x) ** 2)
+    loss.backward()
+    optimizer.step()
+
+
+# Benchmarks, name: (prepare, run, prepared again before each repeat, largest size)
+benchmarks = {
+    'hypergraph_construction': (prepare_hyperedges, lambda hyperedges: Hypergraph(hyperedges), False, None),
+    'clique_laplacian': (prepare_hypergraph, lambda H: H.clique_laplacian(), True, None),
+    'line_laplacian': (prepare_hypergraph, lambda H: H.line_laplacian(), True, None),
+    'incidence_matrix': (prepare_hypergraph, lambda H: H.incidence_matrix(), False, 10000),
+    'diffuse': (prepare_diffusion, lambda state: state[0].diffuse(state[1], k=10), False, None),
+    'cech_complex': (prepare_points, lambda state: CechComplex(*state), False, 1000),
+    'boundary_maps': (prepare_complex, lambda SC: SC.boundary_maps(), False, 300),
+    'hypergraph_sources': (prepare_sources, lambda state: hypergraphSources(state[0], 100, 50, 50, state[1], tMax=10,
+                                                                            dataType=torch.float64, device='cpu'),
+                           False, None),
+    'dhg_make_signals': (prepare_dhg_signals, lambda state: state[0].make_signals(state[1]), False, 3000),
+    'pool_clique_to_line': (prepare_pooling, lambda state: state[0](state[1]), False, 10000),
+    'train_step': (prepare_train_step, run_train_step, False, None),
+}
+
+
+# Resident memory of the process in bytes, the current one (VmRSS) or its peak (VmHWM). None if it cannot be read, i.e.
+# not on Linux
+def process_memory(field='VmRSS'):
+    if not sys.platform.startswith('linux'):
+        return None
+    with open('/proc/self/status', 'r') as f:
+        match = re.search(field + r':\s+(\d+) kB', f.read())
+    return None if match is None else int(match.group(1)) * 1024
+
+
+# Resets the peak resident memory of the process to the current one. Returns whether it could be reset (only on Linux,
+# if allowed)
+def reset_peak_rss():
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+# Returns the memory freed by earlier benchmarks to the system (glibc keeps it otherwise, and the next benchmarks would
+# reuse it without growing the resident memory)
+def release_memory():
+    gc.collect()
+    if sys.platform.startswith('linux'):
+        try:
+            ctypes.CDLL('libc.so.6').malloc_trim(0)
+        except (OSError, AttributeError):
+            pass
+
+
+# Times repeats runs of the given benchmark at the given size. Returns the time of each run (in seconds), and the peak
+# memory of one more run: the peak resident memory of the process during the run above the resident memory before it
+# (the peak is reset before the run, so it does not depend on the benchmarks run before; None where it cannot be reset,
+# i.e. not on Linux), the peak allocated by CUDA (if available), and the peak traced by tracemalloc in a last run
+# (Python objects and numpy arrays only, torch tensors on the CPU are not traced). Tracing slows down Python code a lot,
+# so neither the timed runs nor the resident memory run are traced.
+def measure(name, size, repeats, rng):
+    prepare, run, fresh, _ = benchmarks[name]
+    state = prepare(size, rng)
+    times = []
+    for r in range(repeats):
+        if fresh and r > 0:
+            state = prepare(size, rng)
+        start = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - start)
+
+    if fresh:
+        state = prepare(size, rng)
+    release_memory()
+    rss_before = process_memory('VmRSS')
+    resettable = reset_peak_rss()
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+    run(state)
+    peak_rss = process_memory('VmHWM')
+    peak_rss = peak_rss - rss_before if resettable and peak_rss is not None and rss_before is not None else None
+    peak_cuda = torch.cuda.max_memory_allocated() if torch.cuda.is_available() else None
+
+    if fresh:
+        state = prepare(size, rng)
+    tracemalloc.start()
+    run(state)
+    peak_traced = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'times': times,
+            'median_time': float(np.median(times)),
+            'min_time': float(np.min(times)),
+            'peak_rss_bytes': peak_rss,
+            'peak_cuda_bytes': peak_cuda,
+            'peak_traced_bytes': peak_traced}
+
+
+# Runs the given benchmarks (all of them, if None) over the grid of sizes. Returns the results as a dictionary, with
+# the environment they were run in and one record per (benchmark, size), in the format written by main.
+def run_benchmarks(names=None, sizes=(100, 1000), repeats=3, seed=0):
+    names = list(benchmarks.keys()) if names is None else names
+    for name in names:
+        if name not in benchmarks:
+            raise ValueError('benchmark {} not available'.format(name))
+    results = {'date': datetime.datetime.now().isoformat(),
+               'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                               'torch': torch.__version__, 'platform': platform.platform(),
+                               'threads': torch.get_num_threads()},
+               'sizes': list(sizes), 'repeats': repeats, 'seed': seed,
+               'records': []}
+    for name in names:
+        for size in sizes:
+            max_size = benchmarks[name][3]
+            if max_size is not None and size > max_size:
+                continue
+            # Same inputs for each (benchmark, size), whatever ran before it
+            rng = np.random.default_rng([seed, size])
+            record = {'benchmark': name, 'size': size}
+            record.update(measure(name, size, repeats, rng))
+            peak = 'n/a' if record['peak_rss_bytes'] is None else '{:.1f}'.format(record['peak_rss_bytes'] / 2**20)
+            print('{:<24} {:>8d} {:>12.4f} s {:>12} MiB'.format(name, size, record['median_time'], peak))
+            results['records'].append(record)
+    return results
+
+
+# Compares the median times of the results with those of a previous run, for the (benchmark, size) pairs in both.
+# Returns the ones that are more than tolerance times slower, as (benchmark, size, old time, new time).
+def compare_results(results, previous, tolerance=1.5):
+    previous_times = {(record['benchmark'], record['size']): record['median_time'] for record in previous['records']}
+    regressions = []
+    for record in results['records']:
+        key = (record['benchmark'], record['size'])
+        if key in previous_times and record['median_time'] > tolerance * previous_times[key]:
+            regressions.append((record['benchmark'], record['size'], previous_times[key], record['median_time']))
+    return regressions
+
+
+def main():
+    args = parser.parse_args()
+    results = run_benchmarks(args.benchmarks, args.sizes, args.repeats, args.seed)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results saved to ' + args.output)
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            previous = json.load(f)
+        regressions = compare_results(results, previous, args.tolerance)
+        for name, size, old_time, new_time in regressions:
+            print('Regression: {} at size {} went from {:.4f} s to {:.4f} s'.format(name, size, old_time, new_time))
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,8 @@ from sklearn.metrics import f1_score
 import dhg
 import pickle
 from Hypergraphs import *
+from Operator_Cache import OperatorCache, save_operators
+from Data_Loaders import hypergraphDataset
 
 
 class dhgData(_dataForClassification):
@@ -27,6 +29,12 @@ class dhgData(_dataForClassification):
 
     Methods:
 
+    signal, labels, targets = .getTransductiveBatch(samplesType, inds = None):
+        returns the features of all the nodes as a single graph signal (shape:
+        1 x dim_features x numberNodes), the labels of the samples inds (all of
+        them, if None) and the readout targets, i.e. (0, node) for each of
+        those samples, so that all of them are classified with one forward.
+
     signals, labels = .getSamples(samplesType[, optionalArguments])
         Input:
             samplesType (string): 'train', 'valid' or 'test' to determine from
@@ -130,7 +138,7 @@ class dhgData(_dataForClassification):
     def make_signals(self, inds_tensor):
         # If we have no features, generate uniform random signals
         if self.F is None:
-            return torch.rand(len(inds_tensor), 1, self.N, device=self.device)
+            return torch.rand(len(inds_tensor), 1, self.N, dtype=self.dataType, device=self.device)
         # Build signals.
         else:
             # Use a list for indices so we aren't creating and concatenating tensors constantly
@@ -278,6 +286,37 @@ class dhgData(_dataForClassification):
 
         return np.stack((np.arange(targets.shape[0]), targets), 1)
 
+    # Returns the whole graph signal (1 x dim_features x N, the features of all the nodes at once), along with the
+    # labels and readout targets of the samples inds (all of them, if None) of samplesType. Since the task is
+    # transductive, the outputs at all the targets can be read from a single forward of this signal.
+    def getTransductiveBatch(self, samplesType, inds=None):
+        assert samplesType == 'train' or samplesType == 'valid' \
+               or samplesType == 'test'
+        if self.F is None:
+            x = torch.rand(1, 1, self.N, device=self.device)
+        else:
+            x = self.d['features'].T.unsqueeze(0)
+        x = x.type(self.dataType)
+        y = self.samples[samplesType]['targets']
+        if inds is None:
+            nodes = self.indices[samplesType]
+        else:
+            nodes = self.indices[samplesType][inds]
+            y = y[inds]
+        # All the targets are on the only sample
+        targets = np.stack((np.zeros(len(nodes), dtype=np.int64), np.asarray(nodes)), 1)
+        return x, y, targets
+
+    # Returns the (sparse) signals, labels and readout targets of the samples inds, so that a whole batch is built in
+    # one call (e.g. by a DataLoader worker process)
+    def getBatch(self, samplesType, inds):
+        x, y = self.getSamples(samplesType, inds)
+        return x, y, self.getTargets(samplesType, inds)
+
+    # Exposes the samplesType split as a torch Dataset, to be consumed by a DataLoader
+    def getDataset(self, samplesType, dense=False):
+        return hypergraphDataset(self, samplesType, dense)
+
     # We need to overwrite the parent class' method since we're using sparse signals
     def getSamples(self, samplesType, *args):
         # samplesType: train, valid, test
@@ -390,21 +429,12 @@ if __name__ == '__main__':
     if do_matrices:
         H = Hypergraph(d['edge_list'])
 
-        print('Generating GSOs...')
-        L_c = H.clique_laplacian()
-        L_l = H.line_laplacian()
-        GSOs = [L_c, L_l, L_c]
-        with open('../Learning/data/' + name + '/' + name + '_GSOs.pkl','wb') as f:
-            pickle.dump(GSOs, f)
-        del GSOs
-
-        # Compute the incidence matrix
-        print('Creating incidence matrix...')
-        B = H.incidence_matrix()
-        incidence_matrix = [B, B.T]
-        with open('../Learning/data/' + name + '/' + name + '_incidence_matrices.pkl', 'wb') as f:
-            pickle.dump(incidence_matrix, f)
-        del incidence_matrix
+        # GSOs of the clique, line and clique expansions, and the incidence matrices between them (loaded from the
+        # cache, if they were already built for this hypergraph)
+        print('Generating GSOs and incidence matrices...')
+        GSOs, incidence_matrix = OperatorCache().get_operators(H, ['clique', 'line', 'clique'])
+        save_operators('../Learning/data/' + name + '/' + name, GSOs, incidence_matrix)
+        del GSOs, incidence_matrix
 
     # Create data object
     dataParams = {'dataType': torch.float64, 'device': 'cuda:0' if (useGPU and torch.cuda.is_available()) else 'cpu'}
@@ -8,10 +8,23 @@ import torch
 import numpy as np
 import os
 import pickle
+import copy
 import datetime
+import time
+import contextlib
+import threading
+import socket
+import torch.distributed as dist
+import torch.multiprocessing as mp
 
 from sklearn.metrics import confusion_matrix
 
+# The spectral similarity is shared with the sparsifiers in Approximation
+import sys
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Approximation'))
+from Graph_Approximation import spectral_similarity
+from memoryTools import MemoryTracker, BatchSizeTuner, availableMemory, formatBytes
+
 """
 Helper functions
 
@@ -20,28 +33,6 @@ Includes Trainer and Evaluator modules, as well as some general helper functions
 """
 
 
-# Computes the spectral similarity between two matrices A and B of the same size.
-# Finds the largest value epsilon (eps) such that (1 - eps)*lambda_i(A) <= lambda_i(B) <= (1 + eps)*lambda_i(A)
-def spectral_similarity(A, B, zero_threshold=1e-10):
-    assert A.ndim == 2 and B.ndim == 2
-    assert A.shape == B.shape
-
-    # Compute eigenvalues
-    eigs_A = np.linalg.eigvalsh(A)
-    eigs_B = np.linalg.eigvalsh(B)
-
-    # Ignoring the eigenvalues thar are zero (up to the given precision)
-    first_nonzero_eig_ind = np.min(np.where(eigs_A > zero_threshold))
-    eigs_A = eigs_A[first_nonzero_eig_ind:]
-    eigs_B = eigs_B[first_nonzero_eig_ind:]
-
-    # For each pair in ascending order, compute the lower bound for epsilon
-    eps_vals = np.abs((eigs_B - eigs_A) / eigs_A)
-
-    # Pick the greatest lower bound
-    return np.max(eps_vals)
-
-
 """
 Training Module
 
@@ -51,6 +42,207 @@ Trainer: general trainer that just computes a loss over a training set and
     runs an evaluation on a validation test
 
 """
+# Commands sent by rank 0 to the other ranks in data parallel training
+rankStop, rankEpoch, rankBatch = 0, 1, 2
+
+
+class ASHAPruner:
+    """
+    ASHAPruner: early stopping of hyperparameter sweep trials by asynchronous
+        successive halving. The validation cost of every trial is recorded at
+        the rungs (epochs minEpochs, minEpochs*eta, minEpochs*eta^2, ...), and
+        a trial is stopped at a rung if its validation cost is not among the
+        best 1/eta of the costs recorded so far at that rung (by any trial).
+        Trials are never held back waiting for others, so trials can run
+        asynchronously on different workers.
+
+    Initialization:
+
+        minEpochs (int): epoch of the first rung (default: 1)
+        eta (int): reduction factor; only one in eta trials goes past each rung
+            (default: 3)
+        rungScores (dict): validation costs recorded at each rung. To share
+            them between processes, give a multiprocessing Manager dict (and a
+            Manager lock as lock) (default: None, a new dict)
+        lock (lock): lock protecting rungScores (default: None, a new lock)
+        trialName (string): name of the trial (default: None)
+
+    Methods:
+
+    trialPruner = .forTrial(trialName): pruner for the trial trialName, sharing
+        the recorded costs
+
+    prune = .shouldPrune(epoch, score): records the validation cost score of the
+        trial after epoch epochs (if it is a rung), and returns True if the
+        trial should be stopped. Larger costs are better (as in the trainers).
+    """
+
+    def __init__(self, minEpochs=1, eta=3, rungScores=None, lock=None, trialName=None):
+        assert minEpochs > 0 and eta > 1
+        self.minEpochs = minEpochs
+        self.eta = eta
+        self.rungScores = {} if rungScores is None else rungScores
+        self.lock = threading.Lock() if lock is None else lock
+        self.trialName = trialName
+
+    def forTrial(self, trialName):
+        return ASHAPruner(self.minEpochs, self.eta, self.rungScores, self.lock, trialName)
+
+    def isRung(self, epoch):
+        if epoch < self.minEpochs or epoch % self.minEpochs != 0:
+            return False
+        ratio = epoch // self.minEpochs
+        while ratio % self.eta == 0:
+            ratio = ratio // self.eta
+        return ratio == 1
+
+    def shouldPrune(self, epoch, score):
+        if not self.isRung(epoch):
+            return False
+        # Lists stored in a Manager dict are copies, so they have to be reassigned
+        with self.lock:
+            scores = self.rungScores.get(epoch, []) + [float(score)]
+            self.rungScores[epoch] = scores
+        # Keep the best 1/eta of the trials that got to this rung (none is pruned until there are eta of them)
+        nKeep = len(scores) // self.eta
+        if nKeep == 0:
+            return False
+        return float(score) < sorted(scores, reverse=True)[nKeep - 1]
+
+
+class TrainingProfiler:
+    """
+    TrainingProfiler: breakdown of the time spent in each training step, by
+        phase (data fetch, forward, loss, IL penalty, backward, optimizer step
+        and evaluation of the training cost) and by layer (forward and
+        backward of every submodule of the architecture, i.e. every layer of
+        GFL and Readout, through forward and backward hooks). On the GPU, the
+        device is synchronized before taking each time, so the times are
+        those of the kernels and not of their launches (which also makes the
+        training slower, hence it is opt-in).
+
+        The layer times include the time of their sublayers (e.g. the time of
+        GFL includes that of GFL.0), and with fused_forward the graph filters
+        are run by fusedGFL instead of being called as modules, so their time
+        is only in that of fusedGFL. The backward of a layer is only timed if
+        its input needs gradients, so that of the first layers (and of GFL
+        and fusedGFL as a whole) is close to zero.
+
+    Initialization:
+
+        archit (nn.Module): architecture to profile
+
+    Methods:
+
+    .recording: only the phases and layers run while it is True are recorded
+        (the trainer sets it during each training step, so the validation
+        steps are left out)
+
+    with .phase(name): adds the time spent in the block to the phase name
+
+    breakdown = .endEpoch(): total time (in seconds) spent in each phase, and
+        in the forward and backward of each layer (as 'GFL.0.forward' and the
+        like), since the last call; the breakdown is also appended to .epochs
+
+    .remove(): removes the hooks from the architecture
+    """
+
+    def __init__(self, archit):
+        self.archit = archit
+        self.cuda = any([p.is_cuda for p in archit.parameters()])
+        self.recording = False
+        self.totals = {}
+        self.epochs = []
+        # Start times of the layers running (a stack for each, in case a layer is called again within itself)
+        self.starts = {}
+        self.handles = []
+        for name, module in archit.named_modules():
+            if name == '':
+                continue
+            self.handles.append(module.register_forward_pre_hook(self.startHook(name + '.forward')))
+            self.handles.append(module.register_forward_hook(self.endHook(name + '.forward')))
+            self.handles.append(module.register_full_backward_pre_hook(self.startHook(name + '.backward')))
+            self.handles.append(module.register_full_backward_hook(self.endHook(name + '.backward')))
+
+    def now(self):
+        if self.cuda:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def add(self, name, seconds):
+        self.totals[name] = self.totals.get(name, 0.) + seconds
+
+    def startHook(self, name):
+        def hook(*args):
+            if self.recording:
+                self.starts.setdefault(name, []).append(self.now())
+        return hook
+
+    def endHook(self, name):
+        def hook(*args):
+            if self.recording and len(self.starts.get(name, [])) > 0:
+                self.add(name, self.now() - self.starts[name].pop())
+        return hook
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if not self.recording:
+            yield
+            return
+        start = self.now()
+        yield
+        self.add(name, self.now() - start)
+
+    def endEpoch(self):
+        breakdown = self.totals
+        self.epochs.append(breakdown)
+        self.totals = {}
+        self.starts = {}
+        return breakdown
+
+    def remove(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+
+# Splits the nTrain training samples into batches of batchSize samples, and returns the number of batches, the size
+# of each batch and the index of the first sample of each batch (and of the last one)
+def splitBatches(nTrain, batchSize):
+    # Number of batches: If the desired number of batches does not split the
+    # dataset evenly, we reduce the size of the last batch (the number of
+    # samples in the last batch).
+    # The variable batchSize is a list of length nBatches (number of
+    # batches), where each element of the list is a number indicating the
+    # size of the corresponding batch.
+    if nTrain < batchSize:
+        nBatches = 1
+        batchSize = [nTrain]
+    elif nTrain % batchSize != 0:
+        nBatches = np.ceil(nTrain / batchSize).astype(np.int64)
+        batchSize = [batchSize] * nBatches
+        # If the sum of all batches so far is not the total number of
+        # graphs, start taking away samples from the last batch (remember
+        # that we used ceiling, so we are overshooting with the estimated
+        # number of batches)
+        while sum(batchSize) != nTrain:
+            batchSize[-1] -= 1
+    # If they fit evenly, then just do so.
+    else:
+        nBatches = nTrain // batchSize
+        batchSize = [batchSize] * nBatches
+    # batchIndex is used to determine the first and last element of each
+    # batch.
+    # If batchSize is, for example [20,20,20] meaning that there are three
+    # batches of size 20 each, then cumsum will give [20,40,60] which
+    # determines the last index of each batch: up to 20, from 20 to 40, and
+    # from 40 to 60. We add the 0 at the beginning so that
+    # batchIndex[b]:batchIndex[b+1] gives the right samples for batch b.
+    batchIndex = np.cumsum(batchSize).tolist()
+    batchIndex = [0] + batchIndex
+    return nBatches, batchSize, batchIndex
+
+
 class sourceTrainer:
     """
     Trainer: general trainer that just computes a loss over a training set and
@@ -59,8 +251,8 @@ class sourceTrainer:
     Initialization:
 
         model (Modules.model class): model to train
-        data (Utils.data class): needs to have a getSamples and an evaluate
-            method
+        data (Utils.data class): needs to have a getSamples, a getBatch and an
+            evaluate method
         nEpochs (int): number of epochs (passes over the dataset)
         batchSize (int): size of each minibatch
 
@@ -85,6 +277,50 @@ class sourceTrainer:
         realitizationNo (int): keep track of what data realization this is
         >> Alternatively, these last two keyword arguments can be used to keep
             track of different trainings of the same model
+        numWorkers (int): number of DataLoader worker processes building the
+            training batches in the background (0 means the batches are built
+            on the training thread, as usual)
+        prefetchFactor (int): number of batches each worker keeps ready
+        pinMemory (bool): if True, the batches built by the workers are placed
+            in pinned memory, so they can be copied asynchronously to the GPU
+        > Obs.: The data needs a getDataset method to use the workers, and
+              should be kept on the CPU (the batches are moved to the device
+              of the model by the trainer).
+        pruner (ASHAPruner): if given, the latest validation cost is reported
+            to the pruner at the end of each epoch, and training stops if the
+            pruner decides the trial is not promising.
+        worldSize (int): number of processes training the model (data
+            parallel, with torch.distributed on the gloo backend). The other
+            worldSize-1 processes (ranks) are forked from this one when
+            training starts, each batch is split among the ranks, and the
+            gradients are averaged (weighted by the share of the batch of each
+            rank) before every step, so all ranks take the same step a single
+            process would. Validation, the selection of the best model and the
+            saving are done by this process (rank 0) only, and the training
+            loss and cost reported are those of its share of the batch. The
+            batches are always built on the training thread in this case.
+        profile (bool): if True, the time of each phase of the training steps
+            and of the forward and backward of each layer is recorded (see
+            TrainingProfiler), and the breakdown of each epoch is added to
+            trainVars (and to the tensorboard logs, if doLogging)
+        trackMemory (bool): if True, the peak memory of each epoch (resident
+            set size of the process, and allocated by torch on the GPU) is
+            recorded (see memoryTools.MemoryTracker) and added to trainVars
+            (and to the tensorboard logs, if doLogging)
+        autoBatchSize (bool): if True, when training starts the batch size is
+            replaced by the one with the highest throughput under the memory
+            budget (see memoryTools.BatchSizeTuner), probed with training steps
+            (whose changes to the model and the optimizer are undone), and the
+            learning rate and the intervals (in training steps) are scaled
+            accordingly. The batch size of the validation steps (and the one
+            returned for the evaluation) is tuned the same way, with forward
+            steps only.
+        memoryBudget (int): largest peak memory (in bytes) of the batch sizes
+            chosen by autoBatchSize (if None, the memory available, see
+            memoryTools.availableMemory)
+        learningRateScaling (string): how the learning rate is scaled with the
+            batch size chosen by autoBatchSize: 'linear' (in proportion to it),
+            'sqrt' (to its square root, as is usual for ADAM) or None
 
     Training:
 
@@ -104,6 +340,16 @@ class sourceTrainer:
                 validation step (np.array)
             'evalValid': evaluation function on the validation samples for each
                 validation step (np.array)
+            'pruned': True if training was stopped by the pruner (bool)
+            'nEpochsRun': number of epochs actually run (int)
+            'profile': if profile, the time spent in each phase and layer in
+                each epoch (list of dict, see TrainingProfiler.endEpoch)
+            'peakMemory': if trackMemory, the peak memory of each epoch (list of
+                dict, see memoryTools.MemoryTracker.endEpoch)
+            'evalBatchSize': batch size of the validation steps (int)
+            'batchSizeProbes': if autoBatchSize, the probes of the training and
+                of the validation batch sizes (dict of lists, see
+                memoryTools.BatchSizeTuner)
     """
 
     def __init__(self, model, data, nEpochs, batchSize, **kwargs):
@@ -177,9 +423,63 @@ class sourceTrainer:
         else:
             integral_lipschitz_constant = None
 
+        if 'numWorkers' in kwargs.keys():
+            numWorkers = kwargs['numWorkers']
+        else:
+            numWorkers = 0
+
+        if 'prefetchFactor' in kwargs.keys():
+            prefetchFactor = kwargs['prefetchFactor']
+        else:
+            prefetchFactor = 2
+
+        if 'pinMemory' in kwargs.keys():
+            pinMemory = kwargs['pinMemory']
+        else:
+            pinMemory = 'cuda' in str(model.device)
+
+        if 'pruner' in kwargs.keys():
+            pruner = kwargs['pruner']
+        else:
+            pruner = None
+
+        if 'worldSize' in kwargs.keys():
+            worldSize = kwargs['worldSize']
+        else:
+            worldSize = 1
+
+        if 'profile' in kwargs.keys():
+            profile = kwargs['profile']
+        else:
+            profile = False
+
+        if 'trackMemory' in kwargs.keys():
+            trackMemory = kwargs['trackMemory']
+        else:
+            trackMemory = False
+
+        if 'autoBatchSize' in kwargs.keys():
+            autoBatchSize = kwargs['autoBatchSize']
+        else:
+            autoBatchSize = False
+
+        if 'memoryBudget' in kwargs.keys():
+            memoryBudget = kwargs['memoryBudget']
+        else:
+            memoryBudget = None
+
+        if 'learningRateScaling' in kwargs.keys():
+            learningRateScaling = kwargs['learningRateScaling']
+        else:
+            learningRateScaling = 'linear'
+        assert learningRateScaling in ['linear', 'sqrt', None]
+        # The ranks draw their shares from the same permutation of the samples
+        if worldSize > 1:
+            numWorkers = 0
+
         if doLogging:
             from alegnn.utils.visualTools import Visualizer
-            logsTB = os.path.join(self.saveDir, self.name + '-logsTB')
+            logsTB = os.path.join(self.model.saveDir, self.model.name + '-logsTB')
             logger = Visualizer(logsTB, name='visualResults')
         else:
             logger = None
@@ -197,37 +497,7 @@ class sourceTrainer:
 
         nTrain = data.nTrain  # size of the training set
 
-        # Number of batches: If the desired number of batches does not split the
-        # dataset evenly, we reduce the size of the last batch (the number of
-        # samples in the last batch).
-        # The variable batchSize is a list of length nBatches (number of
-        # batches), where each element of the list is a number indicating the
-        # size of the corresponding batch.
-        if nTrain < batchSize:
-            nBatches = 1
-            batchSize = [nTrain]
-        elif nTrain % batchSize != 0:
-            nBatches = np.ceil(nTrain / batchSize).astype(np.int64)
-            batchSize = [batchSize] * nBatches
-            # If the sum of all batches so far is not the total number of
-            # graphs, start taking away samples from the last batch (remember
-            # that we used ceiling, so we are overshooting with the estimated
-            # number of batches)
-            while sum(batchSize) != nTrain:
-                batchSize[-1] -= 1
-        # If they fit evenly, then just do so.
-        else:
-            nBatches = np.int(nTrain / batchSize)
-            batchSize = [batchSize] * nBatches
-        # batchIndex is used to determine the first and last element of each
-        # batch.
-        # If batchSize is, for example [20,20,20] meaning that there are three
-        # batches of size 20 each, then cumsum will give [20,40,60] which
-        # determines the last index of each batch: up to 20, from 20 to 40, and
-        # from 40 to 60. We add the 0 at the beginning so that
-        # batchIndex[b]:batchIndex[b+1] gives the right samples for batch b.
-        batchIndex = np.cumsum(batchSize).tolist()
-        batchIndex = [0] + batchIndex
+        nBatches, batchSize, batchIndex = splitBatches(nTrain, batchSize)
 
         ###################
         # SAVE ATTRIBUTES #
@@ -255,6 +525,22 @@ class sourceTrainer:
         self.trainingOptions['graphNo'] = graphNo
         self.trainingOptions['realizationNo'] = realizationNo
         self.trainingOptions['integral_lipschitz_constant'] = integral_lipschitz_constant
+        self.trainingOptions['numWorkers'] = numWorkers
+        self.trainingOptions['prefetchFactor'] = prefetchFactor
+        self.trainingOptions['pinMemory'] = pinMemory
+        self.trainingOptions['pruner'] = pruner
+        self.trainingOptions['worldSize'] = worldSize
+        self.trainingOptions['profile'] = profile
+        self.trainingOptions['trackMemory'] = trackMemory
+        self.trainingOptions['autoBatchSize'] = autoBatchSize
+        self.trainingOptions['memoryBudget'] = memoryBudget
+        self.trainingOptions['learningRateScaling'] = learningRateScaling
+        self.trainingOptions['evalBatchSize'] = batchSize[0]
+        self.batchSizeProbes = None
+        # Hooks are only added to the architecture when training starts
+        self.profiler = None
+        # Weight of the gradients of this rank in the average over the ranks
+        self.shareWeight = 1.
 
     # Computes the training loss, including a constraint penalty for the integral Lipschitz constants
     # of the graph filtering layers. All filters are constrained to have IL constant below some
@@ -272,45 +558,61 @@ class sourceTrainer:
         integral_lipschitz_constant = self.trainingOptions['integral_lipschitz_constant']
 
         # Compute the loss
-        loss = self.model.loss(yHat, y)
+        with self.profilePhase('loss'):
+            loss = self.model.loss(yHat, y)
 
         # Compute the penalty term, if necessary
         if integral_lipschitz_constant is not None:
-            C_vals = self.model.archit.compute_IL_constant(return_all=True)
-            # loss += -1e-2 * torch.mean(torch.log(integral_lipschitz_constant - C_vals))
-            loss += 1e-2 * torch.mean(torch.exp(1*(C_vals - integral_lipschitz_constant)))
+            with self.profilePhase('ILPenalty'):
+                C_vals = self.model.archit.compute_IL_constant(return_all=True)
+                # loss += -1e-2 * torch.mean(torch.log(integral_lipschitz_constant - C_vals))
+                loss += 1e-2 * torch.mean(torch.exp(1*(C_vals - integral_lipschitz_constant)))
 
         return loss
 
-    def trainBatch(self, thisBatchIndices):
+    # Context in which the time spent is added to the given phase of the training step, when profiling (see
+    # TrainingProfiler)
+    def profilePhase(self, name):
+        if self.profiler is None:
+            return contextlib.nullcontext()
+        return self.profiler.phase(name)
+
+    # Trains on a single batch. If the batch was already built (e.g. by a DataLoader worker), it is given in thisBatch
+    # as the tuple (signals, labels, targets), and thisBatchIndices is not used.
+    def trainBatch(self, thisBatchIndices, thisBatch=None):
 
         # Get the samples
-        xTrain, yTrain = self.data.getSamples('train', thisBatchIndices)
-        xTrain = xTrain.to(self.model.device)
-        yTrain = yTrain.to(self.model.device)
+        with self.profilePhase('dataFetch'):
+            if thisBatch is None:
+                thisBatch = self.data.getBatch('train', thisBatchIndices)
+            xTrain, yTrain, targets = thisBatch
+            xTrain = xTrain.to(self.model.device, non_blocking=True)
+            yTrain = yTrain.to(self.model.device, non_blocking=True)
 
         # Start measuring time
         startTime = datetime.datetime.now()
 
-        # Reset gradients
-        self.model.archit.zero_grad()
+        with self.profilePhase('forward'):
+            # Reset gradients
+            self.model.archit.zero_grad()
 
-        # Obtain the output of the GNN
-        yHatTrain = self.model.archit(xTrain)
+            # Obtain the output of the GNN
+            yHatTrain = self.model.archit(xTrain)
 
-        # Take targets
-        targets = self.data.getTargets(thisBatchIndices)
-        if targets is not None:
-            yHatTrain = yHatTrain[range(len(thisBatchIndices)), targets, :]
+            # Take targets
+            if targets is not None:
+                yHatTrain = yHatTrain[range(xTrain.shape[0]), targets, :]
 
         # Compute loss
         lossValueTrain = self.IL_loss(yHatTrain, yTrain)
 
         # Compute gradients
-        lossValueTrain.backward()
+        with self.profilePhase('backward'):
+            lossValueTrain.backward()
 
         # Optimize
-        self.model.optim.step()
+        with self.profilePhase('optimizerStep'):
+            self.optimizerStep()
 
         # Finish measuring time
         endTime = datetime.datetime.now()
@@ -322,10 +624,107 @@ class sourceTrainer:
         #   same value, but detaches it from the gradient, so that no
         #   gradient operation is taken into account here.
         #   (Alternatively, we could use a with torch.no_grad():)
-        costTrain = self.data.evaluate(yHatTrain.data, yTrain)
+        with self.profilePhase('evaluate'):
+            costTrain = self.data.evaluate(yHatTrain.data, yTrain)
 
         return lossValueTrain.item(), costTrain.item(), timeElapsed
 
+    # Takes an optimization step. With data parallel training, the gradients of all the ranks are averaged first (each
+    # one weighted by the share of the batch of its rank), so that all the ranks take the same step. Parameters without
+    # a gradient in any of the ranks are left without one, as the optimizer would with a single process.
+    def optimizerStep(self):
+        if self.trainingOptions['worldSize'] > 1:
+            parameters = [p for p in self.model.archit.parameters() if p.requires_grad]
+            hasGrad = torch.tensor([p.grad is not None for p in parameters], dtype=parameters[0].dtype)
+            grads = torch.cat([hasGrad] + [self.shareWeight * p.grad.flatten() if p.grad is not None
+                                           else torch.zeros(p.numel(), dtype=p.dtype) for p in parameters])
+            dist.all_reduce(grads)
+            offset = len(parameters)
+            for i, p in enumerate(parameters):
+                if grads[i] > 0:
+                    p.grad = grads[offset:offset + p.numel()].reshape(p.shape).to(p.dtype)
+                offset += p.numel()
+        self.model.optim.step()
+
+    # Share of the batch trained on by this rank (every worldSize-th sample, starting at its rank)
+    def rankShare(self, thisBatchIndices):
+        share = thisBatchIndices[dist.get_rank()::dist.get_world_size()]
+        self.shareWeight = len(share) / len(thisBatchIndices)
+        return share
+
+    # Starts the other ranks of data parallel training, as forked copies of this process (so they start from the same
+    # model, optimizer and data), and joins them as rank 0. The torch threads are split among the ranks.
+    def startRanks(self, worldSize):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            initMethod = 'tcp://127.0.0.1:%d' % s.getsockname()[1]
+        nThreads = max(1, torch.get_num_threads() // worldSize)
+        context = mp.get_context('fork')
+        ranks = [context.Process(target=self.rankWorker, args=(rank, worldSize, initMethod, nThreads), daemon=True)
+                 for rank in range(1, worldSize)]
+        for process in ranks:
+            process.start()
+        self.previousNumThreads = torch.get_num_threads()
+        torch.set_num_threads(nThreads)
+        dist.init_process_group('gloo', init_method=initMethod, rank=0, world_size=worldSize)
+        return ranks
+
+    # Sends a command (and its value) from rank 0 to the other ranks, and returns it on all of them
+    def broadcastCommand(self, command=0, value=0):
+        commandTensor = torch.tensor([command, value], dtype=torch.long)
+        dist.broadcast(commandTensor, 0)
+        return int(commandTensor[0]), int(commandTensor[1])
+
+    # Sends the permutation of the training samples of the epoch from rank 0 to the other ranks
+    def broadcastPermutation(self, idxEpoch=None):
+        permutation = torch.zeros(self.data.nTrain, dtype=torch.long) if idxEpoch is None \
+            else torch.tensor(idxEpoch, dtype=torch.long)
+        dist.broadcast(permutation, 0)
+        return permutation.tolist()
+
+    # Tells the other ranks that training is over, and leaves the process group
+    def stopRanks(self, ranks):
+        self.broadcastCommand(rankStop)
+        dist.destroy_process_group()
+        for process in ranks:
+            process.join()
+        torch.set_num_threads(self.previousNumThreads)
+        self.shareWeight = 1.
+
+    # Training loop of the ranks other than rank 0: they follow the epochs (permutations of the samples, and learning
+    # rate decay) and batches that rank 0 sends, and train on their share of each batch.
+    def rankWorker(self, rank, worldSize, initMethod, nThreads):
+        torch.set_num_threads(nThreads)
+        dist.init_process_group('gloo', init_method=initMethod, rank=rank, world_size=worldSize)
+        batchIndex = self.trainingOptions['batchIndex']
+        if self.trainingOptions['doLearningRateDecay']:
+            learningRateScheduler = torch.optim.lr_scheduler.StepLR(
+                self.model.optim, self.trainingOptions['learningRateDecayPeriod'],
+                self.trainingOptions['learningRateDecayRate'])
+        command, batch = self.broadcastCommand()
+        while command != rankStop:
+            if command == rankEpoch:
+                idxEpoch = self.broadcastPermutation()
+                if self.trainingOptions['doLearningRateDecay']:
+                    learningRateScheduler.step()
+            else:
+                thisBatchIndices = self.rankShare(idxEpoch[batchIndex[batch]: batchIndex[batch + 1]])
+                if len(thisBatchIndices) > 0:
+                    self.trainBatch(thisBatchIndices)
+                else:
+                    # Nothing to train on, but the step is still taken with the gradients of the other ranks
+                    self.model.archit.zero_grad()
+                    self.optimizerStep()
+            command, batch = self.broadcastCommand()
+        dist.destroy_process_group()
+
+    # Output of the architecture at the given samples of samplesType (without gradients)
+    def inferenceBatch(self, samplesType, thisBatchIndices):
+        xBatch, _ = self.data.getSamples(samplesType, thisBatchIndices)
+        xBatch = xBatch.to(self.model.device)
+        nSamples = len(thisBatchIndices)
+        return self.model.archit(xBatch)[range(nSamples), range(nSamples), :]
+
     def validationStep(self):
 
         # Validation:
@@ -346,17 +745,10 @@ class sourceTrainer:
 
             # Use batches, for memory saving
             yHatValid = torch.tensor([], device=self.model.device)
-            batchSize = self.trainingOptions['batchSize'][0]
-            for b in range(xValid.shape[0] // batchSize):
-                thisBatchIndices = list(range(b * batchSize, (b+1) * batchSize))
-                xValidBatch, _ = self.data.getSamples('valid', thisBatchIndices)
-                xValidBatch = xValidBatch.to(self.model.device)
-                yHatValid = torch.cat((yHatValid, self.model.archit(xValidBatch)[range(batchSize), range(batchSize), :]))
-            if xValid.shape[0] % batchSize > 0:
-                thisBatchIndices = list(range((b + 1) * batchSize, xValid.shape[0]))
-                xValidBatch, _ = self.data.getSamples('valid', thisBatchIndices)
-                xValidBatch = xValidBatch.to(self.model.device)
-                yHatValid = torch.cat((yHatValid, self.model.archit(xValidBatch)[range(batchSize), range(batchSize), :]))
+            batchSize = self.trainingOptions['evalBatchSize']
+            for start in range(0, xValid.shape[0], batchSize):
+                thisBatchIndices = list(range(start, min(start + batchSize, xValid.shape[0])))
+                yHatValid = torch.cat((yHatValid, self.inferenceBatch('valid', thisBatchIndices)))
 
             # Compute loss
             lossValueValid = self.IL_loss(yHatValid, yValid)
@@ -371,8 +763,70 @@ class sourceTrainer:
 
         return lossValueValid.item(), costValid.item(), timeElapsed
 
+    # Replaces the batch size of the training steps, and that of the validation steps, with the ones of highest
+    # throughput under the memory budget (see memoryTools.BatchSizeTuner). The training batch sizes are probed with
+    # training steps on the first samples, and the state of the model and the optimizer before them is restored after.
+    # With data parallel training, the probes run before the other ranks start, each on the share of the batch of one
+    # rank. The learning rate is scaled with the ratio of the batch sizes, and so are the intervals (in training steps)
+    # between prints and validations, so that they still cover the same number of samples.
+    def tuneBatchSize(self):
+        nTrain = self.data.nTrain
+        worldSize = self.trainingOptions['worldSize']
+        memoryBudget = self.trainingOptions['memoryBudget']
+        if memoryBudget is None:
+            memoryBudget = availableMemory(self.model.device)
+        oldBatchSize = self.trainingOptions['batchSize'][0]
+
+        architState = copy.deepcopy(self.model.archit.state_dict())
+        optimState = copy.deepcopy(self.model.optim.state_dict())
+        self.trainingOptions['worldSize'] = 1
+        try:
+            trainTuner = BatchSizeTuner(lambda n: self.trainBatch(list(range(int(np.ceil(n / worldSize))))), nTrain,
+                                        memoryBudget, device=self.model.device)
+            batchSize = trainTuner.tune()
+        finally:
+            self.trainingOptions['worldSize'] = worldSize
+            self.model.archit.load_state_dict(architState)
+            self.model.optim.load_state_dict(optimState)
+            self.model.archit.zero_grad()
+
+        def inferenceStep(n):
+            with torch.no_grad():
+                self.inferenceBatch('train', list(range(n)))
+
+        evalTuner = BatchSizeTuner(inferenceStep, min(nTrain, max(self.data.nValid, self.data.nTest)), memoryBudget,
+                                   device=self.model.device)
+        evalBatchSize = evalTuner.tune()
+        self.batchSizeProbes = {'train': trainTuner.probes, 'eval': evalTuner.probes}
+
+        # Scale the learning rate, and the intervals
+        ratio = batchSize / oldBatchSize
+        learningRateScaling = self.trainingOptions['learningRateScaling']
+        for paramGroup in self.model.optim.param_groups:
+            if learningRateScaling == 'linear':
+                paramGroup['lr'] *= ratio
+            elif learningRateScaling == 'sqrt':
+                paramGroup['lr'] *= float(np.sqrt(ratio))
+        for interval in ['printInterval', 'validationInterval']:
+            if self.trainingOptions[interval] > 0:
+                self.trainingOptions[interval] = max(1, int(round(self.trainingOptions[interval] / ratio)))
+        nBatches, batchSizes, batchIndex = splitBatches(nTrain, batchSize)
+        self.trainingOptions['nBatches'] = nBatches
+        self.trainingOptions['batchSize'] = batchSizes
+        self.trainingOptions['batchIndex'] = batchIndex
+        self.trainingOptions['evalBatchSize'] = evalBatchSize
+
+        if self.trainingOptions['doPrint']:
+            print("Batch size: %d (from %d), validation batch size: %d, learning rate: %g, memory budget: %s" % (
+                batchSize, oldBatchSize, evalBatchSize, self.model.optim.param_groups[0]['lr'],
+                'none' if memoryBudget is None else formatBytes(memoryBudget)))
+
     def train(self):
 
+        # Tune the batch sizes (and scale the options that depend on them) before reading the options
+        if self.trainingOptions['autoBatchSize']:
+            self.tuneBatchSize()
+
         # Get back the training options
         assert 'trainingOptions' in dir(self)
         assert 'doLogging' in self.trainingOptions.keys()
@@ -412,6 +866,28 @@ class sourceTrainer:
         realizationNo = self.trainingOptions['realizationNo']
         assert 'integral_lipschitz_constant' in self.trainingOptions.keys()
         integral_lipschitz_constant = self.trainingOptions['integral_lipschitz_constant']
+        assert 'numWorkers' in self.trainingOptions.keys()
+        numWorkers = self.trainingOptions['numWorkers']
+        assert 'prefetchFactor' in self.trainingOptions.keys()
+        prefetchFactor = self.trainingOptions['prefetchFactor']
+        assert 'pinMemory' in self.trainingOptions.keys()
+        pinMemory = self.trainingOptions['pinMemory']
+        assert 'pruner' in self.trainingOptions.keys()
+        pruner = self.trainingOptions['pruner']
+        assert 'worldSize' in self.trainingOptions.keys()
+        worldSize = self.trainingOptions['worldSize']
+        assert 'profile' in self.trainingOptions.keys()
+        profile = self.trainingOptions['profile']
+        assert 'trackMemory' in self.trainingOptions.keys()
+        trackMemory = self.trainingOptions['trackMemory']
+
+        # If there are workers, the training batches are built in the background by a DataLoader. The sampler draws a
+        # new random permutation every epoch, following the same batch sizes as below.
+        if numWorkers > 0:
+            from Data_Loaders import epochBatchSampler, makeDataLoader
+            batchLoader = makeDataLoader(self.data, 'train', epochBatchSampler(self.data.nTrain, batchIndex),
+                                         numWorkers=numWorkers, pinMemory=pinMemory,
+                                         prefetchFactor=prefetchFactor)
 
         # Learning rate scheduler:
         if doLearningRateDecay:
@@ -426,10 +902,22 @@ class sourceTrainer:
             self.model.archit.enforce_IL_condition(integral_lipschitz_constant)
             print(f"IL constraint: {integral_lipschitz_constant}\nInitial IL coefficient: {self.model.archit.compute_IL_constant()}")
 
+        # Data parallel training: the other ranks start from the same state as this one
+        if worldSize > 1:
+            ranks = self.startRanks(worldSize)
+
+        # Hooks timing the forward and backward of each layer (added after forking the other ranks, which do not
+        # profile)
+        if profile:
+            self.profiler = TrainingProfiler(self.model.archit)
+        if trackMemory:
+            memoryTracker = MemoryTracker()
+
         # Initialize counters (since we give the possibility of early stopping,
         # we had to drop the 'for' and use a 'while' instead):
         epoch = 0  # epoch counter
         lagCount = 0  # lag counter for early stopping
+        pruned = False  # whether the pruner stopped the training
 
         # Store the training variables
         lossTrain = []
@@ -438,8 +926,10 @@ class sourceTrainer:
         costValid = []
         timeTrain = []
         timeValid = []
+        profileTrain = []
+        peakMemory = []
 
-        while epoch < nEpochs \
+        while epoch < nEpochs and not pruned \
                 and (lagCount < earlyStoppingLag or (not doEarlyStopping)):
             # The condition will be zero (stop), whenever one of the items of
             # the 'and' is zero. Therefore, we want this to stop only for epoch
@@ -460,9 +950,22 @@ class sourceTrainer:
             # accidentally increasing lagCount).
 
             # Randomize dataset for each epoch
-            randomPermutation = np.random.permutation(self.data.nTrain)
-            # Convert a numpy.array of numpy.int into a list of actual int.
-            idxEpoch = [int(i) for i in randomPermutation]
+            if numWorkers > 0:
+                # The workers start building the batches of the epoch as soon
+                # as the iterator is created
+                batchIterator = iter(batchLoader)
+            else:
+                randomPermutation = np.random.permutation(self.data.nTrain)
+                # Convert a numpy.array of numpy.int into a list of actual int.
+                idxEpoch = [int(i) for i in randomPermutation]
+                # The other ranks take their shares of the batches from the
+                # same permutation
+                if worldSize > 1:
+                    self.broadcastCommand(rankEpoch)
+                    self.broadcastPermutation(idxEpoch)
+
+            if trackMemory:
+                memoryTracker.startEpoch()
 
             # Learning decay
             if doLearningRateDecay:
@@ -478,10 +981,27 @@ class sourceTrainer:
             while batch < nBatches \
                     and (lagCount < earlyStoppingLag or (not doEarlyStopping)):
 
-                # Extract the adequate batch
-                thisBatchIndices = idxEpoch[batchIndex[batch] : batchIndex[batch + 1]]
+                # Only the training step (and fetching its batch) is profiled
+                if profile:
+                    self.profiler.recording = True
 
-                lossValueTrain, costValueTrain, timeElapsed = self.trainBatch(thisBatchIndices)
+                # Extract the adequate batch
+                if numWorkers > 0:
+                    thisBatchIndices = None
+                    with self.profilePhase('dataFetch'):
+                        thisBatch = next(batchIterator)
+                else:
+                    thisBatchIndices = idxEpoch[batchIndex[batch] : batchIndex[batch + 1]]
+                    thisBatch = None
+                    # Each rank only trains on its share of the batch
+                    if worldSize > 1:
+                        self.broadcastCommand(rankBatch, batch)
+                        thisBatchIndices = self.rankShare(thisBatchIndices)
+
+                lossValueTrain, costValueTrain, timeElapsed = self.trainBatch(thisBatchIndices, thisBatch)
+
+                if profile:
+                    self.profiler.recording = False
 
                 # Logging values
                 if doLogging:
@@ -600,9 +1120,48 @@ class sourceTrainer:
             # \\\ END OF EPOCH:
             # \\\\\\\
 
+            # \\\ Time spent in each phase and layer during the epoch
+            if profile:
+                breakdown = self.profiler.endEpoch()
+                profileTrain += [breakdown]
+                if doPrint:
+                    print("\t(E: %2d) " % (epoch + 1) + ", ".join(
+                        ["%s %.4fs" % (phase, breakdown[phase]) for phase in
+                         ['dataFetch', 'forward', 'loss', 'ILPenalty', 'backward', 'optimizerStep', 'evaluate']
+                         if phase in breakdown.keys()]))
+                if doLogging:
+                    logger.scalar_summary(mode='Profile', epoch=epoch, **breakdown)
+
+            # \\\ Peak memory during the epoch
+            if trackMemory:
+                peaks = memoryTracker.endEpoch()
+                peakMemory += [peaks]
+                if doPrint:
+                    print("\t(E: %2d) Peak memory: %s RSS" % (epoch + 1, formatBytes(peaks['peakRSS'])), end='')
+                    if peaks['peakCUDA'] is not None:
+                        print(", %s CUDA" % formatBytes(peaks['peakCUDA']), end='')
+                    print("")
+                if doLogging:
+                    logger.scalar_summary(mode='Memory', epoch=epoch,
+                                          **{key: value for key, value in peaks.items() if value is not None})
+
             # \\\ Increase epoch count:
             epoch += 1
 
+            # \\\ Report the latest validation cost to the pruner, and stop
+            # if this trial is not among the promising ones (a trial that
+            # already ran all its epochs is never pruned)
+            if pruner is not None and len(costValid) > 0 and epoch < nEpochs:
+                pruned = pruner.shouldPrune(epoch, costValid[-1])
+                if pruned and doPrint:
+                    print("\t=> Pruned after %d epochs (%s)" % (epoch, pruner.trialName))
+
+        if worldSize > 1:
+            self.stopRanks(ranks)
+
+        if profile:
+            self.profiler.remove()
+
         # \\\ Save models:
         self.model.save(label='Last')
 
@@ -627,8 +1186,17 @@ class sourceTrainer:
                      'costTrain': costTrain,
                      'lossValid': lossValid,
                      'costValid': costValid,
-                     'costValidBest': costValidBest
+                     'costValidBest': costValidBest,
+                     'pruned': pruned,
+                     'nEpochsRun': epoch
                      }
+        if profile:
+            trainVars['profile'] = profileTrain
+        if trackMemory:
+            trainVars['peakMemory'] = peakMemory
+        trainVars['evalBatchSize'] = self.trainingOptions['evalBatchSize']
+        if self.batchSizeProbes is not None:
+            trainVars['batchSizeProbes'] = self.batchSizeProbes
 
         if doSaveVars:
             saveDirVars = os.path.join(self.model.saveDir, 'trainVars')
@@ -663,36 +1231,83 @@ class dhgTrainer(sourceTrainer):
     """
     Trainer: trainer for DHG data that computes a loss over a training set and
         runs an evaluation on a validation test
+
+    Initialization:
+
+        Same as sourceTrainer, with the additional optional (keyword) argument
+
+        subgraphSampling (bool): if True, the architecture is only run on the
+            subgraphs (of each GSO) that the outputs at the target nodes of the
+            batch depend on (see LocalGNNCliqueLine.enableSubgraphSampling).
+        transductive (bool): if True, each training step is a single forward
+            of the features of all the nodes (data.getTransductiveBatch), with
+            the loss computed on all the training nodes, i.e. there is one step
+            per epoch (and validationInterval counts epochs). Validation is done
+            the same way. No DataLoader workers are used in this case (nor
+            autoBatchSize).
     """
 
     def __init__(self, model, data, nEpochs, batchSize, **kwargs):
         super().__init__(model, data, nEpochs, batchSize, **kwargs)
 
-    def trainBatch(self, thisBatchIndices):
+        # Run the architecture only on the neighborhoods (in every GSO) of the
+        # target nodes of each batch, instead of on the whole hypergraph
+        if 'subgraphSampling' in kwargs.keys():
+            subgraphSampling = kwargs['subgraphSampling']
+        else:
+            subgraphSampling = False
+        self.trainingOptions['subgraphSampling'] = subgraphSampling
+        if subgraphSampling:
+            self.model.archit.enableSubgraphSampling()
+
+        # Classify all the training nodes from a single forward of the whole
+        # graph signal, so that each epoch is one (full batch) training step
+        if 'transductive' in kwargs.keys():
+            transductive = kwargs['transductive']
+        else:
+            transductive = False
+        self.trainingOptions['transductive'] = transductive
+        if transductive:
+            self.trainingOptions['batchSize'] = [data.nTrain]
+            self.trainingOptions['batchIndex'] = [0, data.nTrain]
+            self.trainingOptions['nBatches'] = 1
+            self.trainingOptions['numWorkers'] = 0
+            self.trainingOptions['autoBatchSize'] = False
+
+    def trainBatch(self, thisBatchIndices, thisBatch=None):
         # Get the samples
-        xTrain, yTrain = self.data.getSamples('train', thisBatchIndices)
-        xTrain = xTrain.to(self.model.device)
-        yTrain = yTrain.to(self.model.device)
+        with self.profilePhase('dataFetch'):
+            if thisBatch is None:
+                if self.trainingOptions['transductive']:
+                    thisBatch = self.data.getTransductiveBatch('train', thisBatchIndices)
+                else:
+                    thisBatch = self.data.getBatch('train', thisBatchIndices)
+            xTrain, yTrain, targets = thisBatch
+            xTrain = xTrain.to(self.model.device, non_blocking=True)
+            yTrain = yTrain.to(self.model.device, non_blocking=True)
 
         # Start measuring time
         startTime = datetime.datetime.now()
 
-        # Reset gradients
-        self.model.archit.zero_grad()
+        with self.profilePhase('forward'):
+            # Reset gradients
+            self.model.archit.zero_grad()
 
-        # Obtain the output of the GNN
-        self.model.archit.targets = self.data.getTargets('train', thisBatchIndices)
-        yHatTrain = self.model.archit(xTrain)
-        self.model.archit.targets = None
+            # Obtain the output of the GNN
+            self.model.archit.targets = targets
+            yHatTrain = self.model.archit(xTrain)
+            self.model.archit.targets = None
 
         # Compute loss
         lossValueTrain = self.IL_loss(yHatTrain, yTrain)
 
         # Compute gradients
-        lossValueTrain.backward()
+        with self.profilePhase('backward'):
+            lossValueTrain.backward()
 
         # Optimize
-        self.model.optim.step()
+        with self.profilePhase('optimizerStep'):
+            self.optimizerStep()
 
         # Finish measuring time
         endTime = datetime.datetime.now()
@@ -704,14 +1319,27 @@ class dhgTrainer(sourceTrainer):
         #   same value, but detaches it from the gradient, so that no
         #   gradient operation is taken into account here.
         #   (Alternatively, we could use a with torch.no_grad():)
-        costTrain = self.data.evaluate(yHatTrain.data, yTrain)
+        with self.profilePhase('evaluate'):
+            costTrain = self.data.evaluate(yHatTrain.data, yTrain)
 
         return lossValueTrain.item(), costTrain.item(), timeElapsed
 
+    # Output of the architecture at the target nodes of the given samples of samplesType (without gradients)
+    def inferenceBatch(self, samplesType, thisBatchIndices):
+        xBatch, _ = self.data.getSamples(samplesType, thisBatchIndices)
+        self.model.archit.targets = self.data.getTargets(samplesType, thisBatchIndices)
+        yHat = self.model.archit(xBatch.to(self.model.device))
+        self.model.archit.targets = None
+        return yHat
+
     def validationStep(self):
 
         # Validation:
-        xValid, yValid = self.data.getSamples('valid')
+        if self.trainingOptions['transductive']:
+            xValid, yValid, targetsValid = self.data.getTransductiveBatch('valid')
+        else:
+            xValid, yValid = self.data.getSamples('valid')
+            targetsValid = self.data.getTargets('valid')
         xValid = xValid.to(self.model.device)
         yValid = yValid.to(self.model.device)
         integral_lipschitz_constant = self.trainingOptions['integral_lipschitz_constant']
@@ -723,10 +1351,14 @@ class dhgTrainer(sourceTrainer):
         # to obtain the validation accuracy are not taken into
         # account to update the learnable parameters.
         with torch.no_grad():
-            # Obtain the output of the GNN
-            self.model.archit.targets = self.data.getTargets('valid')
-            yHatValid = self.model.archit(xValid)
-            self.model.archit.targets = None
+            # Obtain the output of the GNN, in batches if the batch size was tuned
+            if self.trainingOptions['autoBatchSize']:
+                yHatValid = self.model.archit.forwardBatch(self.data, 'valid',
+                                                           batchSize=self.trainingOptions['evalBatchSize'])
+            else:
+                self.model.archit.targets = targetsValid
+                yHatValid = self.model.archit(xValid)
+                self.model.archit.targets = None
 
             # Use batches, for memory saving
             '''
@@ -769,6 +1401,18 @@ evaluateFlocking: evaluate a model using the flocking cost
 """
 
 
+# Output of the model at all the samples of samplesType: either from a single forward of the features of all the nodes
+# (transductive), or in batches of samples
+def dhgForward(model, data, samplesType, transductive=False, batchSize=100):
+    if not transductive:
+        return model.archit.forwardBatch(data, samplesType, batchSize=batchSize)
+    x, _, targets = data.getTransductiveBatch(samplesType)
+    model.archit.targets = targets
+    yHat = model.archit(x.to(model.device))
+    model.archit.targets = None
+    return yHat
+
+
 def dhgEvaluate(model, data, **kwargs):
     """
         evaluate: evaluate a model using classification error
@@ -778,6 +1422,9 @@ def dhgEvaluate(model, data, **kwargs):
             data (data class): a data class from the Utils.dataTools; it needs to
                 have a getSamples method and an evaluate method.
             doPrint (optional, bool): if True prints results
+            transductive (optional, bool): if True, all the test nodes are
+                classified from a single forward of the features of all the
+                nodes (data.getTransductiveBatch) instead of in batches
 
         Output:
             evalVars (dict): 'errorBest' contains the error rate for the best
@@ -795,6 +1442,10 @@ def dhgEvaluate(model, data, **kwargs):
         batchSize = kwargs['batchSize']
     else:
         batchSize = 100
+    if 'transductive' in kwargs.keys():
+        transductive = kwargs['transductive']
+    else:
+        transductive = False
 
     ########
     # DATA #
@@ -815,7 +1466,7 @@ def dhgEvaluate(model, data, **kwargs):
 
     with torch.no_grad():
         # Process the samples
-        yHatTest = model.archit.forwardBatch(data, 'test', batchSize=batchSize)
+        yHatTest = dhgForward(model, data, 'test', transductive, batchSize)
         # yHatTest is of shape
         #   testSize x numberOfClasses
         # We compute the error
@@ -842,7 +1493,7 @@ def dhgEvaluate(model, data, **kwargs):
 
     with torch.no_grad():
         # Process the samples
-        yHatTest = model.archit.forwardBatch(data, 'test', batchSize=batchSize)
+        yHatTest = dhgForward(model, data, 'test', transductive, batchSize)
         # yHatTest is of shape
         #   testSize x numberOfClasses
         # We compute the error
@@ -879,6 +1530,13 @@ def dhgEvaluate(model, data, **kwargs):
     return evalVars
 
 
+# Output of the model at the signals x, in batches of batchSize samples (all of them at once, if None)
+def sourceForward(model, x, batchSize=None):
+    if batchSize is None:
+        return model.archit(x)
+    return torch.cat([model.archit(x[start:start + batchSize]) for start in range(0, x.shape[0], batchSize)])
+
+
 def sourceEvaluate(model, data, **kwargs):
     """
     evaluate: evaluate a model using classification error
@@ -888,6 +1546,8 @@ def sourceEvaluate(model, data, **kwargs):
         data (data class): a data class from the Utils.dataTools; it needs to
             have a getSamples method and an evaluate method.
         doPrint (optional, bool): if True prints results
+        batchSize (optional, int): number of test samples in each forward (if
+            not given, all of them at once)
 
     Output:
         evalVars (dict): 'errorBest' contains the error rate for the best
@@ -901,6 +1561,10 @@ def sourceEvaluate(model, data, **kwargs):
         doSaveVars = kwargs['doSaveVars']
     else:
         doSaveVars = True
+    if 'batchSize' in kwargs.keys():
+        batchSize = kwargs['batchSize']
+    else:
+        batchSize = None
 
     ########
     # DATA #
@@ -921,7 +1585,7 @@ def sourceEvaluate(model, data, **kwargs):
 
     with torch.no_grad():
         # Process the samples
-        yHatTest = model.archit(xTest)
+        yHatTest = sourceForward(model, xTest, batchSize)
         # yHatTest is of shape
         #   testSize x numberOfClasses
         # We compute the error
@@ -944,7 +1608,7 @@ def sourceEvaluate(model, data, **kwargs):
 
     with torch.no_grad():
         # Process the samples
-        yHatTest = model.archit(xTest)
+        yHatTest = sourceForward(model, xTest, batchSize)
         # yHatTest is of shape
         #   testSize x numberOfClasses
         # We compute the error
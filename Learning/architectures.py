@@ -13,9 +13,12 @@ import torch.nn as nn
 # import torch.sparse
 import alegnn.utils.graphML as gml
 import sparseGraphML as spgml
+import partitionedGraphML as ppgml
 import alegnn.utils.graphTools
 from alegnn.utils.dataTools import changeDataType
 import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
 import math
 from opt_einsum import contract as sparse_einsum
 
@@ -64,10 +67,9 @@ class PoolCliqueToLine(nn.Module):
                 batch_size x dim_features x out_dim
     """
 
-    def __init__(self, incidenceMatrix, do_sparse):
+    def __init__(self, incidenceMatrix, do_sparse=False):
 
         super().__init__()
-        self.device = incidenceMatrix.device
         '''
         self.do_sparse = do_sparse
         if self.do_sparse:
@@ -78,11 +80,14 @@ class PoolCliqueToLine(nn.Module):
             self.Bt = incidenceMatrix.T
             self.Dinv = torch.sum(self.Bt, 1)**(-1)
         '''
-        self.Bt = incidenceMatrix.T
         self.nInputNodes = incidenceMatrix.shape[0]
         self.nOutputNodes = incidenceMatrix.shape[1]
-        self.edge_list = self.makeEdgeList(incidenceMatrix)
-        self.signal_step = 8
+        # Nonzero entries of the incidence matrix, so that the pooling only visits the (node, hyperedge) pairs.
+        # These are buffers, so they follow the module in .to() and the like.
+        nodeIndex, edgeIndex, values = spgml.incidenceIndex(incidenceMatrix)
+        self.register_buffer('nodeIndex', nodeIndex, persistent=False)
+        self.register_buffer('edgeIndex', edgeIndex, persistent=False)
+        self.register_buffer('values', values, persistent=False)
 
     def forward(self, x):
         # x should be of shape batchSize x dimNodeSignals x nInputNodes
@@ -104,13 +109,12 @@ class PoolCliqueToLine(nn.Module):
 
         # v, _ = torch.max(torch.einsum('bfn,nm->bfnm', x, self.B), dim=2)
 
-        v = torch.zeros((x.shape[0], x.shape[1], self.nOutputNodes), device=self.device)
         # for m in range(self.nOutputNodes):
         #    v[:, :, m], _ = torch.max(x[:, :, self.edge_list[m]], dim=2)
-        for b in range(x.shape[0]):
-            for k in range(x.shape[1] // self.signal_step):
-                v[b, k*self.signal_step : (k+1)*self.signal_step, :], _ = \
-                        torch.max(x[b, k*self.signal_step : (k+1)*self.signal_step, None] * self.Bt, dim=2)
+        # Rather than building the batchSize x dimNodeSignals x nInputNodes x nOutputNodes tensor, we only take the
+        # products at the nonzero entries of B, and reduce them into the hyperedges (including a 0, as the zero
+        # entries of x * B would).
+        v = spgml.incidencePool(x, self.nodeIndex, self.edgeIndex, self.values, self.nOutputNodes)
         # if self.do_sparse:
         #     v = torch.sparse.sum(x[:, :, None] * self.Bt, 3).to_dense() * self.Dinv
         # else:
@@ -118,17 +122,312 @@ class PoolCliqueToLine(nn.Module):
 
         return v
 
-    # Make an edge list from an incidence matrix
-    def makeEdgeList(self, B):
-        return [torch.where(B[:,m] > 0)[0].to(self.device) for m in range(self.nOutputNodes)]
-
     def extra_repr(self):
         reprString = "in_dim=%d, out_dim=%d, pooling between GSOs" % (
             self.nInputNodes, self.nOutputNodes)
         return reprString
 
 
+class ChebyshevGraphFilter(gml.GraphFilter):
+    """
+    ChebyshevGraphFilter Creates a (linear) layer that applies a graph filter
+        on the Chebyshev polynomials of the rescaled GSO S' = 2 S / lambda_max - I
+        instead of on the powers of S, i.e. y = sum_k h_k T_k(S') x + b. The
+        spectrum of S' is in [-1, 1] whatever the scale of S, so, unlike the
+        monomial taps of GraphFilter, the shifted signals do not blow up (or
+        vanish) as the number of filter taps grows.
+
+    Initialization:
+
+        ChebyshevGraphFilter(in_features, out_features, filter_taps,
+                             edge_features=1, bias=True)
+
+        Same as GraphFilter. The filter taps have the same shape (out_features
+        x edge_features x filter_taps x in_features), so the integral
+        Lipschitz terms and the constraints on them are handled alike.
+
+    Add graph shift operator:
+
+        ChebyshevGraphFilter.addGSO(GSO, lambdaMax = None) Before applying the
+        filter, we need to define the GSO (dense or sparse) and its largest
+        absolute eigenvalue lambdaMax, that rescales it. If lambdaMax is not
+        given, it is computed (in double precision) on the first forward; the
+        LocalGNN architectures give the one they cache for each of their GSOs.
+        The GSO is assumed to have a nonnegative spectrum (e.g. a Laplacian).
+
+    Forward call: same as GraphFilter.
+    """
+
+    def addGSO(self, S, lambdaMax=None):
+        super().addGSO(S)
+        self.lambdaMax = lambdaMax
+
+    def forward(self, x):
+        if self.lambdaMax is None:
+            self.lambdaMax = spectralRadius(self.S)
+        return spgml.chebyshevLSIGF(self.weight, self.S, x, self.lambdaMax, self.bias)
+
+    def extra_repr(self):
+        return super().extra_repr() + ", Chebyshev taps"
+
+
+# Output of a graph filter layer (GraphFilter or ChebyshevGraphFilter) over the GSO S, which need not be the GSO of the
+# layer (e.g. a subgraph of it), with the taps accumulated as the signal is shifted with shift(x, S)
+def accumulatedGraphFilter(layer, S, x, shift=spgml.graphShift):
+    if isinstance(layer, ChebyshevGraphFilter):
+        return spgml.chebyshevLSIGF(layer.weight, S, x, layer.lambdaMax, layer.bias, shift)
+    return spgml.accumulatedLSIGF(layer.weight, S, x, layer.bias, shift)
+
+
+# Integral Lipschitz terms of a graph filter layer over a GSO with spectral radius lambdaMax: for each tap, the
+# coefficient of that tap in lambda h'(lambda) at lambda = lambdaMax. For the monomial taps this is k lambdaMax^k, and
+# for the Chebyshev taps it is 2 k^2 (since T_k'(1) = k^2), whatever the scale of the GSO.
+def filterILTerms(layer, lambdaMax):
+    if isinstance(layer, ChebyshevGraphFilter):
+        taps = [2 * k ** 2 for k in range(layer.K)]
+    else:
+        taps = [0] + [k * lambdaMax ** k for k in range(1, layer.K)]
+    return torch.tensor(taps, dtype=layer.weight.dtype, device=layer.weight.device) \
+        .reshape(1, 1, layer.K, 1).expand(layer.F, layer.E, layer.K, layer.G)
+
+
+class FusedGraphFiltering(nn.Module):
+    """
+    FusedGraphFiltering: runs the graph filtering layers of a LocalGNN (the GFL
+        sequential of graph filters, nonlinearities, pooling layers and pooling
+        between GSOs) without the per layer overhead: the no-op pooling layers
+        are dropped, each graph filter is computed with the filter taps
+        accumulated as the signal is shifted (spgml.accumulatedLSIGF, or
+        spgml.chebyshevLSIGF for the Chebyshev graph filters) and
+        followed directly by its bias and nonlinearity, and the GSOs are taken
+        from buffers instead of being checked and re-added to each layer.
+        The forward has no data-dependent control flow, so it can be compiled
+        with torch.compile.
+
+    Initialization:
+
+        FusedGraphFiltering(GFL)
+
+        Inputs:
+            GFL (nn.Sequential): graph filtering layers of the architecture
+
+        Output:
+            torch.nn.Module with the same output as GFL.
+
+        Observation: The parameters stay in (and are trained through) the
+            layers of GFL; this module only keeps references to them, so they
+            are not duplicated in the state_dict. The GSOs are non-persistent
+            buffers, moved along with the module but not saved.
+
+    Forward call:
+
+        y = FusedGraphFiltering(x)
+
+        Inputs:
+            x (torch.tensor): input data; shape:
+                batch_size x dim_features x number_nodes
+
+        Outputs:
+            y (torch.tensor): same output as GFL(x)
+    """
+
+    def __init__(self, GFL):
+
+        super().__init__()
+        # Each stage is [layer, GSO index, nonlinearity] for graph filters and
+        # [layer, None, None] for the rest of the (non-trivial) layers.
+        # These are plain lists on purpose, so the layers are not registered
+        # (again) as submodules.
+        self.stages = []
+        GSOs = []
+        for layer in GFL:
+            if isinstance(layer, gml.GraphFilter):
+                # Layers that share a GSO share the buffer
+                index = [i for i in range(len(GSOs)) if GSOs[i] is layer.S]
+                if len(index) == 0:
+                    GSOs.append(layer.S)
+                    index = [len(GSOs) - 1]
+                    if isinstance(layer.S, spgml.FactoredGSO):
+                        # Not a tensor, but it is rebuilt (on the converted factors) along with this module anyway
+                        setattr(self, 'GSO%d' % index[0], layer.S)
+                    else:
+                        self.register_buffer('GSO%d' % index[0], layer.S, persistent=False)
+                self.stages.append([layer, index[0], None])
+            elif isinstance(layer, gml.NoPool):
+                continue
+            elif len(self.stages) > 0 and self.stages[-1][1] is not None and self.stages[-1][2] is None:
+                # The layer right after each graph filter is its nonlinearity
+                self.stages[-1][2] = layer
+            else:
+                self.stages.append([layer, None, None])
+        self.nGSOs = len(GSOs)
+
+    def forward(self, x):
+        for layer, index, sigma in self.stages:
+            if index is None:
+                x = layer(x)
+            else:
+                x = accumulatedGraphFilter(layer, getattr(self, 'GSO%d' % index), x)
+                if sigma is not None:
+                    x = sigma(x)
+        return x
+
+    def extra_repr(self):
+        reprString = "stages=%d, GSOs=%d, no-op pooling dropped" % (len(self.stages), self.nGSOs)
+        return reprString
+
+
+class PartitionedGraphFiltering(nn.Module):
+    """
+    PartitionedGraphFiltering: runs the graph filtering layers of a LocalGNN
+        (the GFL sequential) split across the processes (ranks) of the
+        torch.distributed process group, for expansions too large for a single
+        process. The nodes of each GSO are split into parts, one per rank, and
+        each rank only keeps the signal at its own nodes and the block of the
+        GSO that the output at them depends on. The missing values (the halo)
+        are exchanged between ranks before each shift of the signal
+        (ppgml.partitionedShift), and the pooling between GSOs becomes a
+        scatter of the node signals into the hyperedges of each rank
+        (ppgml.partitionedIncidencePool). The taps are accumulated as in
+        FusedGraphFiltering.
+
+    Initialization:
+
+        PartitionedGraphFiltering(GFL, rank, worldSize, parts = None)
+
+        Inputs:
+            GFL (nn.Sequential): graph filtering layers of the architecture
+            rank (int): rank of this process
+            worldSize (int): number of processes
+            parts (list of torch.tensor): part (rank) of each node of each GSO,
+                and of each hyperedge if the GFL ends with a pooling between
+                GSOs; if None, each GSO is split with ppgml.bandwidthPartition
+                (and the hyperedges with ppgml.hyperedgePartition). They have to
+                be the same on all ranks.
+
+        Output:
+            torch.nn.Module with the same output as GFL at the nodes of the
+            last GSO that this rank owns.
+
+        Observation: The parameters stay in (and are trained through) the
+            layers of GFL and are replicated on all ranks, so their gradients
+            have to be summed over the ranks after the backward
+            (ppgml.allReduceGradients). Only the pooling functions that keep
+            all the nodes (NoPool) are supported. The blocks of the GSOs and
+            incidence matrices are (non-persistent) buffers, so the layers of
+            GFL can drop the full ones once this module is built.
+
+    Forward call:
+
+        y = PartitionedGraphFiltering(x)
+
+        Inputs:
+            x (torch.tensor): input data at the owned nodes of the first GSO
+                (.ownedNodes[0]); shape:
+                batch_size x dim_features x number_owned_nodes
+
+        Outputs:
+            y (torch.tensor): output at the owned nodes of the last GSO, or
+                at the owned hyperedges if the GFL ends with a pooling between
+                GSOs (.ownedNodes[-1]); shape:
+                batch_size x dim_features x number_owned_nodes
+
+        Observation: The exchanges are collective, so all the ranks have to
+            run the forward (and the backward) with the same batch size and the
+            same layers.
+    """
+
+    def __init__(self, GFL, rank, worldSize, parts=None):
+
+        super().__init__()
+        assert not isinstance(GFL[0], PoolCliqueToLine), 'the input has to be on the first GSO'
+        self.rank = rank
+        self.worldSize = worldSize
+        # Same stages as FusedGraphFiltering, [layer, GSO index, nonlinearity] for graph filters and
+        # [layer, None, None] for the rest, but with [layer, pooling index, None] for the poolings between GSOs
+        self.stages = []
+        GSOs = []
+        pools = []
+        for layer in GFL:
+            if isinstance(layer, gml.GraphFilter):
+                index = [i for i in range(len(GSOs)) if GSOs[i] is layer.S]
+                if len(index) == 0:
+                    GSOs.append(layer.S)
+                    index = [len(GSOs) - 1]
+                self.stages.append([layer, index[0], None])
+            elif isinstance(layer, gml.NoPool):
+                continue
+            elif isinstance(layer, PoolCliqueToLine):
+                pools.append(layer)
+                self.stages.append([layer, len(pools) - 1, None])
+            elif len(self.stages) > 0 and self.stages[-1][2] is None \
+                    and isinstance(self.stages[-1][0], gml.GraphFilter):
+                # The layer right after each graph filter is its nonlinearity
+                self.stages[-1][2] = layer
+            else:
+                assert not hasattr(layer, 'addGSO'), 'only NoPool is supported as pooling function'
+                self.stages.append([layer, None, None])
+        # Pooling i goes from the nodes of GSO i to the ones of GSO i+1 (or, after the last GSO, to its hyperedges)
+        assert len(pools) in [len(GSOs) - 1, len(GSOs)], 'there has to be a graph filter on each GSO'
+        self.nGSOs = len(GSOs)
+        if parts is None:
+            self.parts = [ppgml.bandwidthPartition(S, worldSize) for S in GSOs]
+            if len(pools) == self.nGSOs:
+                self.parts.append(ppgml.hyperedgePartition(pools[-1].nodeIndex, pools[-1].edgeIndex,
+                                                           pools[-1].nInputNodes, pools[-1].nOutputNodes, worldSize))
+        else:
+            self.parts = [torch.as_tensor(p, dtype=torch.long).cpu() for p in parts]
+        # Only the block of each GSO (and the entries of each incidence matrix) that the owned nodes depend on is kept
+        self.shiftPlans = []
+        for i in range(self.nGSOs):
+            plan = ppgml.shiftPlan(GSOs[i], self.parts[i], rank).to(GSOs[i].device)
+            self.shiftPlans.append(plan)
+            self.register_buffer('GSO%d' % i, ppgml.localGSO(GSOs[i], plan), persistent=False)
+        self.poolPlans = []
+        for i in range(len(pools)):
+            plan = ppgml.incidencePlan(pools[i].nodeIndex, pools[i].edgeIndex, self.parts[i], self.parts[i + 1],
+                                       rank).to(pools[i].values.device)
+            self.poolPlans.append(plan)
+            self.register_buffer('poolValues%d' % i, pools[i].values[plan.entries], persistent=False)
+        # Nodes of each GSO (and hyperedges of the last pooling, if any) owned by this rank
+        self.ownedNodes = [plan.ownedOutputs for plan in self.shiftPlans]
+        if len(pools) == self.nGSOs:
+            self.ownedNodes.append(self.poolPlans[-1].ownedOutputs)
+
+    def forward(self, x):
+        for layer, index, sigma in self.stages:
+            if isinstance(layer, PoolCliqueToLine):
+                x = ppgml.partitionedIncidencePool(x, getattr(self, 'poolValues%d' % index), self.poolPlans[index])
+            elif index is None:
+                x = layer(x)
+            else:
+                plan = self.shiftPlans[index]
+                x = accumulatedGraphFilter(layer, getattr(self, 'GSO%d' % index), x,
+                                           lambda x, S: ppgml.partitionedShift(x, S, plan))
+                if sigma is not None:
+                    x = sigma(x)
+        return x
+
+    def _apply(self, fn, *args, **kwargs):
+        super()._apply(fn, *args, **kwargs)
+        # The plans are not tensors, so they are moved to the device the blocks are converted to
+        for i in range(self.nGSOs):
+            self.shiftPlans[i].to(getattr(self, 'GSO%d' % i).device)
+        for i in range(len(self.poolPlans)):
+            self.poolPlans[i].to(getattr(self, 'poolValues%d' % i).device)
+        return self
+
+    def extra_repr(self):
+        reprString = "rank=%d, world size=%d, GSOs=%d, owned nodes=%s, halo=%s" % (
+            self.rank, self.worldSize, self.nGSOs, [len(plan.ownedOutputs) for plan in self.shiftPlans],
+            [len(plan.inputs) - len(plan.ownedInputs) for plan in self.shiftPlans])
+        return reprString
+
+
 def changeDataTypeAndDevice(X, dataType, device):
+    # Factored GSOs are converted factor by factor
+    if isinstance(X, spgml.FactoredGSO):
+        return X.to(device=device, dtype=dataType)
     # Change data type and device as required
     X = changeDataType(X, dataType)
     if device is not None:
@@ -145,7 +444,201 @@ def getDataTypeAndDevice(X):
     return dataType, device
 
 
-class LocalGNNCliqueLine(nn.Module):
+# Largest absolute eigenvalue of a (symmetric) GSO, dense, sparse or factored, over all its edge features. The
+# eigenvalues are always computed in double precision, whatever the precision the GSO is kept in. Sparse GSOs larger
+# than spgml.denseSpectralSize nodes are never formed: only the largest eigenvalue is computed, with Lanczos (eigsh),
+# as for the factored ones.
+def spectralRadius(S):
+    if isinstance(S, spgml.FactoredGSO):
+        return S.spectralRadius()
+    N = S.shape[-1]
+    if S.is_sparse and N > spgml.denseSpectralSize:
+        S = S.coalesce()
+        indices = S.indices().cpu().numpy()
+        values = S.values().detach().cpu().numpy().astype(np.float64)
+        if S.dim() == 2:
+            indices = np.vstack((np.zeros(indices.shape[1], dtype=indices.dtype), indices))
+        radius = 0.
+        for e in np.unique(indices[0]):
+            feature = indices[0] == e
+            S_e = scipy.sparse.csr_matrix((values[feature], (indices[1][feature], indices[2][feature])), shape=(N, N))
+            eigenvalues = scipy.sparse.linalg.eigsh(S_e, k=1, which='LM', tol=1e-10, return_eigenvectors=False)
+            radius = max(radius, float(np.max(np.abs(eigenvalues))))
+        return radius
+    if S.is_sparse:
+        S = S.to_dense()
+    return torch.max(torch.abs(torch.linalg.eigvalsh(S.to(torch.float64)))).item()
+
+
+class GraphStructureModule(nn.Module):
+    """
+    GraphStructureModule: base class of the LocalGNN architectures, that keeps
+        the graph structure (GSOs, incidence matrices and the terms for the
+        integral Lipschitz constant) as buffers of the module instead of plain
+        lists of tensors. This way they follow the module in .to(), .double()
+        and the like, and the GSOs can be saved in (and loaded from) the
+        state_dict if wanted.
+
+    Graph structure:
+
+        .registerGraphStructure(GSOs, incidenceMatrices, persistent = False):
+        registers the GSOs (list of edge_features x number_nodes x number_nodes
+        tensors, dense or sparse) as the buffers GSO0, GSO1, ... and the
+        incidence matrices (list of number_nodes x number_hyperedges tensors)
+        as the buffers incidence0, incidence1, ... If persistent is False, they
+        are left out of the state_dict, since they are given again when the
+        architecture is created. The factored GSOs (spgml.FactoredGSO) are not
+        tensors, so their factors are registered instead (as GSO0_incidence,
+        GSO0_weights, ...), and the GSO is rebuilt from them when asked for.
+
+        .S, .B, .IL_terms: lists of the registered GSOs, incidence matrices and
+        integral Lipschitz terms (read only, use registerGraphStructure and
+        setILTerms to change them).
+
+        .linkGSOs(): adds the current GSO buffers to each layer of the GFL
+        sequential that has an addGSO method, counting the GSOs through the
+        PoolCliqueToLine layers between them. This is called after each
+        .to() (or any other ._apply()), so there is no need to re-add the
+        GSOs to the layers by hand. The Chebyshev graph filters also get the
+        spectral radius of their GSO.
+
+        .getSpectralRadius(i): largest absolute eigenvalue of GSO i, computed
+        (in double precision) the first time it is asked for, and kept until
+        the graph structure is registered again.
+
+        .releaseGraphStructure(): drops the GSOs and incidence matrices, both
+        the buffers and the references to them in the layers of the GFL
+        sequential, once they are only needed through the blocks kept by the
+        partitioned graph filtering layers. The spectral radii are computed
+        before, so the integral Lipschitz terms can still be built. They are
+        back after the graph structure is registered again.
+
+    Precision:
+
+        The GSOs and incidence matrices follow the precision of the module, so
+        .to(torch.float32) runs the whole architecture in single precision. The
+        spectral radius of the GSOs (for the integral Lipschitz terms) is always
+        computed in double precision.
+
+        .enableAutocast(dataType = torch.bfloat16): runs the forward under
+        torch.autocast with the given (lower precision) data type, on whichever
+        device the input is. The parameters and GSOs are kept in their own
+        precision, and the output is returned in the precision of the
+        parameters, so that the loss is computed as usual.
+    """
+
+    # Data type the forward runs in under torch.autocast, if enabled
+    autocastDtype = None
+    # Whether the GSOs and incidence matrices were dropped, see releaseGraphStructure
+    graphStructureReleased = False
+
+    def registerGraphStructure(self, GSOs, incidenceMatrices, persistent=False):
+        self.persistentGSOs = persistent
+        self.graphStructureReleased = False
+        self.nGSOs = len(GSOs)
+        # Computed on demand, see getSpectralRadius
+        self.spectralRadii = [None] * self.nGSOs
+        self.factoredGSOs = [isinstance(GSO, spgml.FactoredGSO) for GSO in GSOs]
+        for i in range(self.nGSOs):
+            if self.factoredGSOs[i]:
+                for name, factor in GSOs[i].factors().items():
+                    self.register_buffer('GSO%d_%s' % (i, name), factor, persistent=persistent)
+            else:
+                self.register_buffer('GSO%d' % i, GSOs[i], persistent=persistent)
+        self.nIncidenceMatrices = len(incidenceMatrices)
+        for i in range(self.nIncidenceMatrices):
+            self.register_buffer('incidence%d' % i, incidenceMatrices[i], persistent=persistent)
+
+    def setILTerms(self, ILTerms):
+        # These are derived from the GSOs, so they are never saved
+        self.nILTerms = len(ILTerms)
+        for i in range(self.nILTerms):
+            self.register_buffer('ILTerms%d' % i, ILTerms[i], persistent=False)
+
+    # GSO i, rebuilt from its (converted) factors if it is factored
+    def getGSO(self, i):
+        if self.factoredGSOs[i]:
+            return spgml.FactoredGSO(**{name: getattr(self, 'GSO%d_%s' % (i, name))
+                                        for name in ['incidence', 'incidenceT', 'weights', 'scale', 'diagonal']})
+        return getattr(self, 'GSO%d' % i)
+
+    @property
+    def S(self):
+        return [self.getGSO(i) for i in range(self.nGSOs)]
+
+    @property
+    def B(self):
+        return [getattr(self, 'incidence%d' % i) for i in range(self.nIncidenceMatrices)]
+
+    @property
+    def IL_terms(self):
+        return [getattr(self, 'ILTerms%d' % i) for i in range(self.nILTerms)]
+
+    def enableAutocast(self, dataType=torch.bfloat16):
+        self.autocastDtype = dataType
+
+    # Output of splitForward (the readout only), under autocast if enabled
+    def autocastForward(self, x):
+        if self.autocastDtype is None:
+            output, _ = self.splitForward(x)
+            return output
+        with torch.autocast(device_type=x.device.type, dtype=self.autocastDtype):
+            output, _ = self.splitForward(x)
+        return output.to(next(self.parameters()).dtype)
+
+    def getSpectralRadius(self, i):
+        if self.spectralRadii[i] is None:
+            self.spectralRadii[i] = spectralRadius(self.getGSO(i))
+        return self.spectralRadii[i]
+
+    # Layers of the GFL sequential that run on a GSO (those with an addGSO method), along with the index of that GSO
+    def gsoLayers(self):
+        # If the GFL starts by pooling between GSOs, the first layers run on the first GSO only after that pooling
+        i = -1 if isinstance(self.GFL[0], PoolCliqueToLine) else 0
+        for layer in self.GFL:
+            if isinstance(layer, PoolCliqueToLine):
+                i += 1
+            elif hasattr(layer, 'addGSO'):
+                yield i, layer
+
+    def linkGSOs(self):
+        S = self.S
+        for i, layer in self.gsoLayers():
+            if isinstance(layer, ChebyshevGraphFilter):
+                layer.addGSO(S[i], self.getSpectralRadius(i))
+            else:
+                layer.addGSO(S[i])
+
+    # The spectral radii are computed before the GSOs are dropped, since the integral Lipschitz terms need them
+    def releaseGraphStructure(self):
+        for i in range(self.nGSOs):
+            self.getSpectralRadius(i)
+        for name in [name for name, _ in self.named_buffers(recurse=False)
+                     if name.startswith('GSO') or name.startswith('incidence')]:
+            setattr(self, name, None)
+        for layer in self.GFL:
+            if isinstance(layer, PoolCliqueToLine):
+                layer.nodeIndex, layer.edgeIndex, layer.values = None, None, None
+            elif isinstance(layer, gml.GraphFilter):
+                layer.S = None
+        self.graphStructureReleased = True
+
+    def _apply(self, fn, *args, **kwargs):
+        # The fused layers only keep (non-persistent) references to the GSOs, so instead of converting them as well,
+        # they are rebuilt on the converted GSOs
+        fused = getattr(self, 'fusedGFL', None) is not None
+        if fused:
+            self.fusedGFL = None
+        super()._apply(fn, *args, **kwargs)
+        # Once released, the graph structure is only left in the partitioned layers, converted along with the rest
+        if not self.graphStructureReleased:
+            self.linkGSOs()
+        if fused:
+            self.enableFusedForward(self.compileFused)
+        return self
+
+
+class LocalGNNCliqueLine(GraphStructureModule):
     """
     LocalGNN: implement the selection GNN architecture where all operations are
         implemented locally, i.e. by means of neighboring exchanges only. More
@@ -210,6 +703,15 @@ class LocalGNNCliqueLine(nn.Module):
                 'perm' + order in Utils.graphTools that takes as input the GSO
                 and returns a new GSO ordered by the specified criteria and
                 an order array
+            persistentGSOs (bool, default = False): the GSOs and incidence
+                matrices are registered as buffers (see GraphStructureModule);
+                if True, they are also saved in the state_dict. The GSOs can be
+                sparse, in which case the fused graph filtering layers are used.
+            filterTypes (list of string or None, default = None): type of the
+                graph filters on each GSO, 'monomial' (GraphFilter, taps on
+                the powers of the GSO) or 'chebyshev' (ChebyshevGraphFilter,
+                taps on the Chebyshev polynomials of the rescaled GSO, stable
+                for a large number of filter taps). If None, all are monomial.
 
         Output:
             nn.Module with a Local GNN architecture with the above specified
@@ -252,12 +754,35 @@ class LocalGNNCliqueLine(nn.Module):
         isolate the effect of the graph convolutions from the effect of the
         readout layer.
 
+        >> Obs.: If targets are given, the outputs of the graph filtering
+            layers at the targets are gathered before the readout layer, so
+            only those go through it.
+
         y = .singleNodeForward(x, nodes): outputs the value of the last layer
         at a single node. x is the usual input of shape batchSize x dimFeatures
         x numberNodes. nodes is either a single node (int) or a collection of
         nodes (list or numpy.array) of length batchSize, where for each element
         in the batch, we get the output at the single specified node. The
         output y is of shape batchSize x dimReadout[-1].
+
+        .enableReceptiveFieldPruning(): from then on, when targets are given,
+        the graph filtering layers after the last pooling between GSOs only
+        run on the subgraph induced by the nodes within reach of the targets
+        (as many hops as filter taps, minus one, on those layers). The output
+        at the targets is the same, but yGFL from .splitForward() is only
+        given at those nodes. Requires NoPool as the pooling function.
+
+        .enableSubgraphSampling(): same as above, but for all the graph
+        filtering layers: the receptive field of the targets is followed back
+        through each pooling between GSOs (through the incidence matrices)
+        and each block of layers only runs on the subgraph induced by it, so
+        the cost of the forward does not depend on the size of the graphs.
+
+        .enableFusedForward(compile = False): runs the graph filtering layers
+        through a FusedGraphFiltering module from then on (same output, same
+        parameters, without the no-op pooling layers and the per layer
+        overhead). If compile is True (and torch.compile is available), the
+        fused module is also compiled.
     """
 
     def __init__(self,
@@ -270,7 +795,7 @@ class LocalGNNCliqueLine(nn.Module):
                  # MLP in the end
                  dimReadout,
                  # Structure
-                 GSOs, incidence_matrices, do_sparse=False, targets=None):
+                 GSOs, incidence_matrices, do_sparse=False, targets=None, persistentGSOs=False, filterTypes=None):
         # Initialize parent:
         super().__init__()
         # dimSignals should be a list and of size 1 more than nFilter taps.
@@ -288,12 +813,9 @@ class LocalGNNCliqueLine(nn.Module):
                 assert GSO.shape[0] == GSO.shape[1]
                 GSOs[i] = torch.unsqueeze(GSO, axis=0)  # 1 x N x N
             else:
-                assert GSO.shape[0] == GSO.shape[1]  # E x N x N
+                assert GSO.shape[1] == GSO.shape[2]  # E x N x N
             if i < numGSOs - 1:
                 B = incidence_matrices[i]
-                if B.is_sparse:
-                    self.B_is_sparse[i] = True
-                    B = B.coalesce()
                 assert B.ndim == 2 and B.shape[0] == GSO.shape[1]  # N x M
         # nSelectedNodes should be a list of size nFilterTaps, since the number
         # of nodes in the first layer is always the size of the graph
@@ -305,24 +827,33 @@ class LocalGNNCliqueLine(nn.Module):
         # poolingSize also has to be a list of the same size
         for i in range(numGSOs):
             assert len(poolingSize[i]) == len(nFilterTaps[i])
+        # One type of graph filter for each GSO
+        if filterTypes is None:
+            filterTypes = ['monomial'] * numGSOs
+        assert len(filterTypes) == numGSOs
+        for filterType in filterTypes:
+            assert filterType in ['monomial', 'chebyshev']
         # Store the values (using the notation in the paper):
         self.L = [len(nTaps) for nTaps in nFilterTaps]  # Number of graph filtering layers
         self.F = [dims for dims in dimSignals]  # Features
         self.K = [nTaps for nTaps in nFilterTaps]  # Filter taps
+        self.filterTypes = filterTypes  # Monomial or Chebyshev taps
         self.E = [GSO.shape[0] for GSO in GSOs]  # Number of edge features
         # For the incidence matrices
-        self.B = []
+        B = []
         # For the GSOs
-        self.S = []
+        S = []
         for i in range(numGSOs):
-            self.S.append(GSOs[i])
-            if 'torch' not in repr(self.S[i].dtype):
-                self.S[i] = torch.tensor(self.S[i])
+            S.append(GSOs[i])
+            if 'torch' not in repr(S[i].dtype):
+                S[i] = torch.tensor(S[i])
             # Permute the incidence matrices to match the GSOs
             if i < numGSOs - 1:
-                self.B.append(incidence_matrices[i])
-                if 'torch' not in repr(self.B[i].dtype):
-                    self.B[i] = torch.tensor(self.B[i])
+                B.append(incidence_matrices[i])
+                if 'torch' not in repr(B[i].dtype):
+                    B[i] = torch.tensor(B[i])
+        # Both are kept as buffers (only saved in the state_dict if persistentGSOs is True)
+        self.registerGraphStructure(S, B, persistentGSOs)
 
         self.alpha = [poolSizes for poolSizes in poolingSize]
         self.N = [[GSOs[i].shape[1]] + nSelectedNodes[i] for i in range(numGSOs)]  # Number of nodes
@@ -343,9 +874,10 @@ class LocalGNNCliqueLine(nn.Module):
         offset = 0
         for i in range(numGSOs):
             for l in range(self.L[i]):
-                # \\ Graph filtering stage:
-                gfl.append(gml.GraphFilter(self.F[i][l], self.F[i][l + 1], self.K[i][l],
-                                               self.E[i], self.bias))
+                # \\ Graph filtering stage (on the powers of the GSO, or on its Chebyshev polynomials):
+                graphFilter = ChebyshevGraphFilter if self.filterTypes[i] == 'chebyshev' else gml.GraphFilter
+                gfl.append(graphFilter(self.F[i][l], self.F[i][l + 1], self.K[i][l],
+                                       self.E[i], self.bias))
                 # There is a 3*l below here, because we have three elements per
                 # layer: graph filter, nonlinearity and pooling, so after each layer
                 # we're actually adding elements to the (sequential) list.
@@ -363,6 +895,16 @@ class LocalGNNCliqueLine(nn.Module):
                 offset += 3*self.L[i] + 1
         # And now feed them into the sequential
         self.GFL = nn.Sequential(*gfl)  # Graph Filtering Layers
+        # The Chebyshev graph filters take the (cached) spectral radius of their GSO
+        self.linkGSOs()
+        # Fused graph filtering layers, only used if enableFusedForward() is called
+        self.fusedGFL = None
+        self.compileFused = False
+        # First block of layers (between poolings between GSOs) that only runs on the receptive field of the targets,
+        # only used if enableReceptiveFieldPruning() or enableSubgraphSampling() are called
+        self.firstPrunedBlock = None
+        # Partitioned graph filtering layers, only used if enablePartitionedForward() is called
+        self.partitionedGFL = None
         # \\\ MLP (Fully Connected Layers) \\\
         fc = []
         if len(self.dimReadout) > 0:  # Maybe we don't want to readout anything
@@ -386,6 +928,9 @@ class LocalGNNCliqueLine(nn.Module):
         # so we finally have the architecture.
         # Lastly, for efficiency we pre-compute some terms for computing the integral Lipschitz constant
         self.construct_IL_terms()
+        # The graph filters of GFL only take dense GSOs, sparse ones are handled by the fused layers
+        if any([GSO.is_sparse for GSO in self.S]):
+            self.enableFusedForward()
 
     def changeGSO(self, GSOs, Bs, nSelectedNodes=[], poolingSize=[]):
 
@@ -401,23 +946,33 @@ class LocalGNNCliqueLine(nn.Module):
                 GSOs[i] = torch.unsqueeze(GSO, axis=0)  # 1 x N x N
             else:
                 assert GSO.shape[1] == GSO.shape[2]  # E x N x N
-            if i < numGSOs - 1:
+            if i < len(Bs):
                 B = Bs[i]
-                assert B.ndim == 2 and B.shape[0] == GSO.shape[0]  # N x M
+                assert B.ndim == 2 and B.shape[0] == GSOs[i].shape[1]  # N x M
 
         # Loop through all GSOs provided
+        S = []
+        B = []
         for i in range(numGSOs):
             # Get dataType and device of the current GSO, so when we replace it, it
-            # is still located in the same type and the same device.
-            dataType, device = getDataTypeAndDevice(self.S[i])
-            # Reorder the new GSO
-            self.S[i], self.order[i] = self.permFunction(GSOs[i])
+            # is still located in the same type and the same device (the ones of the
+            # parameters, if the GSOs were released for the partitioned forward).
+            if self.graphStructureReleased:
+                dataType, device = getDataTypeAndDevice(next(self.parameters()))
+            else:
+                dataType, device = getDataTypeAndDevice(self.S[i])
             # Change data type and device as required
-            self.S[i] = changeDataTypeAndDevice(self.S[i], dataType, device)
-            if i < numGSOs - 1:
-                dataType, device = getDataTypeAndDevice(self.B[i])
-                self.B[i] = B[i][self.order, :]
-                self.B[i] = changeDataTypeAndDevice(self.B[i], dataType, device)
+            S.append(changeDataTypeAndDevice(GSOs[i], dataType, device))
+            if i < len(Bs):
+                if not self.graphStructureReleased:
+                    dataType, device = getDataTypeAndDevice(self.B[i])
+                B.append(changeDataTypeAndDevice(Bs[i], dataType, device))
+        # Replace the buffers
+        self.registerGraphStructure(S, B, self.persistentGSOs)
+        # And the incidence matrices of the poolings between GSOs
+        pools = [l for l in range(len(self.GFL)) if isinstance(self.GFL[l], PoolCliqueToLine)]
+        for i in range(len(pools)):
+            self.GFL[pools[i]] = PoolCliqueToLine(self.B[i])
 
         # Before making decisions, check if there is a new poolingSize list
         if len(poolingSize) > 0:
@@ -449,23 +1004,27 @@ class LocalGNNCliqueLine(nn.Module):
                 offset += 3*self.L[i] + 1
 
         # And update the GSOs
-        offset = 0
-        for i in range(numGSOs):
-            for l in range(self.L[i]):
-                self.GFL[3 * l + offset].addGSO(self.S[i])  # Graph convolutional layer
-                self.GFL[3 * l + 2 + offset].addGSO(self.S[i])
-            offset += 3 * self.L[i] + 1
+        self.linkGSOs()
+        # The fused layers have to pick up the new GSOs as well
+        if self.fusedGFL is not None:
+            self.enableFusedForward(self.compileFused)
+        # And so does the receptive field of the targets
+        if self.firstPrunedBlock is not None:
+            self.constructReceptiveFields()
+        # And the blocks of the GSOs kept by this rank
+        if self.partitionedGFL is not None:
+            self.enablePartitionedForward(self.partitionedGFL.rank, self.partitionedGFL.worldSize,
+                                          self.partitionedGFL.parts)
         # Lastly, for efficiency we pre-compute some terms for computing the integral Lipschitz constant
         self.construct_IL_terms()
 
     # Construct terms required to compute the integral Lipschitz constant ahead of time for efficiency
     def construct_IL_terms(self):
-        self.IL_terms = []
-        for layer in self.GFL:
+        IL_terms = []
+        for i, layer in self.gsoLayers():
             if isinstance(layer, gml.GraphFilter):
-                lambda_max = torch.max(torch.abs(torch.linalg.eigvalsh(layer.S)))
-                self.IL_terms.append(torch.Tensor([0] + [k * lambda_max ** k for k in range(1, layer.K)])
-                                        .repeat(layer.F, layer.E, layer.G).reshape(layer.F, layer.E, layer.K, layer.G))
+                IL_terms.append(filterILTerms(layer, self.getSpectralRadius(i)))
+        self.setILTerms(IL_terms)
 
     # Ensure the integral Lipschitz constant constraint is not violated.
     # Otherwise, the loss could be NaN (due to the log barrier penalties)
@@ -514,6 +1073,150 @@ class LocalGNNCliqueLine(nn.Module):
         else:
             return torch.max(C_tensor)
 
+    # Use the fused (and possibly compiled) graph filtering layers from now on
+    def enableFusedForward(self, compile=False):
+        self.fusedGFL = FusedGraphFiltering(self.GFL)
+        self.compileFused = compile and hasattr(torch, 'compile')
+        if self.compileFused:
+            self.fusedGFL.compile()
+
+    # Run the graph filtering layers, fused if enabled
+    def graphFiltering(self, x):
+        if self.fusedGFL is None:
+            return self.GFL(x)
+        else:
+            return self.fusedGFL(x)
+
+    # From now on, split the graph filtering layers across the ranks of the (already initialized) torch.distributed
+    # process group, see PartitionedGraphFiltering. Each rank takes the whole input, but only computes (and returns) the
+    # output at the nodes of the last GSO that it owns: all the outputs if there are no targets, or the outputs at the
+    # targets given by ownedTargetMask otherwise, so that the loss has to be computed on those. The parameters are
+    # replicated, so, for the same update as a single process, each rank has to weight its loss by its share of the
+    # targets, and the gradients have to be summed over the ranks (ppgml.allReduceGradients) before the optimizer step.
+    # All the ranks have to run the forward and the backward, even if they have no targets. Each rank only keeps the
+    # blocks of the GSOs it needs: the full GSOs (and the fused layers on them) are dropped, until changeGSO is called.
+    def enablePartitionedForward(self, rank=None, worldSize=None, parts=None):
+        assert self.firstPrunedBlock is None, 'the partitioned forward does not prune the receptive field'
+        rank = torch.distributed.get_rank() if rank is None else rank
+        worldSize = torch.distributed.get_world_size() if worldSize is None else worldSize
+        self.partitionedGFL = PartitionedGraphFiltering(self.GFL, rank, worldSize, parts)
+        self.fusedGFL = None
+        self.releaseGraphStructure()
+
+    # Which of the targets (1D, nodes, or 2D, (sample, node) pairs) are at nodes of the last GSO owned by this rank, in
+    # the partitioned forward
+    def ownedTargetMask(self, targets):
+        targets = torch.as_tensor(targets)
+        nodes = targets if targets.ndim == 1 else targets[:, 1]
+        parts = self.partitionedGFL.parts[-1]
+        return parts[nodes.cpu()] == self.partitionedGFL.rank
+
+    # Runs the partitioned graph filtering layers on the input at the nodes of the first GSO owned by this rank
+    def partitionedForward(self, x):
+        x = x.index_select(2, self.partitionedGFL.ownedNodes[0])
+        if x.is_sparse:
+            x = x.to_dense()
+        return self.partitionedGFL(x)
+
+    # Splits the GFL into blocks of layers between the poolings between GSOs, and keeps, for each block, the neighbors
+    # that its graph filters shift the signal from and how many hops they reach, as well as the entries of the incidence
+    # matrix of each pooling between GSOs sorted by hyperedge, so that the receptive field of a set of targets can be
+    # found visiting only the nodes in it
+    def constructReceptiveFields(self):
+        assert self.rho is gml.NoPool, 'receptive field pruning needs the nodes to be kept by the pooling layers'
+        self.blocks = []  # First and last (plus one) layer of each block
+        start = 0
+        for l in range(len(self.GFL)):
+            if isinstance(self.GFL[l], PoolCliqueToLine):
+                self.blocks.append([start, l])
+                start = l + 1
+        self.blocks.append([start, len(self.GFL)])
+        self.blockHops = []
+        for b in range(len(self.blocks)):
+            filters = [layer for layer in self.GFL[self.blocks[b][0]:self.blocks[b][1]]
+                       if isinstance(layer, gml.GraphFilter)]
+            self.blockHops.append(sum([layer.K - 1 for layer in filters]))
+            if len(filters) > 0:
+                pointers, neighbors = spgml.shiftNeighbors(filters[0].S)
+                self.register_buffer('neighborPointers%d' % b, pointers, persistent=False)
+                self.register_buffer('neighbors%d' % b, neighbors, persistent=False)
+            if b > 0:
+                # The pooling right before the block
+                pool = self.GFL[self.blocks[b][0] - 1]
+                entries = torch.argsort(pool.edgeIndex, stable=True)
+                self.register_buffer('poolPointers%d' % b,
+                                     spgml.compressedPointers(pool.edgeIndex[entries], pool.nOutputNodes),
+                                     persistent=False)
+                self.register_buffer('poolEntries%d' % b, entries, persistent=False)
+
+    # From now on, when targets are given, only run the graph filtering layers after the last pooling between GSOs
+    # on the nodes that are within reach of the targets
+    def enableReceptiveFieldPruning(self):
+        self.constructReceptiveFields()
+        self.firstPrunedBlock = len(self.blocks) - 1
+
+    # From now on, when targets are given, run all the layers on the subgraphs (of each GSO) that the output at the
+    # targets depends on, so that the cost of the forward depends on the size of the neighborhoods of the targets only
+    def enableSubgraphSampling(self):
+        self.constructReceptiveFields()
+        self.firstPrunedBlock = 0
+
+    # Nodes of each block (from the first pruned one) that the output at the given nodes of the last one depends on,
+    # along with the entries of the incidence matrix of the pooling before each block that connect them
+    def sampleReceptiveField(self, nodes):
+        blockNodes = [None] * len(self.blocks)
+        poolEntries = [None] * len(self.blocks)
+        for b in range(len(self.blocks) - 1, self.firstPrunedBlock - 1, -1):
+            if self.blockHops[b] > 0:
+                nodes = spgml.khopNeighborhood(getattr(self, 'neighborPointers%d' % b), getattr(self, 'neighbors%d' % b),
+                                               nodes, self.blockHops[b])
+            else:
+                nodes = torch.unique(nodes)
+            blockNodes[b] = nodes
+            if b > self.firstPrunedBlock:
+                # Nodes pooled into the hyperedges reached
+                positions, _ = spgml.compressedNeighbors(getattr(self, 'poolPointers%d' % b), nodes)
+                poolEntries[b] = getattr(self, 'poolEntries%d' % b)[positions]
+                nodes = self.GFL[self.blocks[b][0] - 1].nodeIndex[poolEntries[b]]
+        return blockNodes, poolEntries
+
+    # Runs the graph filtering layers only on the nodes needed to compute the output at the nodes given (the same for
+    # all the samples in the batch): the blocks of layers from the first pruned one on run on the subgraph induced by
+    # their receptive field. Returns the output at the receptive field of the last block
+    # (batchSize x dimFeatures x nNodes) and, for each of the given nodes, its position in it.
+    def prunedGraphFiltering(self, x, nodes):
+        blockNodes, poolEntries = self.sampleReceptiveField(nodes)
+        if x.is_sparse and self.firstPrunedBlock > 0:
+            x = x.to_dense()
+        for b in range(len(self.blocks)):
+            start, end = self.blocks[b]
+            if b > 0:
+                pool = self.GFL[start - 1]
+                if b <= self.firstPrunedBlock:
+                    x = pool(x)
+                else:
+                    # Pool from the nodes of the previous block into the ones of this block
+                    entries = poolEntries[b]
+                    x = spgml.incidencePool(x, torch.searchsorted(blockNodes[b - 1], pool.nodeIndex[entries]),
+                                            torch.searchsorted(blockNodes[b], pool.edgeIndex[entries]),
+                                            pool.values[entries], blockNodes[b].shape[0])
+            if b == self.firstPrunedBlock:
+                x = x.index_select(2, blockNodes[b])
+                if x.is_sparse:
+                    x = x.to_dense()
+            S = None
+            for layer in self.GFL[start:end]:
+                if isinstance(layer, gml.GraphFilter):
+                    if b < self.firstPrunedBlock:
+                        S = layer.S
+                    elif S is None:
+                        # All the filters in a block share the same GSO
+                        S = spgml.inducedGSO(layer.S, blockNodes[b])
+                    x = accumulatedGraphFilter(layer, S, x)
+                elif not isinstance(layer, gml.NoPool):
+                    x = layer(x)
+        return x, torch.searchsorted(blockNodes[-1], nodes.contiguous())
+
     def splitForward(self, x):
 
         # Now we compute the forward call
@@ -521,32 +1224,56 @@ class LocalGNNCliqueLine(nn.Module):
         assert x.shape[1] == self.F[0][0]
         assert x.shape[2] == self.N[0][0]
 
-        # Convert to dense, if required
-        if x.is_sparse:
-            x = x.to_dense()
-        # Let's call the graph filtering layer
-        yGFL = self.GFL(x)
-        # Change the order, for the readout
-        y = yGFL.permute(0, 2, 1)  # B x N[-1] x F[-1]
-        # And, feed it into the Readout layer
-        y = self.Readout(y)  # B x N[-1] x dimReadout[-1]
-        # Reshape and return
-        # return y.permute(0, 2, 1), yGFL
-        if self.targets is not None:
-            if self.targets.ndim == 1:
-                return y[:, self.targets, :], yGFL
-            elif self.targets.ndim == 2:
-                return y[self.targets[:,0], self.targets[:,1], :], yGFL
+        if self.targets is None:
+            # Convert to dense, if required
+            if x.is_sparse:
+                x = x.to_dense()
+            # Let's call the graph filtering layer
+            if self.partitionedGFL is not None:
+                # Only at the nodes owned by this rank, B x F[-1] x nOwnedNodes
+                yGFL = self.partitionedForward(x)
             else:
-                raise ValueError('Targets must be 1D or 2D array/tensor')
-        else:
+                yGFL = self.graphFiltering(x)
+            # Change the order, for the readout
+            y = yGFL.permute(0, 2, 1)  # B x N[-1] x F[-1]
+            # And, feed it into the Readout layer
+            y = self.Readout(y)  # B x N[-1] x dimReadout[-1]
             return y, yGFL
-        # IF PERMUTED: B x dimReadout[-1] x N[-1], B x dimFeatures[-1] x N[-1]
+        # The readout is applied at each node separately, so the outputs of the graph filtering layers at the targets
+        # are gathered first, and only those go through the readout layer
+        targets = torch.as_tensor(self.targets, device=x.device)
+        if targets.ndim == 1:
+            # The same nodes for all the samples
+            samples, nodes = None, targets
+        elif targets.ndim == 2:
+            # One (sample, node) pair per target
+            samples, nodes = targets[:, 0], targets[:, 1]
+        else:
+            raise ValueError('Targets must be 1D or 2D array/tensor')
+        if self.firstPrunedBlock is not None:
+            # yGFL is only the output at the receptive field of the targets, B x F[-1] x nReceptiveField
+            yGFL, nodes = self.prunedGraphFiltering(x, nodes)
+        elif self.partitionedGFL is not None:
+            # yGFL is only the output at the nodes owned by this rank, and only the targets there are kept
+            yGFL = self.partitionedForward(x)
+            owned = self.ownedTargetMask(targets).to(x.device)
+            if samples is not None:
+                samples = samples[owned]
+            nodes = torch.searchsorted(self.partitionedGFL.ownedNodes[-1], nodes[owned].contiguous())
+        else:
+            if x.is_sparse:
+                x = x.to_dense()
+            yGFL = self.graphFiltering(x)
+        if samples is None:
+            y = yGFL[:, :, nodes].permute(0, 2, 1)  # B x nTargets x F[-1]
+        else:
+            y = yGFL[samples, :, nodes]  # nTargets x F[-1]
+        return self.Readout(y), yGFL
 
     # Splits samples into batches and runs forward on all of them
     def forwardBatch(self, data, samplesType, batchSize=32):
         nSamples = data.indices[samplesType].shape[0]
-        device = self.S[0].device
+        device = next(self.parameters()).device
         output = torch.tensor([], device=device)
 
         for b in range(nSamples // batchSize):
@@ -557,7 +1284,7 @@ class LocalGNNCliqueLine(nn.Module):
             output = torch.cat((output, yBatch))
 
         if nSamples % batchSize > 0:
-            thisBatchIndices = list(range((b + 1) * batchSize, nSamples))
+            thisBatchIndices = list(range(nSamples - nSamples % batchSize, nSamples))
             xBatch, _ = data.getSamples(samplesType, thisBatchIndices)
             self.targets = data.getTargets(samplesType, thisBatchIndices)
             yBatch = self.forward(xBatch.to(device))
@@ -572,83 +1299,34 @@ class LocalGNNCliqueLine(nn.Module):
         # we need to create this other forward function that takes both outputs
         # (the GNN and the MLP) and returns only the MLP output in the proper
         # forward function.
-        output, _ = self.splitForward(x)
+        output = self.autocastForward(x)
 
         return output
 
-    # TODO: This is NOT updated and should not be used!!!
     def singleNodeForward(self, x, nodes):
 
-        # x is of shape B x F[0] x N[-1]
+        # x is of shape B x F[0] x N[0]
         batchSize = x.shape[0]
         # nodes is either an int, or a list/np.array of ints of size B
         assert type(nodes) is int \
                or type(nodes) is list \
                or type(nodes) is np.ndarray
 
-        # Let us start by building the selection matrix
-        # This selection matrix has to be a matrix of shape
-        #   B x N[-1] x 1
-        # so that when multiplying with the output of the forward, we get a
-        #   B x dimRedout[-1] x 1
-        # and we just squeeze the last dimension
-
-        # TODO: The big question here is if multiplying by a matrix is faster
-        # than doing torch.index_select
-
-        # Let's always work with numpy arrays to make it easier.
         if type(nodes) is int:
-            # Change the node number to accommodate the new order
-            nodes = self.order.index(nodes)
-            # If it's int, make it a list and an array
-            nodes = np.array([nodes], dtype=np.int)
-            # And repeat for the number of batches
-            nodes = np.tile(nodes, batchSize)
-        if type(nodes) is list:
-            newNodes = [self.order.index(n) for n in nodes]
-            nodes = np.array(newNodes, dtype=np.int)
-        elif type(nodes) is np.ndarray:
-            newNodes = np.array([np.where(np.array(self.order) == n)[0][0] \
-                                 for n in nodes])
-            nodes = newNodes.astype(np.int)
-        # Now, nodes is an np.int np.ndarray with shape batchSize
-
-        # Build the selection matrix
-        selectionMatrix = np.zeros([batchSize, self.N[-1], 1])
-        selectionMatrix[np.arange(batchSize), nodes, 0] = 1.
-        # And convert it to a tensor
-        selectionMatrix = torch.tensor(selectionMatrix,
-                                       dtype=x.dtype,
-                                       device=x.device)
-
-        # Now compute the output
+            # Same node for all the elements in the batch
+            nodes = [nodes] * batchSize
+        nodes = torch.as_tensor(np.array(nodes), dtype=torch.long, device=x.device)
+        assert nodes.shape[0] == batchSize
+
+        # Take each node as the target of its sample, so that only the output at
+        # that node goes through the readout layer
+        targets = self.targets
+        self.targets = torch.stack((torch.arange(batchSize, device=x.device), nodes), dim=1)
         y = self.forward(x)
-        # This output is of size B x dimReadout[-1] x N[-1]
-
-        # Multiply the output
-        y = torch.matmul(y, selectionMatrix)
-        #   B x dimReadout[-1] x 1
-
-        # Squeeze the last dimension and return
-        return y.squeeze(2)
+        # This output is of size B x dimReadout[-1]
+        self.targets = targets
 
-    def to(self, device):
-        # Because only the filter taps and the weights are registered as
-        # parameters, when we do a .to(device) operation it does not move the
-        # GSOs. So we need to move them ourselves.
-        # Call the parent .to() method (to move the registered parameters)
-        super().to(device)
-        # Move the terms for the integral Lipschitz computations
-        self.IL_terms = [s.to(device) for s in self.IL_terms]
-        # Move the GSO
-        offset = 0
-        for i in range(len(self.S)):
-            self.S[i] = self.S[i].to(device)
-            # And all the other variables derived from it.
-            for l in range(self.L[i]):
-                self.GFL[3 * l + offset].addGSO(self.S[i])
-                self.GFL[3 * l + 2 + offset].addGSO(self.S[i])
-            offset += 3 * self.L[i] + 1
+        return y
 
 
 class LocalGNNHGLap(LocalGNNCliqueLine):
@@ -662,9 +1340,10 @@ class LocalGNNHGLap(LocalGNNCliqueLine):
                  # MLP in the end
                  dimReadout,
                  # Structure
-                 GSOs, incidence_matrices, targets=None, order=None):
-        # Initialize parent:
-        super().__init__()
+                 GSOs, incidence_matrices, targets=None, order=None, persistentGSOs=False, filterTypes=None):
+        # Initialize the module only, the architecture is built here (with one
+        # incidence matrix per GSO) instead of by LocalGNNCliqueLine
+        GraphStructureModule.__init__(self)
         # dimSignals should be a list and of size 1 more than nFilter taps.
         numGSOs = len(GSOs)
         for i in range(numGSOs):
@@ -681,7 +1360,7 @@ class LocalGNNHGLap(LocalGNNCliqueLine):
                 assert GSO.shape[1] == GSO.shape[2]  # E x N x N
             if i < numGSOs - 1:
                 B = incidence_matrices[i]
-                assert B.ndim == 2 and B.shape[0] == GSO.shape[0]  # N x M
+                assert B.ndim == 2 and B.shape[0] == GSOs[i].shape[1]  # N x M
         # nSelectedNodes should be a list of size nFilterTaps, since the number
         # of nodes in the first layer is always the size of the graph
         if nSelectedNodes is None:
@@ -692,13 +1371,20 @@ class LocalGNNHGLap(LocalGNNCliqueLine):
         # poolingSize also has to be a list of the same size
         for i in range(numGSOs):
             assert len(poolingSize[i]) == len(nFilterTaps[i])
+        # One type of graph filter for each GSO
+        if filterTypes is None:
+            filterTypes = ['monomial'] * numGSOs
+        assert len(filterTypes) == numGSOs
+        for filterType in filterTypes:
+            assert filterType in ['monomial', 'chebyshev']
         # Store the values (using the notation in the paper):
         self.L = [len(nTaps) for nTaps in nFilterTaps]  # Number of graph filtering layers
         self.F = [dims for dims in dimSignals]  # Features
         self.K = [nTaps for nTaps in nFilterTaps]  # Filter taps
+        self.filterTypes = filterTypes  # Monomial or Chebyshev taps
         self.E = [GSO.shape[0] for GSO in GSOs]  # Number of edge features
         # For the incidence matrices
-        self.B = []
+        B = []
         if order is not None:
             # If there's going to be reordering, then the value of the
             # permutation function will be given by the criteria in
@@ -711,18 +1397,20 @@ class LocalGNNHGLap(LocalGNNCliqueLine):
             self.permFunction = alegnn.utils.graphTools.permIdentity
             # This is overridden if coarsening is selected, since the ordering
             # function is native to that pooling method.
-        self.S = []
+        S = []
         self.order = []
         for i in range(numGSOs):
             newS, newOrder = self.permFunction(GSOs[i])
-            self.S.append(newS)
+            S.append(newS)
             self.order.append(newOrder)
-            if 'torch' not in repr(self.S[i].dtype):
-                self.S[i] = torch.tensor(self.S[i])
+            if 'torch' not in repr(S[i].dtype):
+                S[i] = torch.tensor(S[i])
             # Permute the incidence matrices to match the GSOs
-            self.B.append(incidence_matrices[i][newOrder, :])
-            if 'torch' not in repr(self.B[i].dtype):
-                self.B[i] = torch.tensor(self.B[i])
+            B.append(incidence_matrices[i][newOrder, :])
+            if 'torch' not in repr(B[i].dtype):
+                B[i] = torch.tensor(B[i])
+        # Both are kept as buffers (only saved in the state_dict if persistentGSOs is True)
+        self.registerGraphStructure(S, B, persistentGSOs)
 
         self.alpha = [poolSizes for poolSizes in poolingSize]
         self.N = [[GSOs[i].shape[1]] + nSelectedNodes[i] for i in range(numGSOs)]  # Number of nodes
@@ -743,9 +1431,10 @@ class LocalGNNHGLap(LocalGNNCliqueLine):
         offset = 0
         for i in range(numGSOs):
             for l in range(self.L[i]):
-                # \\ Graph filtering stage:
-                gfl.append(gml.GraphFilter(self.F[i][l], self.F[i][l + 1], self.K[i][l],
-                                           self.E[i], self.bias))
+                # \\ Graph filtering stage (on the powers of the GSO, or on its Chebyshev polynomials):
+                graphFilter = ChebyshevGraphFilter if self.filterTypes[i] == 'chebyshev' else gml.GraphFilter
+                gfl.append(graphFilter(self.F[i][l], self.F[i][l + 1], self.K[i][l],
+                                       self.E[i], self.bias))
                 # There is a 3*l below here, because we have three elements per
                 # layer: graph filter, nonlinearity and pooling, so after each layer
                 # we're actually adding elements to the (sequential) list.
@@ -763,6 +1452,15 @@ class LocalGNNHGLap(LocalGNNCliqueLine):
                 offset += 3*self.L[i] + 1
         # And now feed them into the sequential
         self.GFL = nn.Sequential(*gfl)  # Graph Filtering Layers
+        # The Chebyshev graph filters take the (cached) spectral radius of their GSO
+        self.linkGSOs()
+        # Fused graph filtering layers, only used if enableFusedForward() is called
+        self.fusedGFL = None
+        self.compileFused = False
+        # Receptive field pruning (see LocalGNNCliqueLine) is not used here
+        self.firstPrunedBlock = None
+        # Partitioned graph filtering layers, only used if enablePartitionedForward() is called
+        self.partitionedGFL = None
         # \\\ MLP (Fully Connected Layers) \\\
         fc = []
         if len(self.dimReadout) > 0:  # Maybe we don't want to readout anything
@@ -786,6 +1484,9 @@ class LocalGNNHGLap(LocalGNNCliqueLine):
         # so we finally have the architecture.
         # Lastly, for efficiency we pre-compute some terms for computing the integral Lipschitz constant
         self.construct_IL_terms()
+        # The graph filters of GFL only take dense GSOs, sparse (and factored) ones are handled by the fused layers
+        if any([GSO.is_sparse for GSO in self.S]):
+            self.enableFusedForward()
 
     '''
     def changeGSO(self, GSOs, Bs, nSelectedNodes=[], poolingSize=[]):
@@ -921,7 +1622,7 @@ class LocalGNNHGLap(LocalGNNCliqueLine):
         # Reorder
         x = x[:, :, self.order[0]]  # B x F x N
         # Let's call the graph filtering layer
-        yGFL = self.GFL(x)
+        yGFL = self.graphFiltering(x)
         # Change the order, for the readout
         y = yGFL.permute(0, 2, 1)  # B x N[-1] x F[-1]
         # And, feed it into the Readout layer
@@ -941,7 +1642,7 @@ class LocalGNNHGLap(LocalGNNCliqueLine):
         # we need to create this other forward function that takes both outputs
         # (the GNN and the MLP) and returns only the MLP output in the proper
         # forward function.
-        output, _ = self.splitForward(x)
+        output = self.autocastForward(x)
 
         return output
 
@@ -1020,7 +1721,7 @@ class LocalGNNHGLap(LocalGNNCliqueLine):
             offset += 3 * self.L[i] + 1
     '''
 
-class LocalGNNClique(nn.Module):
+class LocalGNNClique(GraphStructureModule):
     def __init__(self,
                  # Graph filtering
                  dimSignals, nFilterTaps, bias,
@@ -1031,7 +1732,7 @@ class LocalGNNClique(nn.Module):
                  # MLP in the end
                  dimReadout,
                  # Structure
-                 GSOs, incidence_matrices, targets=None, order=None):
+                 GSOs, incidence_matrices, targets=None, order=None, persistentGSOs=False):
         # Initialize parent:
         super().__init__()
         # dimSignals should be a list and of size 1 more than nFilter taps.
@@ -1050,7 +1751,7 @@ class LocalGNNClique(nn.Module):
                 assert GSO.shape[1] == GSO.shape[2]  # E x N x N
             if i < numGSOs - 1:
                 B = incidence_matrices[i]
-                assert B.ndim == 2 and B.shape[0] == GSO.shape[0]  # N x M
+                assert B.ndim == 2 and B.shape[0] == GSOs[i].shape[1]  # N x M
         # nSelectedNodes should be a list of size nFilterTaps, since the number
         # of nodes in the first layer is always the size of the graph
         if nSelectedNodes is None:
@@ -1067,7 +1768,7 @@ class LocalGNNClique(nn.Module):
         self.K = [nTaps for nTaps in nFilterTaps]  # Filter taps
         self.E = [GSO.shape[0] for GSO in GSOs]  # Number of edge features
         # For the incidence matrices
-        self.B = []
+        B = []
         if order is not None:
             # If there's going to be reordering, then the value of the
             # permutation function will be given by the criteria in
@@ -1080,18 +1781,20 @@ class LocalGNNClique(nn.Module):
             self.permFunction = alegnn.utils.graphTools.permIdentity
             # This is overridden if coarsening is selected, since the ordering
             # function is native to that pooling method.
-        self.S = []
+        S = []
         self.order = []
         for i in range(numGSOs):
             newS, newOrder = self.permFunction(GSOs[i])
-            self.S.append(newS)
+            S.append(newS)
             self.order.append(newOrder)
-            if 'torch' not in repr(self.S[i].dtype):
-                self.S[i] = torch.tensor(self.S[i])
+            if 'torch' not in repr(S[i].dtype):
+                S[i] = torch.tensor(S[i])
             # Permute the incidence matrices to match the GSOs
-            self.B.append(incidence_matrices[i][newOrder, :])
-            if 'torch' not in repr(self.B[i].dtype):
-                self.B[i] = torch.tensor(self.B[i])
+            B.append(incidence_matrices[i][newOrder, :])
+            if 'torch' not in repr(B[i].dtype):
+                B[i] = torch.tensor(B[i])
+        # Both are kept as buffers (only saved in the state_dict if persistentGSOs is True)
+        self.registerGraphStructure(S, B, persistentGSOs)
 
         self.alpha = [poolSizes for poolSizes in poolingSize]
         self.N = [[GSOs[i].shape[1]] + nSelectedNodes[i] for i in range(numGSOs)]  # Number of nodes
@@ -1175,18 +1878,20 @@ class LocalGNNClique(nn.Module):
                 assert B.ndim == 2 and B.shape[0] == GSO.shape[0]  # N x M
 
         # Loop through all GSOs provided
+        S = []
+        B = []
         for i in range(numGSOs):
             # Get dataType and device of the current GSO, so when we replace it, it
             # is still located in the same type and the same device.
             dataType, device = getDataTypeAndDevice(self.S[i])
             # Reorder the new GSO
-            self.S[i], self.order[i] = self.permFunction(GSOs[i])
+            newS, self.order[i] = self.permFunction(GSOs[i])
             # Change data type and device as required
-            self.S[i] = changeDataTypeAndDevice(self.S[i], dataType, device)
-            if i < numGSOs - 1:
-                dataType, device = getDataTypeAndDevice(self.B[i])
-                self.B[i] = B[i][self.order, :]
-                self.B[i] = changeDataTypeAndDevice(self.B[i], dataType, device)
+            S.append(changeDataTypeAndDevice(newS, dataType, device))
+            dataType, device = getDataTypeAndDevice(self.B[i])
+            B.append(changeDataTypeAndDevice(Bs[i][self.order[i], :], dataType, device))
+        # Replace the buffers
+        self.registerGraphStructure(S, B, self.persistentGSOs)
 
         # Before making decisions, check if there is a new poolingSize list
         if len(poolingSize) > 0:
@@ -1218,23 +1923,17 @@ class LocalGNNClique(nn.Module):
                 offset += 3*self.L[i] + 1
 
         # And update the GSOs
-        offset = 0
-        for i in range(numGSOs):
-            for l in range(self.L[i]):
-                self.GFL[3 * l + offset].addGSO(self.S[i])  # Graph convolutional layer
-                self.GFL[3 * l + 2 + offset].addGSO(self.S[i])
-            offset += 3 * self.L[i] + 1
+        self.linkGSOs()
         # Lastly, for efficiency we pre-compute some terms for computing the integral Lipschitz constant
         self.construct_IL_terms()
 
     # Construct terms required to compute the integral Lipschitz constant ahead of time for efficiency
     def construct_IL_terms(self):
-        self.IL_terms = []
-        for layer in self.GFL:
+        IL_terms = []
+        for i, layer in self.gsoLayers():
             if isinstance(layer, gml.GraphFilter):
-                lambda_max = torch.max(torch.abs(torch.linalg.eigvalsh(layer.S)))
-                self.IL_terms.append( torch.Tensor([0] + [k * lambda_max ** k for k in range(1, layer.K)]) \
-                                 .repeat(layer.F, layer.E, layer.G).reshape(layer.F, layer.E, layer.K, layer.G) )
+                IL_terms.append(filterILTerms(layer, self.getSpectralRadius(i)))
+        self.setILTerms(IL_terms)
 
     # Ensure the integral Lipschitz constant constraint is not violated.
     # Otherwise, the loss could be NaN (due to the log barrier penalties)
@@ -1311,7 +2010,7 @@ class LocalGNNClique(nn.Module):
         # we need to create this other forward function that takes both outputs
         # (the GNN and the MLP) and returns only the MLP output in the proper
         # forward function.
-        output, _ = self.splitForward(x)
+        output = self.autocastForward(x)
 
         return output
 
@@ -1371,26 +2070,8 @@ class LocalGNNClique(nn.Module):
         # Squeeze the last dimension and return
         return y.squeeze(2)
 
-    def to(self, device):
-        # Because only the filter taps and the weights are registered as
-        # parameters, when we do a .to(device) operation it does not move the
-        # GSOs. So we need to move them ourselves.
-        # Call the parent .to() method (to move the registered parameters)
-        super().to(device)
-        # Move the terms for the integral Lipschitz computations
-        self.IL_terms = [s.to(device) for s in self.IL_terms]
-        # Move the GSO
-        offset = 0
-        for i in range(len(self.S)):
-            self.S[i] = self.S[i].to(device)
-            # And all the other variables derived from it.
-            for l in range(self.L[i]):
-                self.GFL[3 * l + offset].addGSO(self.S[i])
-                self.GFL[3 * l + 2 + offset].addGSO(self.S[i])
-            offset += 3 * self.L[i] + 1
-
 
-class LocalGNNLine(nn.Module):
+class LocalGNNLine(GraphStructureModule):
     def __init__(self,
                  # Graph filtering
                  dimSignals, nFilterTaps, bias,
@@ -1401,7 +2082,7 @@ class LocalGNNLine(nn.Module):
                  # MLP in the end
                  dimReadout,
                  # Structure
-                 GSOs, incidence_matrices, targets=None, order=None):
+                 GSOs, incidence_matrices, targets=None, order=None, persistentGSOs=False):
         # Initialize parent:
         super().__init__()
         # dimSignals should be a list and of size 1 more than nFilter taps.
@@ -1434,7 +2115,7 @@ class LocalGNNLine(nn.Module):
         self.K = [nTaps for nTaps in nFilterTaps]  # Filter taps
         self.E = [GSO.shape[0] for GSO in GSOs]  # Number of edge features
         # For the incidence matrices
-        self.B = []
+        B = []
         if order is not None:
             # If there's going to be reordering, then the value of the
             # permutation function will be given by the criteria in
@@ -1447,18 +2128,20 @@ class LocalGNNLine(nn.Module):
             self.permFunction = alegnn.utils.graphTools.permIdentity
             # This is overridden if coarsening is selected, since the ordering
             # function is native to that pooling method.
-        self.S = []
+        S = []
         self.order = []
         for i in range(numGSOs):
             newS, newOrder = self.permFunction(GSOs[i])
-            self.S.append(newS)
+            S.append(newS)
             self.order.append(newOrder)
-            if 'torch' not in repr(self.S[i].dtype):
-                self.S[i] = torch.tensor(self.S[i])
+            if 'torch' not in repr(S[i].dtype):
+                S[i] = torch.tensor(S[i])
             # Permute the incidence matrices to match the GSOs
-            self.B.append(incidence_matrices[i][:, newOrder])
-            if 'torch' not in repr(self.B[i].dtype):
-                self.B[i] = torch.tensor(self.B[i])
+            B.append(incidence_matrices[i][:, newOrder])
+            if 'torch' not in repr(B[i].dtype):
+                B[i] = torch.tensor(B[i])
+        # Both are kept as buffers (only saved in the state_dict if persistentGSOs is True)
+        self.registerGraphStructure(S, B, persistentGSOs)
 
         self.alpha = [poolSizes for poolSizes in poolingSize]
         self.N = [[GSOs[0].shape[1]] + nSelectedNodes[i]]  # Number of nodes
@@ -1545,18 +2228,20 @@ class LocalGNNLine(nn.Module):
                 assert B.ndim == 2 and B.shape[0] == GSO.shape[0]  # N x M
 
         # Loop through all GSOs provided
+        S = []
+        B = []
         for i in range(numGSOs):
             # Get dataType and device of the current GSO, so when we replace it, it
             # is still located in the same type and the same device.
             dataType, device = getDataTypeAndDevice(self.S[i])
             # Reorder the new GSO
-            self.S[i], self.order[i] = self.permFunction(GSOs[i])
+            newS, self.order[i] = self.permFunction(GSOs[i])
             # Change data type and device as required
-            self.S[i] = changeDataTypeAndDevice(self.S[i], dataType, device)
-            if i < numGSOs - 1:
-                dataType, device = getDataTypeAndDevice(self.B[i])
-                self.B[i] = B[i][self.order, :]
-                self.B[i] = changeDataTypeAndDevice(self.B[i], dataType, device)
+            S.append(changeDataTypeAndDevice(newS, dataType, device))
+            dataType, device = getDataTypeAndDevice(self.B[i])
+            B.append(changeDataTypeAndDevice(Bs[i][:, self.order[i]], dataType, device))
+        # Replace the buffers
+        self.registerGraphStructure(S, B, self.persistentGSOs)
 
         # Before making decisions, check if there is a new poolingSize list
         if len(poolingSize) > 0:
@@ -1588,23 +2273,17 @@ class LocalGNNLine(nn.Module):
                 offset += 3*self.L[i] + 1
 
         # And update the GSOs
-        offset = 0
-        for i in range(numGSOs):
-            for l in range(self.L[i]):
-                self.GFL[3 * l + offset].addGSO(self.S[i])  # Graph convolutional layer
-                self.GFL[3 * l + 2 + offset].addGSO(self.S[i])
-            offset += 3 * self.L[i] + 1
+        self.linkGSOs()
         # Lastly, for efficiency we pre-compute some terms for computing the integral Lipschitz constant
         self.construct_IL_terms()
 
     # Construct terms required to compute the integral Lipschitz constant ahead of time for efficiency
     def construct_IL_terms(self):
-        self.IL_terms = []
-        for layer in self.GFL:
+        IL_terms = []
+        for i, layer in self.gsoLayers():
             if isinstance(layer, gml.GraphFilter):
-                lambda_max = torch.max(torch.abs(torch.linalg.eigvalsh(layer.S)))
-                self.IL_terms.append( torch.Tensor([0] + [k * lambda_max ** k for k in range(1, layer.K)]) \
-                                 .repeat(layer.F, layer.E, layer.G).reshape(layer.F, layer.E, layer.K, layer.G) )
+                IL_terms.append(filterILTerms(layer, self.getSpectralRadius(i)))
+        self.setILTerms(IL_terms)
 
     # Ensure the integral Lipschitz constant constraint is not violated.
     # Otherwise, the loss could be NaN (due to the log barrier penalties)
@@ -1680,7 +2359,7 @@ class LocalGNNLine(nn.Module):
         # we need to create this other forward function that takes both outputs
         # (the GNN and the MLP) and returns only the MLP output in the proper
         # forward function.
-        output, _ = self.splitForward(x)
+        output = self.autocastForward(x)
 
         return output
 
@@ -1739,21 +2418,3 @@ class LocalGNNLine(nn.Module):
 
         # Squeeze the last dimension and return
         return y.squeeze(2)
-
-    def to(self, device):
-        # Because only the filter taps and the weights are registered as
-        # parameters, when we do a .to(device) operation it does not move the
-        # GSOs. So we need to move them ourselves.
-        # Call the parent .to() method (to move the registered parameters)
-        super().to(device)
-        # Move the terms for the integral Lipschitz computations
-        self.IL_terms = [s.to(device) for s in self.IL_terms]
-        # Move the GSO
-        offset = 1
-        for i in range(len(self.S)):
-            self.S[i] = self.S[i].to(device)
-            # And all the other variables derived from it.
-            for l in range(self.L[i]):
-                self.GFL[3 * l + offset].addGSO(self.S[i])
-                self.GFL[3 * l + 2 + offset].addGSO(self.S[i])
-            offset += 3 * self.L[i] + 1
\ No newline at end of file
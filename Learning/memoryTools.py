@@ -0,0 +1,344 @@
+import re
+import time
+import sys
+import resource
+import numpy as np
+import scipy.sparse
+import torch
+import sparseGraphML as spgml
+
+"""
+Memory tools
+
+Estimates of the memory needed to train the LocalGNN architectures (before building them), tracking of the memory
+actually used while training, and tuning of the batch size under a memory budget.
+
+"""
+
+
+# Bytes of each element of the given torch data type
+def elementBytes(dataType):
+    return torch.empty((), dtype=dataType).element_size()
+
+
+# Size of a GSO or incidence matrix, given as a dense or sparse torch tensor, a numpy array, a scipy sparse matrix, a
+# spgml.FactoredGSO, or a tuple (nRows, nColumns, nnz) with only its size. Returns the number of rows, columns and
+# nonzero entries, and whether it is kept as sparse (the tuples are, if sparse is None).
+def operatorSize(S, sparse=None):
+    if isinstance(S, tuple):
+        nRows, nColumns, nnz = S
+        return nRows, nColumns, nnz, True if sparse is None else sparse
+    if isinstance(S, spgml.FactoredGSO):
+        # Only the (nonzero entries of the) factors are kept, whatever sparse says
+        nnz = sum([factor._nnz() if factor.is_sparse else factor.numel()
+                   for factor in S.factors().values() if factor is not None])
+        return S.shape[-2], S.shape[-1], nnz, True
+    if scipy.sparse.issparse(S):
+        isSparse, nnz = True, S.nnz
+    elif isinstance(S, torch.Tensor) and S.is_sparse:
+        isSparse, nnz = True, S._nnz()
+    else:
+        isSparse, nnz = False, int(np.count_nonzero(S.detach().cpu().numpy() if isinstance(S, torch.Tensor) else S))
+    return S.shape[-2], S.shape[-1], nnz, isSparse if sparse is None else sparse
+
+
+# Bytes of a buffer of nRows x nColumns with nnz nonzero entries, kept as a dense tensor or as a sparse (COO) one,
+# whose entries take nIndices int64 indices and one value each
+def operatorBytes(nRows, nColumns, nnz, sparse, valueBytes, edgeFeatures=1, nIndices=3):
+    if sparse:
+        return nnz * edgeFeatures * (valueBytes + 8 * nIndices)
+    return nRows * nColumns * edgeFeatures * valueBytes
+
+
+# Estimate (in bytes) of the memory needed to train a LocalGNN architecture (LocalGNNCliqueLine, LocalGNNHGLap,
+# LocalGNNClique and LocalGNNLine), per layer, without building it. Each GSO gets the graph filtering layers of the
+# corresponding dimSignals and nFilterTaps, and the signals are pooled between consecutive GSOs through the incidence
+# matrices (as PoolCliqueToLine), as in the architecture.
+#   dimSignals, nFilterTaps, dimReadout, bias, filterTypes: as in the architecture
+#   batchSize (int): number of samples in each training step
+#   GSOs, incidence_matrices: the ones given to the architecture, or only their sizes (see operatorSize)
+#   edgeFeatures (int): number of edge features of the GSOs
+#   fused (bool): whether the fused graph filtering layers are used (if None, only if some GSO is sparse, as the
+#       architecture does)
+#   nReadoutNodes (int): nodes of each sample that go through the readout layer, i.e. the number of targets (if
+#       None, all the nodes of the last GSO)
+#   dataType (torch.dtype): data type of the parameters and signals
+#   sparseGSOs (bool): whether the GSOs are kept as sparse tensors (if None, as they are given)
+#   optimizerStates (int): tensors the size of the parameters kept by the optimizer (2 for ADAM, 0 for SGD)
+# Returns a dictionary with
+#   'layers': one dictionary per layer, with its 'name' (as in the architecture, e.g. 'GFL.0' or 'Readout.0'),
+#       'type', and the 'parameters', 'buffers' and 'activations' bytes. The activations are those kept for the
+#       backward (the output of each layer, and the intermediate signals it needs for its gradients), the buffers are
+#       the GSOs and incidence matrices (counted once, at the first layer that uses them), and the input signal is
+#       the first layer, 'input'.
+#   'total': the totals of each kind, along with the 'gradients' and 'optimizer' bytes (of the parameters), and the
+#       sum of all of them, 'training'.
+# These are estimates: the exact temporaries depend on the device, the torch version and on whether the operations are
+# done in place, and the activations of the validation steps (which are done in batches of the same size, without
+# gradients) are not counted.
+def estimateLocalGNNMemory(dimSignals, nFilterTaps, dimReadout, batchSize, GSOs, incidence_matrices=[], bias=True,
+                           filterTypes=None, edgeFeatures=1, fused=None, nReadoutNodes=None, dataType=torch.float64,
+                           sparseGSOs=None, optimizerStates=2):
+    numGSOs = len(GSOs)
+    assert len(dimSignals) == numGSOs and len(nFilterTaps) == numGSOs
+    assert len(incidence_matrices) >= numGSOs - 1
+    if filterTypes is None:
+        filterTypes = ['monomial'] * numGSOs
+    b = elementBytes(dataType)
+    B = batchSize
+    sizes = [operatorSize(S, sparseGSOs) for S in GSOs]
+    if fused is None:
+        fused = any([size[3] for size in sizes])
+
+    layers = [{'name': 'input', 'type': 'signal', 'parameters': 0, 'buffers': 0,
+               'activations': B * dimSignals[0][0] * sizes[0][0] * b}]
+    index = 0
+    for i in range(numGSOs):
+        N, _, nnz, sparse = sizes[i]
+        E = edgeFeatures
+        gsoBytes = operatorBytes(N, N, nnz, sparse, b, E)
+        for l in range(len(nFilterTaps[i])):
+            G, F, K = dimSignals[i][l], dimSignals[i][l + 1], nFilterTaps[i][l]
+            # Shifted signals (B x E x G x N each) kept for the gradients of the taps. The input is the output of the
+            # layer before, and the output is kept by the nonlinearity, so they are counted there.
+            if filterTypes[i] == 'chebyshev' or fused:
+                shifted = K - 1
+            else:
+                # alegnn.utils.graphML.LSIGF also keeps all of them stacked (and permuted) for the last product
+                shifted = 2 * K - 2
+            layers.append({'name': 'GFL.%d' % index, 'type': 'GraphFilter (%s)' % filterTypes[i],
+                           'parameters': (F * E * K * G + (F if bias else 0)) * b,
+                           'buffers': gsoBytes if l == 0 else 0,
+                           'activations': shifted * E * G * B * N * b})
+            layers.append({'name': 'GFL.%d' % (index + 1), 'type': 'nonlinearity', 'parameters': 0, 'buffers': 0,
+                           'activations': B * F * N * b})
+            layers.append({'name': 'GFL.%d' % (index + 2), 'type': 'pooling', 'parameters': 0, 'buffers': 0,
+                           'activations': 0})
+            index += 3
+        if i < numGSOs - 1:
+            nNodes, nEdges, nnzB, sparseB = operatorSize(incidence_matrices[i])
+            G = dimSignals[i][-1]
+            # The products at the nonzero entries (B x G x nnz, and the gathered signal they come from) and the pooled
+            # output (B x G x M)
+            layers.append({'name': 'GFL.%d' % index, 'type': 'PoolCliqueToLine', 'parameters': 0,
+                           'buffers': operatorBytes(nNodes, nEdges, nnzB, sparseB, b, nIndices=2)
+                                      + nnzB * (16 + b),
+                           'activations': (2 * nnzB + nEdges) * B * G * b})
+            index += 1
+
+    R = sizes[-1][0] if nReadoutNodes is None else nReadoutNodes
+    dimIn = dimSignals[-1][-1]
+    for l in range(len(dimReadout)):
+        layers.append({'name': 'Readout.%d' % (2 * l), 'type': 'Linear',
+                       'parameters': (dimIn * dimReadout[l] + (dimReadout[l] if bias else 0)) * b, 'buffers': 0,
+                       'activations': B * R * dimReadout[l] * b})
+        if l < len(dimReadout) - 1:
+            layers.append({'name': 'Readout.%d' % (2 * l + 1), 'type': 'nonlinearity', 'parameters': 0,
+                           'buffers': 0, 'activations': B * R * dimReadout[l] * b})
+        dimIn = dimReadout[l]
+
+    total = {kind: sum([layer[kind] for layer in layers]) for kind in ['parameters', 'buffers', 'activations']}
+    total['gradients'] = total['parameters']
+    total['optimizer'] = optimizerStates * total['parameters']
+    total['training'] = sum(total.values())
+    return {'layers': layers, 'total': total}
+
+
+# Bytes in a human readable form
+def formatBytes(nBytes):
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if abs(nBytes) < 1024:
+            return '%.1f %s' % (nBytes, unit)
+        nBytes /= 1024
+    return '%.1f TiB' % nBytes
+
+
+# Prints the estimate of estimateLocalGNNMemory as a table, one row per layer
+def printMemoryReport(report):
+    print("%-12s %-24s %12s %12s %12s" % ('Layer', 'Type', 'Parameters', 'Buffers', 'Activations'))
+    for layer in report['layers']:
+        print("%-12s %-24s %12s %12s %12s" % (layer['name'], layer['type'], formatBytes(layer['parameters']),
+                                              formatBytes(layer['buffers']), formatBytes(layer['activations'])))
+    total = report['total']
+    print("%-12s %-24s %12s %12s %12s" % ('Total', '', formatBytes(total['parameters']),
+                                          formatBytes(total['buffers']), formatBytes(total['activations'])))
+    print("Training (with gradients and optimizer states): %s" % formatBytes(total['training']))
+
+
+class MemoryTracker:
+    """
+    MemoryTracker: peak memory used by the process in each epoch, i.e. its
+        peak resident set size (RSS), and the peak memory allocated by torch
+        on the GPU (if available). On Linux, the peak RSS is reset at the start
+        of each epoch (through /proc/self/clear_refs); elsewhere (or if that
+        is not allowed) it is the peak since the process started, so it only
+        grows from epoch to epoch.
+
+    Initialization:
+
+        MemoryTracker()
+
+    Methods:
+
+    .startEpoch(): resets the peaks
+
+    peaks = .endEpoch(): peaks since the last .startEpoch(), as a dictionary
+        with the 'peakRSS' and 'peakCUDA' bytes (None without a GPU); they are
+        also appended to .epochs
+    """
+
+    def __init__(self):
+        self.epochs = []
+        self.resettable = sys.platform.startswith('linux')
+
+    def startEpoch(self):
+        if self.resettable:
+            try:
+                with open('/proc/self/clear_refs', 'w') as f:
+                    f.write('5')
+            except OSError:
+                self.resettable = False
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+
+    def peakRSS(self):
+        if sys.platform.startswith('linux'):
+            with open('/proc/self/status', 'r') as f:
+                match = re.search(r'VmHWM:\s+(\d+) kB', f.read())
+            if match is not None:
+                return int(match.group(1)) * 1024
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS, and in kilobytes elsewhere
+        return rss if sys.platform == 'darwin' else rss * 1024
+
+    def endEpoch(self):
+        peaks = {'peakRSS': self.peakRSS(),
+                 'peakCUDA': torch.cuda.max_memory_allocated() if torch.cuda.is_available() else None}
+        self.epochs.append(peaks)
+        return peaks
+
+
+# Memory available to the process on the given device, in bytes: the total memory of the GPU, or, on the CPU, the
+# memory it is already using plus the memory the system has available (None if it cannot be read)
+def availableMemory(device='cpu'):
+    device = torch.device(device)
+    if device.type == 'cuda':
+        return torch.cuda.get_device_properties(device).total_memory
+    if sys.platform.startswith('linux'):
+        with open('/proc/meminfo', 'r') as f:
+            match = re.search(r'MemAvailable:\s+(\d+) kB', f.read())
+        with open('/proc/self/status', 'r') as f:
+            current = re.search(r'VmRSS:\s+(\d+) kB', f.read())
+        if match is not None and current is not None:
+            return (int(match.group(1)) + int(current.group(1))) * 1024
+    return None
+
+
+# Whether the exception is torch running out of memory
+def isOutOfMemory(error):
+    return isinstance(error, MemoryError) or (isinstance(error, RuntimeError) and 'out of memory' in str(error))
+
+
+class BatchSizeTuner:
+    """
+    BatchSizeTuner: finds the batch size with the highest throughput (samples
+        per second) under a memory budget, by timing steps at increasing batch
+        sizes (minBatchSize, growth times that, and so on, up to maxBatchSize).
+        The peak memory of each probe is that of MemoryTracker (allocated by
+        torch on the GPU, or the peak RSS of the process on the CPU). Probing
+        stops at the first batch size that runs out of memory or goes over the
+        budget, or whose throughput is lower than that of the one before (once
+        the device is saturated, larger batches only take more memory). The
+        batch size chosen is the smallest one within tolerance of the highest
+        throughput.
+
+    Initialization:
+
+        BatchSizeTuner(step, maxBatchSize, memoryBudget = None,
+                       minBatchSize = 1, growth = 2, repeats = 2,
+                       tolerance = 0.95, device = 'cpu')
+
+    Input:
+        step (function): step(batchSize) runs one step at that batch size (it
+            is run once to warm up, and then timed repeats times)
+        maxBatchSize (int): largest batch size probed
+        memoryBudget (int): largest peak memory (in bytes) allowed (if None,
+            only running out of memory stops the probing)
+        minBatchSize (int): first batch size probed
+        growth (float): ratio between consecutive batch sizes probed
+        repeats (int): timed steps at each batch size
+        tolerance (float): fraction of the highest throughput at which a
+            smaller batch size is preferred
+        device (string or torch.device): device the steps run on
+
+    Methods:
+
+    batchSize = .tune(): probes the batch sizes and returns the one chosen
+        (minBatchSize if none fits in the budget)
+
+    .probes: list with a dictionary per batch size probed, with its
+        'batchSize', 'seconds' (per step), 'throughput', 'peakMemory' and
+        whether it 'fits' in the budget
+    """
+
+    def __init__(self, step, maxBatchSize, memoryBudget=None, minBatchSize=1, growth=2, repeats=2, tolerance=0.95,
+                 device='cpu'):
+        assert growth > 1 and repeats > 0
+        self.step = step
+        self.maxBatchSize = max(maxBatchSize, 1)
+        self.memoryBudget = memoryBudget
+        self.minBatchSize = min(max(minBatchSize, 1), self.maxBatchSize)
+        self.growth = growth
+        self.repeats = repeats
+        self.tolerance = tolerance
+        self.device = torch.device(device)
+        self.tracker = MemoryTracker()
+        self.probes = []
+
+    def candidates(self):
+        batchSize = self.minBatchSize
+        while batchSize < self.maxBatchSize:
+            yield batchSize
+            batchSize = max(int(batchSize * self.growth), batchSize + 1)
+        yield self.maxBatchSize
+
+    def synchronize(self):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+
+    def probe(self, batchSize):
+        self.tracker.startEpoch()
+        try:
+            self.step(batchSize)
+            self.synchronize()
+            start = time.perf_counter()
+            for _ in range(self.repeats):
+                self.step(batchSize)
+            self.synchronize()
+            seconds = (time.perf_counter() - start) / self.repeats
+        except (RuntimeError, MemoryError) as error:
+            if not isOutOfMemory(error):
+                raise
+            if self.device.type == 'cuda':
+                torch.cuda.empty_cache()
+            return {'batchSize': batchSize, 'seconds': None, 'throughput': 0., 'peakMemory': None, 'fits': False}
+        peaks = self.tracker.endEpoch()
+        peakMemory = peaks['peakCUDA'] if self.device.type == 'cuda' else peaks['peakRSS']
+        return {'batchSize': batchSize, 'seconds': seconds, 'throughput': batchSize / seconds,
+                'peakMemory': peakMemory,
+                'fits': self.memoryBudget is None or peakMemory <= self.memoryBudget}
+
+    def tune(self):
+        self.probes = []
+        for batchSize in self.candidates():
+            probe = self.probe(batchSize)
+            self.probes.append(probe)
+            if not probe['fits']:
+                break
+            if len(self.probes) > 1 and probe['throughput'] < self.probes[-2]['throughput']:
+                break
+        fitting = [probe for probe in self.probes if probe['fits']]
+        if len(fitting) == 0:
+            return self.minBatchSize
+        best = max([probe['throughput'] for probe in fitting])
+        return min([probe['batchSize'] for probe in fitting if probe['throughput'] >= self.tolerance * best])
@@ -0,0 +1,223 @@
+import numpy as np
+import scipy.sparse
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+import torch
+import torch.distributed as dist
+import sparseGraphML as spgml
+
+"""
+Partitioned graph ML operations
+
+Model parallel execution of the graph filtering layers: the nodes of each GSO are split into parts, one per process
+(rank) of the torch.distributed process group, and each rank only keeps the signals at its own nodes and the block of
+the GSO (or of the incidence matrix) that the outputs at its nodes depend on. Before each shift of the signal (and each
+pooling between GSOs), the values at the nodes of the other ranks that are needed (the halo) are exchanged through
+point to point messages, and in the backward their gradients are sent back the same way.
+
+"""
+
+
+# Splits the nodes of a GSO (dense or sparse, edgeFeatures x numberNodes x numberNodes) into nParts parts of (almost)
+# the same size, made of consecutive nodes in reverse Cuthill-McKee order. This order keeps neighboring nodes close to
+# each other, so most of the neighbors of the nodes of each part are in the same part, and the halos stay small.
+# Returns the part of each node.
+def bandwidthPartition(S, nParts):
+    A = spgml.sparsityPattern(S)
+    rows, columns = A.indices().cpu().numpy()
+    N = A.shape[0]
+    return orderPartition(scipy.sparse.coo_matrix((np.ones(len(rows)), (rows, columns)), shape=(N, N)), nParts)
+
+
+# Splits the hyperedges of an incidence matrix, given by the row and column of its nonzero entries (as in
+# spgml.incidenceIndex), like bandwidthPartition, with two hyperedges being neighbors if they share a node
+def hyperedgePartition(nodeIndex, edgeIndex, nNodes, nEdges, nParts):
+    B = scipy.sparse.coo_matrix((np.ones(len(nodeIndex)), (nodeIndex.cpu().numpy(), edgeIndex.cpu().numpy())),
+                                shape=(nNodes, nEdges)).tocsr()
+    return orderPartition(B.T @ B, nParts)
+
+
+# Parts of consecutive nodes in the reverse Cuthill-McKee order of the (scipy) sparsity pattern given
+def orderPartition(pattern, nParts):
+    pattern = pattern.tocsr()
+    N = pattern.shape[0]
+    order = reverse_cuthill_mckee((pattern + pattern.T).tocsr(), symmetric_mode=True)
+    parts = torch.empty(N, dtype=torch.long)
+    parts[torch.as_tensor(order.astype(np.int64))] = torch.arange(N) * nParts // N
+    return parts
+
+
+class HaloPlan:
+    """
+    HaloPlan: what each rank keeps and exchanges to compute the outputs at its
+        nodes, for an operation where each output node depends on some input
+        nodes (a shift over a GSO, or a pooling through an incidence matrix).
+
+    Initialization:
+
+        HaloPlan(inputIndex, outputIndex, inputParts, outputParts, rank)
+
+        Inputs:
+            inputIndex, outputIndex (torch.tensor): dependencies, the output at
+                node outputIndex[i] depends on the input at node inputIndex[i]
+            inputParts, outputParts (torch.tensor): part (rank) of each input
+                and output node
+            rank (int): rank the plan is for
+
+    Attributes:
+
+        .ownedInputs, .ownedOutputs: input and output nodes of this rank
+        .inputs: input nodes needed by this rank (its own and the halo)
+        .ownedPositions: positions of the owned inputs in .inputs
+        .sendPositions[q]: positions, in the owned inputs, of the values that
+            are sent to rank q
+        .receivePositions[q]: positions, in .inputs, of the values that are
+            received from rank q
+        .entries: positions of the dependencies of the owned outputs in
+            inputIndex and outputIndex
+        .inputIndex, .outputIndex: those dependencies, as positions in .inputs
+            and in the owned outputs
+
+        All the node lists are sorted, so both ends of every message agree on
+        the order of the values without having to send it.
+    """
+
+    def __init__(self, inputIndex, outputIndex, inputParts, outputParts, rank):
+        nParts = int(max(torch.max(inputParts), torch.max(outputParts))) + 1
+        self.rank = rank
+        self.ownedInputs = torch.nonzero(inputParts == rank).flatten()
+        self.ownedOutputs = torch.nonzero(outputParts == rank).flatten()
+        # Inputs needed by each part that belong to another part, as unique (needing part, input) pairs
+        needing = outputParts[outputIndex]
+        halo = inputParts[inputIndex] != needing
+        pairs = torch.unique(torch.stack((needing[halo], inputIndex[halo])), dim=1)
+        needing, haloInputs = pairs[0], pairs[1]
+        mine = needing == rank
+        self.inputs = torch.unique(torch.cat((self.ownedInputs, haloInputs[mine])))
+        self.ownedPositions = torch.searchsorted(self.inputs, self.ownedInputs)
+        self.sendPositions = {}
+        self.receivePositions = {}
+        for q in range(nParts):
+            if q == rank:
+                continue
+            send = haloInputs[(needing == q) & (inputParts[haloInputs] == rank)]
+            if len(send) > 0:
+                self.sendPositions[q] = torch.searchsorted(self.ownedInputs, send)
+            receive = haloInputs[mine & (inputParts[haloInputs] == q)]
+            if len(receive) > 0:
+                self.receivePositions[q] = torch.searchsorted(self.inputs, receive)
+        # Dependencies of the outputs of this rank, in local positions
+        self.entries = torch.nonzero(outputParts[outputIndex] == rank).flatten()
+        self.inputIndex = torch.searchsorted(self.inputs, inputIndex[self.entries])
+        self.outputIndex = torch.searchsorted(self.ownedOutputs, outputIndex[self.entries])
+
+    # Moves the index tensors to the given device (the one of the signals), returns the plan itself
+    def to(self, device):
+        for name in ['ownedInputs', 'ownedOutputs', 'inputs', 'ownedPositions', 'entries', 'inputIndex',
+                     'outputIndex']:
+            setattr(self, name, getattr(self, name).to(device))
+        for positions in [self.sendPositions, self.receivePositions]:
+            for q in positions.keys():
+                positions[q] = positions[q].to(device)
+        return self
+
+    def __repr__(self):
+        return "HaloPlan(rank=%d, owned inputs=%d, halo=%d, owned outputs=%d)" % (
+            self.rank, len(self.ownedInputs), len(self.inputs) - len(self.ownedInputs), len(self.ownedOutputs))
+
+
+# Plan of the shifts x S over a GSO (dense or sparse, edgeFeatures x numberNodes x numberNodes), where the output at
+# node n depends on the inputs at the nodes m such that S[e, m, n] is nonzero for some edge feature e
+def shiftPlan(S, parts, rank):
+    inputIndex, outputIndex = spgml.sparsityPattern(S).indices()
+    return HaloPlan(inputIndex.cpu(), outputIndex.cpu(), parts, parts, rank)
+
+
+# Plan of the pooling through an incidence matrix, given by the row and column of its nonzero entries (as in
+# spgml.incidenceIndex), where the output at each hyperedge depends on the inputs at its nodes. The values of the
+# entries this rank keeps are the ones at .entries.
+def incidencePlan(nodeIndex, edgeIndex, nodeParts, edgeParts, rank):
+    return HaloPlan(nodeIndex.cpu(), edgeIndex.cpu(), nodeParts, edgeParts, rank)
+
+
+# Block of the GSO S that the outputs of the rank of plan depend on, edgeFeatures x nInputs x nOwnedOutputs
+def localGSO(S, plan):
+    return S.index_select(1, plan.inputs.to(S.device)).index_select(2, plan.ownedOutputs.to(S.device))
+
+
+# Sends the values of x (... x nOwnedInputs) at the nodes that other ranks need, and receives the ones this rank needs,
+# following plan. Returns the values at all the inputs of the plan (... x nInputs). The leading dimensions have to be
+# the same on all ranks.
+def exchange(x, plan):
+    y = x.new_zeros(x.shape[:-1] + (len(plan.inputs),))
+    y[..., plan.ownedPositions] = x
+    received = [(positions, x.new_empty(x.shape[:-1] + (len(positions),)))
+                for positions in plan.receivePositions.values()]
+    sent = [x[..., positions].contiguous() for positions in plan.sendPositions.values()]
+    requests = [dist.irecv(buffer, q) for q, (_, buffer) in zip(plan.receivePositions.keys(), received)]
+    requests += [dist.isend(buffer, q) for q, buffer in zip(plan.sendPositions.keys(), sent)]
+    for request in requests:
+        request.wait()
+    for positions, buffer in received:
+        y[..., positions] = buffer
+    return y
+
+
+# Reverse of exchange: sends back the gradients at the halo inputs (... x nInputs) to the ranks they came from, and adds
+# up the gradients received at the owned inputs. Returns the gradient at the owned inputs (... x nOwnedInputs).
+def reverseExchange(grad, plan):
+    gradOwned = grad[..., plan.ownedPositions].clone()
+    received = [(positions, grad.new_empty(grad.shape[:-1] + (len(positions),)))
+                for positions in plan.sendPositions.values()]
+    sent = [grad[..., positions].contiguous() for positions in plan.receivePositions.values()]
+    requests = [dist.irecv(buffer, q) for q, (_, buffer) in zip(plan.sendPositions.keys(), received)]
+    requests += [dist.isend(buffer, q) for q, buffer in zip(plan.receivePositions.keys(), sent)]
+    for request in requests:
+        request.wait()
+    for positions, buffer in received:
+        gradOwned.index_add_(gradOwned.ndim - 1, positions, buffer)
+    return gradOwned
+
+
+class HaloExchange(torch.autograd.Function):
+    """
+    HaloExchange: exchange as an autograd function, the gradients at the halo
+        go back to the ranks that own those nodes (reverseExchange). All the
+        ranks have to go through the same exchanges, in the same order, both
+        in the forward and in the backward.
+    """
+
+    @staticmethod
+    def forward(ctx, x, plan):
+        ctx.plan = plan
+        return exchange(x, plan)
+
+    @staticmethod
+    def backward(ctx, grad):
+        return reverseExchange(grad, ctx.plan), None
+
+
+# Shift x S over the block of the GSO of the rank, after bringing in the halo, for the signal at the owned nodes
+# x (batchSize x edgeFeatures x dimFeatures x nOwnedNodes). Same output as graphShift at the owned nodes.
+def partitionedShift(x, S, plan):
+    return spgml.graphShift(HaloExchange.apply(x, plan), S)
+
+
+# Pooling through the incidence matrix for the hyperedges of the rank, after bringing in the halo nodes, for the signal
+# at the owned nodes x (batchSize x dimFeatures x nOwnedNodes). Same output as incidencePool at the owned hyperedges.
+def partitionedIncidencePool(x, values, plan):
+    return spgml.incidencePool(HaloExchange.apply(x, plan), plan.inputIndex, plan.outputIndex, values,
+                               len(plan.ownedOutputs))
+
+
+# Sums the gradients of the (replicated) parameters over all the ranks, since each rank only gets the part of the
+# gradient that comes from the outputs at its nodes
+def allReduceGradients(parameters):
+    parameters = [p for p in parameters if p.grad is not None]
+    if len(parameters) == 0:
+        return
+    grads = torch.cat([p.grad.flatten() for p in parameters])
+    dist.all_reduce(grads)
+    offset = 0
+    for p in parameters:
+        p.grad.copy_(grads[offset:offset + p.numel()].reshape(p.shape))
+        offset += p.numel()
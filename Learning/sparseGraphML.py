@@ -0,0 +1,366 @@
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+import torch
+
+"""
+Sparse and fused graph ML operations
+
+Building blocks used by the architectures when the dense, layer by layer
+implementation in alegnn.utils.graphML is too slow: vectorized pooling between
+the clique and line expansions through the incidence matrix, graph filters
+that accumulate the filter taps instead of stacking the K shifted signals, and
+GSOs that are only kept in factored form (FactoredGSO).
+
+"""
+
+# Largest number of nodes for which the spectral radius of a sparse GSO is computed from the formed (dense) GSO, instead
+# of with Lanczos iterations
+denseSpectralSize = 256
+
+
+# Pools a signal on the nodes into the hyperedges (the columns of the incidence matrix B). Each hyperedge takes the
+# maximum of x[n] * B[n, m] over its nodes n, and of 0, i.e. the same as taking the maximum of x[:, :, :, None] * B over
+# the nodes, but only visiting the nonzero entries of B.
+#   x (torch.tensor): batchSize x dimFeatures x nInputNodes
+#   nodeIndex, edgeIndex (torch.tensor): row and column of each nonzero entry of B (nnz)
+#   values (torch.tensor): value of each nonzero entry of B (nnz)
+#   nOutputNodes (int): number of columns of B
+# Returns a batchSize x dimFeatures x nOutputNodes tensor.
+def incidencePool(x, nodeIndex, edgeIndex, values, nOutputNodes):
+    batchSize, dimFeatures = x.shape[0], x.shape[1]
+    xB = x[:, :, nodeIndex] * values  # batchSize x dimFeatures x nnz
+    v = torch.zeros((batchSize, dimFeatures, nOutputNodes), dtype=x.dtype, device=x.device)
+    return v.scatter_reduce(2, edgeIndex.expand(batchSize, dimFeatures, -1), xB, reduce='amax', include_self=True)
+
+
+# Nonzero entries of an incidence matrix B (dense or sparse), in the format used by incidencePool
+def incidenceIndex(B):
+    if B.is_sparse:
+        B = B.coalesce()
+        nodeIndex, edgeIndex = B.indices()
+        values = B.values()
+    else:
+        nodeIndex, edgeIndex = torch.nonzero(B, as_tuple=True)
+        values = B[nodeIndex, edgeIndex]
+    return nodeIndex, edgeIndex, values
+
+
+# Shifts the signal x once over the GSO S, i.e. x S for each edge feature. S can be dense or sparse (COO); in the
+# latter case, each edge feature is shifted with a sparse-dense product, using x S = (S^T x^T)^T. Sparse products do
+# not support autocast, so they are always run in the precision of S.
+# S need not be square (e.g. the block of a GSO that some of the outputs depend on).
+#   x (torch.tensor): batchSize x edgeFeatures x dimFeatures x numberNodes (edgeFeatures can be 1, and is broadcast)
+#   S (torch.tensor): GSO, edgeFeatures x numberNodes x nOutputNodes
+# Returns a batchSize x edgeFeatures x dimFeatures x nOutputNodes tensor.
+def graphShift(x, S):
+    if isinstance(S, FactoredGSO):
+        return S.shift(x)
+    if not S.is_sparse:
+        return torch.matmul(x, S)
+    B, _, G, N = x.shape
+    E, M = S.shape[0], S.shape[2]
+    x = x.expand(B, E, G, N).to(S.dtype)
+    with torch.autocast(device_type=x.device.type, enabled=False):
+        return torch.stack([torch.sparse.mm(S[e].t(), x[:, e].reshape(B * G, N).t()).t().reshape(B, G, M)
+                            for e in range(E)], dim=1)
+
+
+# Same output as alegnn.utils.graphML.LSIGF, y = sum_k h_k S^k x + b, but each tap is added to the output as soon as
+# the signal is shifted, instead of stacking all the K shifted signals (B x N x E*K*G) and multiplying them at the end.
+#   h (torch.tensor): filter taps, dimOutFeatures x edgeFeatures x filterTaps x dimInFeatures
+#   S (torch.tensor): GSO, edgeFeatures x numberNodes x numberNodes (dense or sparse)
+#   x (torch.tensor): input, batchSize x dimInFeatures x numberNodes
+#   b (torch.tensor): bias, dimOutFeatures x 1 (default: None)
+#   shift (function): shifts the signal once over S, shift(x, S) (default: graphShift)
+def accumulatedLSIGF(h, S, x, b=None, shift=graphShift):
+    F, E, K, G = h.shape
+    B, _, N = x.shape
+    x = x.reshape([B, 1, G, N])
+    # For k = 0 the signal is the same for all edge features
+    y = torch.einsum('bgn,fg->bfn', x[:, 0], torch.sum(h[:, :, 0, :], dim=1))
+    for k in range(1, K):
+        x = shift(x, S)  # B x E x G x N
+        y = y + torch.einsum('begn,feg->bfn', x, h[:, :, k, :])
+    if b is not None:
+        y = y + b
+    return y
+
+
+# Same as accumulatedLSIGF, but with the taps on the Chebyshev polynomials of the rescaled GSO S' = 2 S / lambdaMax - I
+# instead of on the powers of S, y = sum_k h_k T_k(S') x + b, following the recursion T_k = 2 T_{k-1} S' - T_{k-2}. The
+# spectrum of S' is in [-1, 1], so the shifted signals do not grow (or vanish) with k. S' is never built, each shift is
+# (2 / lambdaMax) x S - x, so S can be dense or sparse.
+#   lambdaMax (float): largest absolute eigenvalue of S (or an upper bound of it)
+def chebyshevLSIGF(h, S, x, lambdaMax, b=None, shift=graphShift):
+    F, E, K, G = h.shape
+    B, _, N = x.shape
+    x = x.reshape([B, 1, G, N])
+    # T_0 is the identity, so the signal is the same for all edge features
+    y = torch.einsum('bgn,fg->bfn', x[:, 0], torch.sum(h[:, :, 0, :], dim=1))
+    xPrevious = x
+    for k in range(1, K):
+        xShifted = shift(x, S) * (2 / lambdaMax) - x  # B x E x G x N
+        if k > 1:
+            xShifted = 2 * xShifted - xPrevious
+        xPrevious, x = x, xShifted
+        y = y + torch.einsum('begn,feg->bfn', x, h[:, :, k, :])
+    if b is not None:
+        y = y + b
+    return y
+
+
+# Sparsity pattern of a GSO (dense or sparse, edgeFeatures x numberNodes x numberNodes), as a sparse numberNodes x
+# numberNodes matrix that is positive at each (m, n) such that S[e, m, n] is nonzero for some edge feature e.
+def sparsityPattern(S):
+    if isinstance(S, FactoredGSO):
+        S = S.to_sparse()
+    if S.is_sparse:
+        A = torch.sparse.sum(torch.abs(S), dim=0)
+    else:
+        A = torch.sum(torch.abs(S), dim=0).to_sparse()
+    return A.coalesce()
+
+
+# Neighbors that the output at each node depends on when shifting x S, i.e. the nodes m such that S[e, m, n] is nonzero
+# for some edge feature e, in compressed format: the neighbors of node n are neighbors[pointers[n]:pointers[n+1]].
+#   S (torch.tensor): GSO, dense or sparse, edgeFeatures x numberNodes x numberNodes
+def shiftNeighbors(S):
+    A = sparsityPattern(S).t().coalesce()
+    rows, neighbors = A.indices()
+    return compressedPointers(rows, A.shape[0]), neighbors
+
+
+# Pointers of the compressed format for the (sorted) rows given
+def compressedPointers(rows, nRows):
+    pointers = torch.zeros(nRows + 1, dtype=torch.long, device=rows.device)
+    pointers[1:] = torch.cumsum(torch.bincount(rows, minlength=nRows), dim=0)
+    return pointers
+
+
+# Positions of the neighbors of each of the given nodes in the compressed format with the given pointers, along with
+# the node that each of them is a neighbor of. Only visits the neighbors of the given nodes.
+def compressedNeighbors(pointers, nodes):
+    start = pointers[nodes]
+    count = pointers[nodes + 1] - start
+    segmentStart = torch.cumsum(count, dim=0) - count
+    positions = torch.arange(int(torch.sum(count)), device=pointers.device) \
+        + torch.repeat_interleave(start - segmentStart, count)
+    return positions, torch.repeat_interleave(nodes, count)
+
+
+# Nodes that the output at the given nodes depends on after K shifts x S, i.e. the nodes within K hops of them
+# following the neighbors given by shiftNeighbors. Only the neighbors of the nodes reached at each hop are visited.
+# Returns the sorted node indices.
+def khopNeighborhood(pointers, neighbors, nodes, K):
+    nodes = torch.unique(nodes)
+    frontier = nodes
+    for _ in range(K):
+        positions, _ = compressedNeighbors(pointers, frontier)
+        reached = torch.unique(torch.cat((nodes, neighbors[positions])))
+        frontier = reached[~torch.isin(reached, nodes)]
+        nodes = reached
+    return nodes
+
+
+# Restriction of the GSO S (dense or sparse, edgeFeatures x numberNodes x numberNodes) to the subgraph induced by
+# nodes (sorted node indices), edgeFeatures x nNodes x nNodes.
+def inducedGSO(S, nodes):
+    if isinstance(S, FactoredGSO):
+        return S.restrict(nodes)
+    return S.index_select(1, nodes).index_select(2, nodes)
+
+
+class FactoredGSO:
+    """
+    FactoredGSO: GSO that is only kept through the incidence matrix B (N x M)
+        of a hypergraph and diagonal scalings,
+
+            S = diag(a) + diag(s) B diag(w) B^T diag(s),
+
+        and is never formed. Shifting a signal takes two sparse products, with
+        B^T and with B, so both the memory and the cost of each filter tap are
+        linear in the number of incidences, instead of in the number of edges
+        of the expansion (sum_e |e|^2). For instance, the normalized hypergraph
+        Laplacian I - D_v^-1/2 B D_e^-1 B^T D_v^-1/2 has a = 1, s = d_v^-1/2
+        and w = -1/|e|.
+
+    Initialization:
+
+        FactoredGSO(incidence, weights, scale=None, diagonal=None,
+                    incidenceT=None)
+
+        Inputs:
+            incidence (torch.tensor): B, N x M, dense or sparse (it is kept as
+                a coalesced sparse tensor)
+            weights (torch.tensor): w, one per hyperedge (M)
+            scale (torch.tensor): s, one per node (N) (default: ones)
+            diagonal (torch.tensor): a, one per node (N) (default: zeros)
+            incidenceT (torch.tensor): B^T as a coalesced sparse tensor, if
+                already at hand (default: None, it is computed)
+
+    Attributes:
+
+        .shape: (1, N, N), i.e. a GSO with a single edge feature
+        .dtype, .device: those of the weights
+        .is_sparse: True, since it is never dense, so the architectures run it
+            through the same (fused) layers as the sparse GSOs
+
+    Methods:
+
+        y = .shift(x): x S for x of shape batchSize x edgeFeatures x
+            dimFeatures x N, the same as graphShift
+
+        factors = .factors(): dictionary of the tensors the GSO is made of,
+            so that they can be kept (and moved) as buffers, and the GSO is
+            rebuilt with FactoredGSO(**factors)
+
+        .to(*args, **kwargs): GSO with all the factors moved and converted
+            alike, as in torch.Tensor.to
+
+        .restrict(nodes): GSO of the subgraph induced by the (sorted) nodes,
+            still in factored form (the rows of B at those nodes)
+
+        .to_sparse(), .to_dense(): S, formed, as a 1 x N x N tensor. Only
+            needed by the operations that have to visit the edges of the
+            expansion (e.g. partitioning the nodes), and by .index_select()
+
+        .spectralRadius(): largest absolute eigenvalue of S, in double
+            precision, with Lanczos iterations on the factored operator
+
+    Graph filters:
+
+        It can be the GSO of any of the graph filter layers: the fused ones
+        and the Chebyshev ones shift with graphShift, and
+        alegnn.utils.graphML.GraphFilter (which reshapes its GSO to 1 x E x
+        N x N and shifts with torch.matmul(x, S)) gets the same shift through
+        .reshape() and __torch_function__.
+    """
+
+    def __init__(self, incidence, weights, scale=None, diagonal=None, incidenceT=None):
+        if not incidence.is_sparse:
+            incidence = incidence.to_sparse()
+        self.incidence = incidence.coalesce()
+        self.incidenceT = self.incidence.t().coalesce() if incidenceT is None else incidenceT
+        N = self.incidence.shape[0]
+        self.weights = weights
+        self.scale = torch.ones(N, dtype=weights.dtype, device=weights.device) if scale is None else scale
+        self.diagonal = torch.zeros(N, dtype=weights.dtype, device=weights.device) if diagonal is None else diagonal
+        self.shape = torch.Size((1, N, N))
+        self.ndim = 3
+        self.is_sparse = True
+
+    @property
+    def dtype(self):
+        return self.weights.dtype
+
+    @property
+    def device(self):
+        return self.weights.device
+
+    def factors(self):
+        return {'incidence': self.incidence, 'incidenceT': self.incidenceT, 'weights': self.weights,
+                'scale': self.scale, 'diagonal': self.diagonal}
+
+    def to(self, *args, **kwargs):
+        return FactoredGSO(**{name: factor.to(*args, **kwargs) for name, factor in self.factors().items()})
+
+    def shift(self, x):
+        B, E, G, N = x.shape
+        x = x.to(self.dtype)
+        with torch.autocast(device_type=x.device.type, enabled=False):
+            # (s x) B, one row per batch sample, edge feature and feature
+            z = torch.sparse.mm(self.incidenceT, (x * self.scale).reshape(B * E * G, N).t())  # M x BEG
+            # (w (s x) B) B^T
+            z = torch.sparse.mm(self.incidence, z * self.weights[:, None]).t().reshape(B, E, G, N)
+            return x * self.diagonal + z * self.scale
+
+    def restrict(self, nodes):
+        incidence = self.incidence.index_select(0, nodes).coalesce()
+        return FactoredGSO(incidence, self.weights, self.scale[nodes], self.diagonal[nodes])
+
+    def to_sparse(self):
+        nodeIndex, edgeIndex = self.incidence.indices()
+        values = self.incidence.values() * self.scale[nodeIndex]
+        left = torch.sparse_coo_tensor(self.incidence.indices(), values * self.weights[edgeIndex],
+                                       self.incidence.shape)
+        right = torch.sparse_coo_tensor(self.incidence.indices(), values, self.incidence.shape)
+        N = self.shape[1]
+        nodes = torch.arange(N, device=self.device)
+        D = torch.sparse_coo_tensor(torch.stack((nodes, nodes)), self.diagonal, (N, N))
+        return (torch.sparse.mm(left, right.t()) + D).coalesce().unsqueeze(0)
+
+    def to_dense(self):
+        return self.to_sparse().to_dense()
+
+    def index_select(self, dim, index):
+        return self.to_sparse().index_select(dim, index)
+
+    # Only the reshapes that keep it as a single N x N operator (e.g. to 1 x 1 x N x N)
+    def reshape(self, shape):
+        N = self.shape[1]
+        assert tuple(shape[-2:]) == (N, N) and np.prod(shape) == N * N
+        return self
+
+    # torch.matmul(x, S) is x S, any other torch function is not supported
+    @classmethod
+    def __torch_function__(cls, func, types, args=(), kwargs=None):
+        if func is torch.matmul and len(args) == 2 and isinstance(args[1], FactoredGSO) and not kwargs:
+            return args[1].shift(args[0])
+        return NotImplemented
+
+    def spectralRadius(self):
+        N = self.shape[1]
+        if N <= denseSpectralSize:
+            return torch.max(torch.abs(torch.linalg.eigvalsh(self.to_dense()[0].to(torch.float64)))).item()
+        nodeIndex, edgeIndex = self.incidence.indices().cpu().numpy()
+        B = scipy.sparse.csr_matrix((self.incidence.values().detach().cpu().numpy().astype(np.float64),
+                                     (nodeIndex, edgeIndex)), shape=self.incidence.shape)
+        w, s, a = [v.detach().cpu().numpy().astype(np.float64) for v in [self.weights, self.scale, self.diagonal]]
+        S = scipy.sparse.linalg.LinearOperator((N, N), matvec=lambda v: a * v + s * (B @ (w * (B.T @ (s * v)))),
+                                               dtype=np.float64)
+        eigenvalues = scipy.sparse.linalg.eigsh(S, k=1, which='LM', tol=1e-10, return_eigenvectors=False)
+        return float(np.max(np.abs(eigenvalues)))
+
+    def __repr__(self):
+        return "FactoredGSO(nodes=%d, hyperedges=%d, incidences=%d)" % (
+            self.shape[1], self.incidence.shape[1], self.incidence._nnz())
+
+
+# GSO of the clique expansion of the hypergraph with incidence matrix B (N x M, dense or sparse), where each hyperedge e
+# adds weights[e] (default: 1) to the edge between each pair of its nodes, as a FactoredGSO. The line expansion is the
+# clique expansion of the dual hypergraph, factoredCliqueGSO(B.t()). With A = B W B^T - diag(B W B^T) the adjacency of
+# the expansion, and d = A 1 its degrees,
+#   normalization = 'normalized': I - D^-1/2 A D^-1/2 (with a 0 in the diagonal for the isolated nodes, as in
+#       networkx), the same as Hypergraph.clique_laplacian and line_laplacian for the default weights
+#   normalization = 'combinatorial': D - A
+#   normalization = 'adjacency': A
+# Only B is kept, so none of them has the O(sum_e |e|^2) entries of the expansion.
+def factoredCliqueGSO(B, weights=None, normalization='normalized'):
+    if not B.is_sparse:
+        B = B.to_sparse()
+    B = B.coalesce()
+    N, M = B.shape
+    if weights is None:
+        weights = torch.ones(M, dtype=B.dtype, device=B.device)
+    nodeIndex, edgeIndex = B.indices()
+    values = B.values()
+    # Self loops of B W B^T, left out of the expansion
+    selfLoops = torch.zeros(N, dtype=B.dtype, device=B.device)
+    selfLoops.index_add_(0, nodeIndex, weights[edgeIndex] * values ** 2)
+    # Degrees, (B W B^T) 1 minus the self loops
+    edgeSums = torch.zeros(M, dtype=B.dtype, device=B.device).index_add_(0, edgeIndex, values)
+    degrees = torch.zeros(N, dtype=B.dtype, device=B.device)
+    degrees.index_add_(0, nodeIndex, values * weights[edgeIndex] * edgeSums[edgeIndex])
+    degrees = degrees - selfLoops
+    if normalization == 'normalized':
+        connected = degrees > 1e-12
+        scale = torch.zeros(N, dtype=B.dtype, device=B.device)
+        scale[connected] = degrees[connected] ** (-1/2)
+        return FactoredGSO(B, -weights, scale=scale, diagonal=connected.to(B.dtype) + scale ** 2 * selfLoops)
+    elif normalization == 'combinatorial':
+        return FactoredGSO(B, -weights, diagonal=degrees + selfLoops)
+    elif normalization == 'adjacency':
+        return FactoredGSO(B, weights, diagonal=-selfLoops)
+    else:
+        raise ValueError('normalization {} not available'.format(normalization))
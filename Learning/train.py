@@ -13,13 +13,22 @@ import argparse
 parser = argparse.ArgumentParser(description="Training GNN Models")
 parser.add_argument('-p', '--path', dest='path', type=str)
 parser.add_argument('-s', '--saveModel', dest='saveModel', action='store_true')
-parser.set_defaults(saveModel=False, path='cfg/localGNNCLiqueLine.cfg')
+# Number of (section, fold) experiments run in parallel, and number of torch threads used by each of them
+parser.add_argument('-w', '--workers', dest='workers', type=int)
+parser.add_argument('-t', '--threadsPerWorker', dest='threadsPerWorker', type=int)
+# Expand the grid(...), range(...) and logrange(...) options of the cfg sections into trials, and prune poor trials
+parser.add_argument('--sweep', dest='sweep', action='store_true')
+# Number of processes training each model (data parallel, on the CPU), unless the section gives its own world_size
+parser.add_argument('--world-size', dest='worldSize', type=int)
+parser.set_defaults(saveModel=False, path='cfg/localGNNCLiqueLine.cfg', workers=1, threadsPerWorker=None, sweep=False,
+                    worldSize=1)
 cmd_args = parser.parse_args()
 
 import numpy as np
 
 np.seterr(divide='ignore')
 import torch
+import torch.multiprocessing as mp
 import json
 
 torch.set_default_dtype(torch.float64)
@@ -40,6 +49,8 @@ from os import path
 import datetime
 from pathlib import Path
 import ast
+import re
+import itertools
 from mlxtend.plotting import plot_confusion_matrix
 import sys
 import csv
@@ -59,18 +70,23 @@ startRunTime = datetime.datetime.now()
 # from gnn_data.dataTools import dataMisinformation
 sys.path.insert(1, os.path.abspath('../Synthetic_Data_Generation'))
 sys.path.insert(1, os.path.abspath('../Data'))
+sys.path.insert(1, os.path.abspath('../Approximation'))
 from Source_Localization import hypergraphSources
 from DHG_datasets import dhgData
 from Hypergraphs import HG_normalized_Laplacian_from_incidence
+from Operator_Cache import load_operators
+from Graph_Approximation import laplacian_sparsifier
 from architectures import LocalGNNCliqueLine, LocalGNNHGLap, LocalGNNClique, LocalGNNLine
+from sparseGraphML import factoredCliqueGSO
 # from learner.aggregationGNN import AggregationGNN_DB
 # from learner.subgraphAggregationGNN import SubgraphAggregationGNN
 # from learner.trainerMisinformation import TrainerMisinformation
 # import learner.evaluatorMisinformation as EvaluateMisinformation
-from Helpers import sourceTrainer, sourceEvaluate, dhgTrainer, dhgEvaluate
+from Helpers import sourceTrainer, sourceEvaluate, dhgTrainer, dhgEvaluate, ASHAPruner, spectral_similarity
+from memoryTools import estimateLocalGNNMemory, printMemoryReport
 from copy import deepcopy
 
-possible_gnn_models = ['LocalGNNCliqueLine']
+possible_gnn_models = ['LocalGNNCliqueLine', 'LocalGNNHGLap']
 figSize = 7  # Overall size of the figure that contains the plot
 lineWidth = 2  # Width of the plot lines
 markerShape = 'o'  # Shape of the markers
@@ -82,7 +98,67 @@ xAxisMultiplierTrain = 5  # How many training steps in between those shown in
 
 # same as above.
 
-def train_helper(learner_params, train_params, dataset_params, directory, fold=None):
+# GSOs and incidence matrices already loaded, indexed by matrix_path. They are densified only once, and kept in shared
+# memory so that every fold (and every fold worker process) uses the same copy instead of re-reading the pickles.
+matrixCache = {}
+
+
+# GSOs and incidence matrices of matrix_path. If not gsos, only the incidence matrices are loaded (and the GSOs are
+# None), for the architectures that build their GSOs from them, so the expansions are never formed.
+def load_matrices(matrix_path, gsos=True):
+    if matrix_path not in matrixCache or (gsos and matrixCache[matrix_path][0] is None):
+        GSOs, incidence_matrices = load_operators(matrix_path, gsos)  # works but gives waring about csr_matrix
+        if GSOs is not None:
+            GSOs = [torch.tensor(X.todense()).share_memory_() for X in GSOs]
+        incidence_matrices = [torch.tensor(X).share_memory_() for X in incidence_matrices]
+        matrixCache[matrix_path] = (GSOs, incidence_matrices)
+
+    return matrixCache[matrix_path]
+
+
+# Whether the architecture takes the GSOs saved at matrix_path, or builds them from the incidence matrices (the
+# factored GSOs, and the normalized hypergraph Laplacian of LocalGNNHGLap)
+def formed_gsos_needed(gnn_model, factored_gsos):
+    return not factored_gsos and gnn_model != 'LocalGNNHGLap'
+
+
+# GSOs of the clique and line expansions in factored form (see factoredCliqueGSO), built from the incidence matrices
+# instead of taking the formed ones: the GSO on the rows of each incidence matrix, and on the columns of the last one.
+# They are the normalized Laplacians with overlap weights, i.e. the default GSOs of Operator_Cache.
+def factored_matrices(incidence_matrices):
+    Bs = list(incidence_matrices) + [incidence_matrices[-1].t()]
+    return [factoredCliqueGSO(B.to_sparse()) for B in Bs]
+
+
+# GSOs of matrix_path replaced by eps-spectral sparsifiers of them (see laplacian_sparsifier), kept in matrixCache as
+# well, along with the number of nonzero entries of each GSO before and after, and the spectral similarity achieved.
+# The sparsifiers are kept as sparse tensors (so the architecture filters with them through the fused layers), whose
+# indices and values are in shared memory.
+def sparsify_matrices(matrix_path, eps):
+    key = (matrix_path, 'sparsified', eps)
+    if key not in matrixCache:
+        GSOs, _ = load_matrices(matrix_path)
+        sparsified = []
+        report = {}
+        for i in range(len(GSOs)):
+            S = GSOs[i].numpy()
+            S_H = laplacian_sparsifier(S, eps).tocoo()
+            S_H.eliminate_zeros()
+            report['GSO%d_nnz' % i] = (int(np.count_nonzero(S)), int(S_H.nnz))
+            # The generalized similarity is the bound the sparsifier guarantees, and scales to large GSOs
+            report['GSO%d_spectral_similarity' % i] = spectral_similarity(S, S_H, method='generalized')
+            print('GSO {}: {} -> {} nonzero entries, spectral similarity {:.4f}'.format(
+                i, *report['GSO%d_nnz' % i], report['GSO%d_spectral_similarity' % i]))
+            indices = torch.tensor(np.vstack((S_H.row, S_H.col)), dtype=torch.long).share_memory_()
+            values = torch.tensor(S_H.data, dtype=GSOs[i].dtype).share_memory_()
+            # The entries of a COO matrix made from a CSR one are already sorted and unique
+            sparsified.append(torch.sparse_coo_tensor(indices, values, S_H.shape, is_coalesced=True))
+        matrixCache[key] = (sparsified, report)
+
+    return matrixCache[key]
+
+
+def train_helper(learner_params, train_params, dataset_params, directory, fold=None, pruner=None):
     save_dir = Path(directory)
     tb_dir = save_dir / 'tb'
     ckpt_dir = save_dir / 'ckpt'
@@ -112,10 +188,18 @@ def train_helper(learner_params, train_params, dataset_params, directory, fold=N
     # GRAPH #
     #########
 
-    with open(dataset_params['matrix_path'] + '_GSOs.pkl', 'rb') as f:
-        GSOs = pickle.load(f)
-    with open(dataset_params['matrix_path'] + '_incidence_matrices.pkl', 'rb') as f:
-        incidence_matrices = pickle.load(f) #works but gives waring about csr_matrix
+    GSOs, incidence_matrices = load_matrices(dataset_params['matrix_path'],
+                                             formed_gsos_needed(learner_params['gnn_model'],
+                                                                learner_params['factored_gsos']))
+    if GSOs is None:
+        GSOs = []
+    # Replace the GSOs by spectral sparsifiers of them, if asked for, so that filtering is cheaper
+    if learner_params['sparsify_gsos'] is not None:
+        if not formed_gsos_needed(learner_params['gnn_model'], learner_params['factored_gsos']):
+            raise ValueError('sparsify_gsos needs the GSOs of matrix_path, which are not used with factored_gsos '
+                             'or LocalGNNHGLap')
+        GSOs, sparsifierReport = sparsify_matrices(dataset_params['matrix_path'], learner_params['sparsify_gsos'])
+        writeVarValues(varsFile, sparsifierReport)
 
     ########
     # DATA #
@@ -130,16 +214,28 @@ def train_helper(learner_params, train_params, dataset_params, directory, fold=N
         # data = torch.load(f,map_location='mps:0', pickle_module=pickle)
 
     if useGPU and torch.cuda.is_available():
-        GSOs = [torch.tensor(X.todense(), device='cuda:0') for X in GSOs]
-        incidence_matrices = [torch.tensor(X, device='cuda:0') for X in incidence_matrices]
+        GSOs = [X.to('cuda:0') for X in GSOs]
+        incidence_matrices = [X.to('cuda:0') for X in incidence_matrices]
         data.to('cuda:0')
     elif useGPU and torch.backends.mps.is_available():
-        GSOs = [torch.tensor(X.todense(), device='mps:0') for X in GSOs]
-        incidence_matrices = [torch.tensor(X, device='mps:0') for X in incidence_matrices]
+        GSOs = [X.to('mps:0') for X in GSOs]
+        incidence_matrices = [X.to('mps:0') for X in incidence_matrices]
         data.to('mps:0')
     else:
-        GSOs = [torch.tensor(X.todense(), device='cpu') for X in GSOs]
-        incidence_matrices = [torch.tensor(X, device='cpu') for X in incidence_matrices]
+        GSOs = list(GSOs)
+        incidence_matrices = list(incidence_matrices)
+        data.to('cpu')
+
+    # Factored GSOs only keep the incidence matrices, so the expansions are never formed. Sparse GSOs are kept (and
+    # multiplied) as sparse tensors by the architecture.
+    if learner_params['factored_gsos']:
+        GSOs = factored_matrices(incidence_matrices)
+    elif learner_params['sparse_gsos']:
+        GSOs = [X if X.is_sparse else X.to_sparse() for X in GSOs]
+
+    # DataLoader workers build the batches from the data on the CPU, and the trainer moves them to the device of the
+    # model (through pinned memory, if requested)
+    if train_params['num_workers'] > 0:
         data.to('cpu')
 
     # If we want to do CV, set it up. Ensure we use the same seed for each fold
@@ -168,6 +264,19 @@ def train_helper(learner_params, train_params, dataset_params, directory, fold=N
     else:
         raise ValueError('loss function in cfg not available')
 
+    # Precision of the weights, GSOs and signals, and (lower) precision of the forward under autocast, if any. The
+    # spectral radii of the GSOs are always computed in double precision.
+    if learner_params['precision'] == 'float64':
+        modelDataType, autocastDataType = torch.float64, None
+    elif learner_params['precision'] == 'float32':
+        modelDataType, autocastDataType = torch.float32, None
+    elif learner_params['precision'] == 'bfloat16':
+        modelDataType, autocastDataType = torch.float32, torch.bfloat16
+    else:
+        raise ValueError('precision in cfg not available')
+    if modelDataType != torch.float64:
+        data.astype(modelDataType)
+
     if train_params['nonlinearity'] == 'Tanh':
         nonlinearity = nn.Tanh
     elif train_params['nonlinearity'] == 'Sigmoid':
@@ -219,7 +328,9 @@ def train_helper(learner_params, train_params, dataset_params, directory, fold=N
                          'GSOs': GSOs,  # Graph structure
                          'incidence_matrices': incidence_matrices,
                          'targets': data.targets,
-                         'do_sparse': learner_params['do_sparse']}  # Hyperparameters for the SelectionGNN (selGNN)
+                         'do_sparse': learner_params['do_sparse'],
+                         'persistentGSOs': learner_params['persistent_gsos'],
+                         'filterTypes': learner_params['filter_types']}  # Hyperparameters for the SelectionGNN (selGNN)
 
         hParamsDict = hParamsLocGNN
     elif learner_params['gnn_model'] == 'LocalGNNHGLap':
@@ -241,9 +352,11 @@ def train_helper(learner_params, train_params, dataset_params, directory, fold=N
                          # considering all nodes at once, making the architecture entirely
                          # local.
                          'dimReadout': learner_params['dim_readout'],
-                         'GSOs': HG_normalized_Laplacian_from_incidence(incidence_matrices),  # Graph structure
+                         'GSOs': HG_normalized_Laplacian_from_incidence([B.to_sparse() for B in incidence_matrices]),  # Graph structure
                          'incidence_matrices': incidence_matrices,
-                         'targets': data.targets}  # Hyperparameters for the SelectionGNN (selGNN)
+                         'targets': data.targets,
+                         'persistentGSOs': learner_params['persistent_gsos'],
+                         'filterTypes': learner_params['filter_types']}  # Hyperparameters for the SelectionGNN (selGNN)
 
         hParamsDict = hParamsLocGNN
     elif learner_params['gnn_model'] == 'LocalGNNClique':
@@ -267,7 +380,8 @@ def train_helper(learner_params, train_params, dataset_params, directory, fold=N
                          'dimReadout': learner_params['dim_readout'],
                          'GSOs': [GSOs[0]],  # Graph structure
                          'incidence_matrices': incidence_matrices,
-                         'targets': data.targets}  # Hyperparameters for the SelectionGNN (selGNN)
+                         'targets': data.targets,
+                         'persistentGSOs': learner_params['persistent_gsos']}  # Hyperparameters for the SelectionGNN (selGNN)
 
         hParamsDict = hParamsLocGNN
     elif learner_params['gnn_model'] == 'LocalGNNLine':
@@ -291,7 +405,8 @@ def train_helper(learner_params, train_params, dataset_params, directory, fold=N
                          'dimReadout': learner_params['dim_readout'],
                          'GSOs': [GSOs[1]],  # Graph structure
                          'incidence_matrices': incidence_matrices,
-                         'targets': data.targets}  # Hyperparameters for the SelectionGNN (selGNN)
+                         'targets': data.targets,
+                         'persistentGSOs': learner_params['persistent_gsos']}  # Hyperparameters for the SelectionGNN (selGNN)
 
         hParamsDict = hParamsLocGNN
     elif learner_params['gnn_model'] == 'aggregationGNN':
@@ -385,8 +500,28 @@ def train_helper(learner_params, train_params, dataset_params, directory, fold=N
     ################
     # ARCHITECTURE #
     ################
-    thisArchit = callArchit(**deepcopy(hParamsDict))
-    thisArchit.to(thisDevice)
+    # The graph matrices are not copied, so that on the CPU the architecture keeps using the shared memory copy
+    graphMatrices = {key: list(hParamsDict.pop(key)) for key in ['GSOs', 'incidence_matrices'] if key in hParamsDict}
+    # Estimate of the memory that training will take, per layer, before building the architecture
+    if train_params['estimate_memory'] and 'dimSignals' in hParamsDict.keys():
+        targets = hParamsDict.get('targets')
+        printMemoryReport(estimateLocalGNNMemory(
+            hParamsDict['dimSignals'], hParamsDict['nFilterTaps'], hParamsDict['dimReadout'],
+            train_params['batch_size'], graphMatrices['GSOs'], graphMatrices['incidence_matrices'],
+            bias=hParamsDict['bias'], filterTypes=hParamsDict.get('filterTypes'),
+            fused=True if learner_params['fused_forward'] else None,
+            nReadoutNodes=len(targets) if targets is not None and np.ndim(targets) == 1 else None,
+            dataType=modelDataType, optimizerStates=2 if train_params['optim_alg'] == 'ADAM' else 0))
+    thisArchit = callArchit(**deepcopy(hParamsDict), **graphMatrices)
+    thisArchit.to(device=thisDevice, dtype=modelDataType)
+    if autocastDataType is not None:
+        thisArchit.enableAutocast(autocastDataType)
+    # Fused (and optionally compiled) graph filtering layers
+    if learner_params['fused_forward']:
+        thisArchit.enableFusedForward(compile=learner_params['compile_forward'])
+    # Only run the last graph filtering layers on the receptive field of the targets
+    if learner_params['prune_receptive_field']:
+        thisArchit.enableReceptiveFieldPruning()
 
     #############
     # OPTIMIZER #
@@ -429,25 +564,39 @@ def train_helper(learner_params, train_params, dataset_params, directory, fold=N
     print()
     print("Training model %s..." % thisName)
 
+    trainOptions = {'validationInterval': train_params['validation_interval'],
+                    'printInterval': train_params['print_interval'],
+                    'integral_lipschitz': train_params['integral_lipschitz_constant'],
+                    'numWorkers': train_params['num_workers'],
+                    'prefetchFactor': train_params['prefetch_factor'],
+                    'pinMemory': train_params['pin_memory'],
+                    'pruner': pruner,
+                    'subgraphSampling': train_params['subgraph_sampling'],
+                    'transductive': train_params['transductive'],
+                    'worldSize': train_params['world_size'],
+                    'profile': train_params['profile'],
+                    'trackMemory': train_params['track_memory'],
+                    'autoBatchSize': train_params['auto_batch_size'],
+                    'memoryBudget': (None if train_params['memory_budget'] is None
+                                     else int(train_params['memory_budget'] * 2**20)),
+                    'learningRateScaling': train_params['lr_scaling'],
+                    'doLogging': train_params['do_logging']}
     if train_params['lr_decay']:
-        thisTrainVars = modelsGNN[thisName].train(data, train_params['n_epochs'], train_params['batch_size'],
-                                                  validationInterval=train_params['validation_interval'],
-                                                  printInterval=train_params['print_interval'],
-                                                  learningRateDecayRate=train_params['lr_decay_rate'],
-                                                  learningRateDecayPeriod=train_params['lr_decay_period'],
-                                                  integral_lipschitz=train_params['integral_lipschitz_constant'])
-    else:
-        thisTrainVars = modelsGNN[thisName].train(data, train_params['n_epochs'], train_params['batch_size'],
-                                                  validationInterval=train_params['validation_interval'],
-                                                  printInterval=train_params['print_interval'],
-                                                  integral_lipschitz=train_params['integral_lipschitz_constant'])
+        trainOptions['learningRateDecayRate'] = train_params['lr_decay_rate']
+        trainOptions['learningRateDecayPeriod'] = train_params['lr_decay_period']
+
+    thisTrainVars = modelsGNN[thisName].train(data, train_params['n_epochs'], train_params['batch_size'],
+                                              **trainOptions)
 
     ###########
     # TESTING #
     ###########
     print()
     print("Evaluating model %s..." % thisName)
-    thisTestVars = modelsGNN[thisName].evaluate(data)
+    testOptions = {'transductive': train_params['transductive']}
+    if train_params['auto_batch_size']:
+        testOptions['batchSize'] = thisTrainVars['evalBatchSize']
+    thisTestVars = modelsGNN[thisName].evaluate(data, **testOptions)
 
     writeVarValues(varsFile,
                    {'costBestl%s%03dR%02d' % \
@@ -458,9 +607,15 @@ def train_helper(learner_params, train_params, dataset_params, directory, fold=N
     if cmd_args.saveModel:
         print()
         print("Saving model...")
-        model_save_file = save_dir / 'savedModels' / 'completeModel.pkl'
-        with open(model_save_file, 'wb') as handle:
-            pickle.dump(modelsGNN[thisName], handle, protocol=pickle.HIGHEST_PROTOCOL)
+        # Only the state of the architecture and the optimizer is saved, along with the parameters needed to build
+        # them again (the GSOs are only included in the state if persistent_gsos is set)
+        model_save_file = save_dir / 'savedModels' / 'completeModel.pt'
+        os.makedirs(model_save_file.parent, exist_ok=True)
+        torch.save({'archit': modelsGNN[thisName].archit.state_dict(),
+                    'optim': modelsGNN[thisName].optim.state_dict(),
+                    'learner_params': learner_params,
+                    'train_params': train_params,
+                    'dataset_params': dataset_params}, model_save_file)
         print("Model saved at " + str(save_dir))
 
     print()
@@ -649,7 +804,7 @@ def create_plots(save_dir, trainVars, testVars):
     fig.savefig(os.path.join(save_dir, 'figs.png'), dpi=200)
 
 
-def run_experiment(args, section_name='', fold=None):
+def run_experiment(args, section_name='', fold=None, pruner=None):
     train_params = {
         'n_epochs': args.getint('n_epochs', 50),
         'batch_size': args.getint('batch_size', 20),
@@ -664,7 +819,23 @@ def run_experiment(args, section_name='', fold=None):
         'lr_decay_rate': args.getfloat('lr_decay_rate', 0.9),
         'lr_decay_period': args.getint('lr_decay_period', 1),
         'validation_interval': args.getint('validation_interval', 5),
-        'print_interval': args.getint('print_interval', 5)
+        'print_interval': args.getint('print_interval', 5),
+        'num_workers': args.getint('num_workers', 0),
+        'prefetch_factor': args.getint('prefetch_factor', 2),
+        'pin_memory': args.getboolean('pin_memory', torch.cuda.is_available()),
+        'subgraph_sampling': args.getboolean('subgraph_sampling', False),
+        'transductive': args.getboolean('transductive', False),
+        'world_size': args.getint('world_size', cmd_args.worldSize),
+        # Time each phase of the training steps and each layer, and log to tensorboard
+        'profile': args.getboolean('profile', False),
+        'do_logging': args.getboolean('do_logging', False),
+        # Print the estimated memory of the architecture, and record the peak memory of each epoch
+        'estimate_memory': args.getboolean('estimate_memory', False),
+        'track_memory': args.getboolean('track_memory', False),
+        # Tune the batch size for throughput under a memory budget (in MiB), scaling the learning rate with it
+        'auto_batch_size': args.getboolean('auto_batch_size', False),
+        'memory_budget': args.getfloat('memory_budget', None),
+        'lr_scaling': ast.literal_eval(args.get('lr_scaling', "'linear'"))
     }
 
     learner_params = {
@@ -680,6 +851,15 @@ def run_experiment(args, section_name='', fold=None):
         'num_exchanges': args.getint('num_exchanges', '3'),
         'num_GSOs': args.getint('num_GSOs', '1'),
         'do_sparse': args.getboolean('do_sparse', False),
+        'fused_forward': args.getboolean('fused_forward', False),
+        'compile_forward': args.getboolean('compile_forward', False),
+        'prune_receptive_field': args.getboolean('prune_receptive_field', False),
+        'sparse_gsos': args.getboolean('sparse_gsos', False),
+        'factored_gsos': args.getboolean('factored_gsos', False),
+        'sparsify_gsos': ast.literal_eval(args.get('sparsify_gsos', 'None')),
+        'persistent_gsos': args.getboolean('persistent_gsos', False),
+        'precision': args.get('precision', 'float64'),
+        'filter_types': ast.literal_eval(args.get('filter_types', 'None')),
         'interaction_effects': args.getboolean('interaction_effects', False),
         'summary_statistics': ast.literal_eval(args.get('summary_statistics', "['mean']")),
         'embedding_pooling': ast.literal_eval(args.get('embedding_pooling', "['mean']"))
@@ -699,54 +879,53 @@ def run_experiment(args, section_name='', fold=None):
     }
 
     today = datetime.datetime.now().strftime("%Y.%m.%d_%H.%M.%S")
-    directory = Path('models/' + args.get('name', 'localGNNCliqueLine') + '/' + today + section_name)
+    # Folds may run at the same time, so they need their own directories
+    fold_name = '' if fold is None else '_fold' + str(fold)
+    directory = Path('models/' + args.get('name', 'localGNNCliqueLine') + '/' + today + section_name + fold_name)
 
     trainVars, testVars = train_helper(
         learner_params=learner_params,
         train_params=train_params,
         dataset_params=dataset_params,
         directory=directory,
-        fold=fold)
+        fold=fold,
+        pruner=pruner)
 
     return trainVars, testVars
 
 
-# Run multiple experiments, one per fold.
-def run_CV(args, section_name=''):
-    # Get the number of folds for cross-validation
-    num_folds = args.getint('num_folds', None)
+# Average the training and testing variables across the cross-validation folds
+def aggregate_cv(trainVarsCV, testVarsCV):
+    num_folds = len(trainVarsCV)
+    thisTrainVars = trainVarsCV[0]
+    thisTestVars = testVarsCV[0]
 
-    if num_folds is None:
-        thisTrainVars, thisTestVars = run_experiment(args, section_name, fold=None)
-    else:
-        trainVarsCV = []
-        testVarsCV = []
+    train_keys = ['lossTrain', 'costTrain', 'lossValid', 'costValid', 'costValidBest']
+    test_keys = ['costBest', 'costLast', 'confusionMatrixBest', 'confusionMatrixLast']
 
-        for k in range(num_folds):
-            trainVarsExperiment, testVarsExperiment = run_experiment(args, section_name, fold=k)
-            trainVarsCV.append(trainVarsExperiment)
-            testVarsCV.append(testVarsExperiment)
+    for key_name in train_keys:
+        stacked_vars = np.stack([trainVarsCV[k][key_name] for k in range(num_folds)])
+        thisTrainVars[key_name] = np.mean(stacked_vars, axis=0)
+        thisTrainVars[key_name + '_std'] = np.std(stacked_vars, axis=0)
 
-        thisTrainVars = trainVarsCV[0]
-        thisTestVars = testVarsCV[0]
+    for key_name in test_keys:
+        stacked_vars = np.stack([testVarsCV[k][key_name] for k in range(num_folds)])
+        thisTestVars[key_name] = np.mean(stacked_vars, axis=0)
+        thisTestVars[key_name + '_std'] = np.std(stacked_vars, axis=0)
 
-        # Average across the cross-validation folds
-        train_keys = ['lossTrain', 'costTrain', 'lossValid', 'costValid', 'costValidBest']
-        test_keys = ['costBest', 'costLast', 'confusionMatrixBest', 'confusionMatrixLast']
+    # Take maximum for integral Lipschitz constant
+    if thisTestVars['IL_constant_best'] is not None:
+        thisTestVars['IL_constant_best'] = [testVarsCV[k]['IL_constant_best'] for k in range(num_folds)]
 
-        for key_name in train_keys:
-            stacked_vars = np.stack([trainVarsCV[k][key_name] for k in range(num_folds)])
-            thisTrainVars[key_name] = np.mean(stacked_vars, axis=0)
-            thisTrainVars[key_name + '_std'] = np.std(stacked_vars, axis=0)
+    return thisTrainVars, thisTestVars
 
-        for key_name in test_keys:
-            stacked_vars = np.stack([testVarsCV[k][key_name] for k in range(num_folds)])
-            thisTestVars[key_name] = np.mean(stacked_vars, axis=0)
-            thisTestVars[key_name + '_std'] = np.std(stacked_vars, axis=0)
 
-        # Take maximum for integral Lipschitz constant
-        if thisTestVars['IL_constant_best'] is not None:
-            thisTestVars['IL_constant_best'] = [testVarsCV[k]['IL_constant_best'] for k in range(num_folds)]
+# Aggregate the folds of a section (if there are any) and plot the results
+def finish_cv(args, section_name, trainVarsCV, testVarsCV):
+    if args.getint('num_folds', None) is None:
+        thisTrainVars, thisTestVars = trainVarsCV[0], testVarsCV[0]
+    else:
+        thisTrainVars, thisTestVars = aggregate_cv(trainVarsCV, testVarsCV)
 
     # Plot results
     print()
@@ -760,33 +939,257 @@ def run_CV(args, section_name=''):
     return thisTrainVars, thisTestVars
 
 
+# Folds to run for a section (a single experiment without a fold if there is no cross-validation)
+def section_folds(args):
+    num_folds = args.getint('num_folds', None)
+    return [None] if num_folds is None else list(range(num_folds))
+
+
+# Run multiple experiments, one per fold.
+def run_CV(args, section_name=''):
+    trainVarsCV = []
+    testVarsCV = []
+
+    for k in section_folds(args):
+        trainVarsExperiment, testVarsExperiment = run_experiment(args, section_name, fold=k)
+        trainVarsCV.append(trainVarsExperiment)
+        testVarsCV.append(testVarsExperiment)
+
+    return finish_cv(args, section_name, trainVarsCV, testVarsCV)
+
+
+# Set up each fold worker process: limit its number of torch threads (so that the workers do not oversubscribe the
+# cores) and hand it the graph matrices already loaded in shared memory.
+def init_fold_worker(threads_per_worker, matrices):
+    torch.set_default_dtype(torch.float64)
+    torch.set_num_threads(threads_per_worker)
+    matrixCache.update(matrices)
+
+
+# Run a single (section, fold) experiment in a fold worker. Sections are passed as plain dicts, since configparser
+# sections cannot be pickled.
+def run_fold_job(job):
+    section_name, section_dict, fold = job
+    config = configparser.ConfigParser()
+    config.read_dict({section_name: section_dict})
+    # Pool workers cannot start processes of their own, so the batches are built on the training thread, and each
+    # model is trained by a single process
+    if config[section_name].getint('num_workers', 0) > 0:
+        config[section_name]['num_workers'] = '0'
+    config[section_name]['world_size'] = '1'
+    trainVars, testVars = run_experiment(config[section_name], section_name, fold=fold)
+    return section_name, fold, trainVars, testVars
+
+
+# Run every fold of every section, as a pool of worker processes. Once all the folds of all the sections are done,
+# they are aggregated per section as in run_CV, and returned in the format summarize_cv expects.
+def run_sections(config, section_names, workers=1, threads_per_worker=None):
+    if workers <= 1:
+        cvParams = {}
+        for section_name in section_names:
+            trainVars, testVars = run_CV(config[section_name], section_name)
+            cvParams[section_name] = {'trainVars': trainVars, 'testVars': testVars, 'config': config[section_name]}
+        return cvParams
+
+    if threads_per_worker is None:
+        threads_per_worker = max(1, os.cpu_count() // workers)
+
+    # Load the graph matrices once, before starting the workers
+    for section_name in section_names:
+        section = config[section_name]
+        load_matrices(section.get('matrix_path', '../data/sourceLoc/sourceLoc'),
+                      formed_gsos_needed(section.get('gnn_model', 'LocalGNNCliqueLine'),
+                                         section.getboolean('factored_gsos', False)))
+
+    jobs = [(section_name, dict(config[section_name]), fold)
+            for section_name in section_names for fold in section_folds(config[section_name])]
+    results = {section_name: {} for section_name in section_names}
+
+    # CUDA cannot be used in forked processes
+    context = mp.get_context('spawn' if torch.cuda.is_available() else 'fork')
+    with context.Pool(min(workers, len(jobs)), initializer=init_fold_worker,
+                      initargs=(threads_per_worker, matrixCache)) as pool:
+        for section_name, fold, trainVars, testVars in pool.imap_unordered(run_fold_job, jobs):
+            print("Finished %s (fold %s)" % (section_name, fold), flush=True)
+            results[section_name][fold] = (trainVars, testVars)
+
+    cvParams = {}
+    for section_name in section_names:
+        folds = section_folds(config[section_name])
+        trainVars, testVars = finish_cv(config[section_name], section_name,
+                                        [results[section_name][k][0] for k in folds],
+                                        [results[section_name][k][1] for k in folds])
+        cvParams[section_name] = {'trainVars': trainVars, 'testVars': testVars, 'config': config[section_name]}
+
+    return cvParams
+
+
+cvHeader = ['Name', 'Train Cost', 'Validation Cost', 'Validation Mean',
+            'Validation Std', 'UCB', 'LCB', 'Test Mean', 'Test Std', '# Epochs',
+            'LR', 'LR Decay Rate', 'LR Decay Period', '# Features', '# Filter Taps', 'Readout',
+            'C_real', 'C_limit']
+
+
+def make_summary_directory(name):
+    today = datetime.datetime.now().strftime("%Y.%m.%d_%H.%M.%S")
+    directory = 'models/' + name + '/' + today + '_CV_summary'
+    os.makedirs(directory)
+    return directory
+
+
+def write_cv_row(writer, trainVars, testVars, config):
+    # The standard deviations are only there if the section was cross-validated (see aggregate_cv)
+    costValidBestStd = trainVars.get('costValidBest_std', 0)
+    writer.writerow([config.get('gnn_model'), trainVars['costTrain'], trainVars['costValid'],
+                     trainVars['costValidBest'], costValidBestStd,
+                     trainVars['costValidBest'] + costValidBestStd,
+                     trainVars['costValidBest'] - costValidBestStd,
+                     testVars['costBest'], testVars.get('costBest_std', 0),
+                     config.get('n_epochs'), config.get('learning_rate'), config.get('lr_decay_rate'),
+                     config.get('lr_decay_period'), config.get('dim_features'), config.get('num_filter_taps'),
+                     config.get('dim_readout'), testVars['IL_constant_best'],
+                     config.get('integral_lipschitz_constant')])
+
+
 # Take the output from training and write to a single CSV
 def summarize_cv(cvParams):
     name = cvParams[list(cvParams.keys())[0]]['config'].get('name', 'localGNNCliqueLine')
-    today = datetime.datetime.now().strftime("%Y.%m.%d_%H.%M.%S")
-    directory = 'models/' + name + '/' + today + '_CV_summary'
-    os.mkdir(directory)
+    directory = make_summary_directory(name)
 
     with open(directory + '/CV.csv', 'w', newline='') as csvfile:
         writer = csv.writer(csvfile, delimiter=',')
-        writer.writerow(['Name', 'Train Cost', 'Validation Cost', 'Validation Mean',
-                         'Validation Std', 'UCB', 'LCB', 'Test Mean', 'Test Std', '# Epochs',
-                         'LR', 'LR Decay Rate', 'LR Decay Period', '# Features', '# Filter Taps', 'Readout',
-                         'C_real', 'C_limit'])
+        writer.writerow(cvHeader)
 
         for section_name, vars in cvParams.items():
-            trainVars = vars['trainVars']
-            testVars = vars['testVars']
-            config = vars['config']
-            writer.writerow([config.get('gnn_model'), trainVars['costTrain'], trainVars['costValid'],
-                             trainVars['costValidBest'], trainVars['costValidBest_std'],
-                             trainVars['costValidBest'] + trainVars['costValidBest_std'],
-                             trainVars['costValidBest'] - trainVars['costValidBest_std'],
-                             testVars['costBest'], testVars['costBest_std'],
-                             config.get('n_epochs'), config.get('learning_rate'), config.get('lr_decay_rate'),
-                             config.get('lr_decay_period'), config.get('dim_features'), config.get('num_filter_taps'),
-                             config.get('dim_readout'), testVars['IL_constant_best'],
-                             config.get('integral_lipschitz_constant')])
+            write_cv_row(writer, vars['trainVars'], vars['testVars'], vars['config'])
+
+
+# Sweep options: grid(v1, v2, ...) takes each of the values, range(start, stop, step) the values of np.arange and
+# logrange(low, high, num) num values evenly spaced on a log scale (np.geomspace)
+sweepPattern = re.compile(r'^\s*(grid|range|logrange)\((.*)\)\s*$', re.DOTALL)
+
+
+def sweep_values(kind, arguments):
+    if kind == 'grid':
+        try:
+            values = ast.literal_eval('[' + arguments + ']')
+        except (ValueError, SyntaxError):
+            # Plain strings, e.g. grid(ReLU, Sigmoid)
+            values = [value.strip() for value in arguments.split(',')]
+    elif kind == 'range':
+        values = np.arange(*ast.literal_eval('(' + arguments + ',)')).tolist()
+    else:
+        low, high, num = ast.literal_eval('(' + arguments + ')')
+        values = np.geomspace(low, high, int(num)).tolist()
+    return [str(value) for value in values]
+
+
+# Expand the sweep options of a section into one dict of options per trial (the cartesian product of all the sweep
+# options). A section without sweep options is a single trial.
+def expand_sweep(section):
+    options = dict(section)
+    swept = {}
+    for key, value in options.items():
+        match = sweepPattern.match(value)
+        if match is not None:
+            swept[key] = sweep_values(*match.groups())
+
+    trials = []
+    for values in itertools.product(*swept.values()):
+        trial = dict(options)
+        trial.update(zip(swept.keys(), values))
+        trials.append((dict(zip(swept.keys(), values)), trial))
+    return trials
+
+
+# Run the folds of a sweep trial, one after the other. The pruner only watches the first fold: if it stops it, the
+# rest of the folds are not run, and the trial is reported as pruned.
+def run_trial_job(job):
+    trial_name, trial_dict, pruner, in_pool = job
+    config = configparser.ConfigParser()
+    config.read_dict({trial_name: trial_dict})
+    args = config[trial_name]
+    if in_pool and args.getint('num_workers', 0) > 0:
+        args['num_workers'] = '0'
+    if in_pool:
+        args['world_size'] = '1'
+
+    trainVarsCV = []
+    testVarsCV = []
+    for k in section_folds(args):
+        trialPruner = pruner.forTrial(trial_name) if len(trainVarsCV) == 0 else None
+        trainVarsExperiment, testVarsExperiment = run_experiment(args, trial_name, fold=k, pruner=trialPruner)
+        if trainVarsExperiment['pruned']:
+            return trial_name, trainVarsExperiment, None
+        trainVarsCV.append(trainVarsExperiment)
+        testVarsCV.append(testVarsExperiment)
+
+    trainVars, testVars = finish_cv(args, trial_name, trainVarsCV, testVarsCV)
+    return trial_name, trainVars, testVars
+
+
+# Run a hyperparameter sweep: every section is expanded into trials, which are scheduled on a pool of worker
+# processes. The trials of each section share an ASHA pruner (epochs of the first rung and reduction factor given by
+# prune_min_epochs and prune_eta in the section). The summary CSV gets a row as soon as each trial finishes, and
+# trials.csv lists all of them with their swept values, and whether they were pruned.
+def run_sweep(config, section_names, workers=1, threads_per_worker=None):
+    name = config[section_names[0]].get('name', 'localGNNCliqueLine')
+    directory = make_summary_directory(name)
+    in_pool = workers > 1
+
+    if in_pool:
+        if threads_per_worker is None:
+            threads_per_worker = max(1, os.cpu_count() // workers)
+        context = mp.get_context('spawn' if torch.cuda.is_available() else 'fork')
+        manager = context.Manager()
+
+    jobs = []
+    sweptValues = {}
+    trialConfigs = {}
+    for section_name in section_names:
+        section = config[section_name]
+        minEpochs = section.getint('prune_min_epochs', 1)
+        eta = section.getint('prune_eta', 3)
+        if in_pool:
+            pruner = ASHAPruner(minEpochs, eta, manager.dict(), manager.Lock())
+            load_matrices(section.get('matrix_path', '../data/sourceLoc/sourceLoc'),
+                          formed_gsos_needed(section.get('gnn_model', 'LocalGNNCliqueLine'),
+                                             section.getboolean('factored_gsos', False)))
+        else:
+            pruner = ASHAPruner(minEpochs, eta)
+        for t, (swept, trial_dict) in enumerate(expand_sweep(section)):
+            trial_name = section_name + '_trial%03d' % t
+            sweptValues[trial_name] = swept
+            trialConfigs[trial_name] = trial_dict
+            jobs.append((trial_name, trial_dict, pruner, in_pool))
+    print("Running %d trials..." % len(jobs), flush=True)
+
+    with open(directory + '/CV.csv', 'w', newline='') as csvfile, \
+            open(directory + '/trials.csv', 'w', newline='') as trialsfile:
+        writer = csv.writer(csvfile, delimiter=',')
+        writer.writerow(cvHeader)
+        trialsWriter = csv.writer(trialsfile, delimiter=',')
+        trialsWriter.writerow(['Trial', 'Swept Values', 'Pruned', '# Epochs Run', 'Validation Best'])
+
+        # Write the results of each trial as soon as it is done
+        def write_trial(trial_name, trainVars, testVars):
+            pruned = testVars is None
+            if not pruned:
+                write_cv_row(writer, trainVars, testVars, trialConfigs[trial_name])
+                csvfile.flush()
+            trialsWriter.writerow([trial_name, json.dumps(sweptValues[trial_name]), pruned,
+                                   trainVars['nEpochsRun'], trainVars['costValidBest']])
+            trialsfile.flush()
+            print("Finished %s%s" % (trial_name, ' (pruned)' if pruned else ''), flush=True)
+
+        if in_pool:
+            with context.Pool(min(workers, len(jobs)), initializer=init_fold_worker,
+                              initargs=(threads_per_worker, matrixCache)) as pool:
+                for result in pool.imap_unordered(run_trial_job, jobs):
+                    write_trial(*result)
+        else:
+            for job in jobs:
+                write_trial(*run_trial_job(job))
 
 
 def main():
@@ -797,10 +1200,10 @@ def main():
     today = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
     cvParams = {}
 
-    if config.sections():
-        for section_name in config.sections():
-            trainVars, testVars = run_CV(config[section_name], section_name)
-            cvParams[section_name] = {'trainVars': trainVars, 'testVars': testVars, 'config': config[section_name]}
+    if config.sections() and cmd_args.sweep:
+        run_sweep(config, config.sections(), cmd_args.workers, cmd_args.threadsPerWorker)
+    elif config.sections():
+        cvParams = run_sections(config, config.sections(), cmd_args.workers, cmd_args.threadsPerWorker)
         summarize_cv(cvParams)
     else:
         trainVars, testVars = run_experiment(config[config.default_section])
@@ -0,0 +1,84 @@
+import numpy as np
+import torch
+
+
+class hypergraphDataset(torch.utils.data.Dataset):
+    """
+    hypergraphDataset: Exposes one split of a data object (hypergraphSources,
+        dhgData) as a torch Dataset, so that batches can be built by the worker
+        processes of a torch.utils.data.DataLoader while the model is training.
+
+    Initialization:
+
+    Input:
+        data (class): data object, needs a .getBatch(samplesType, inds) method
+            returning the signals, labels and readout targets of the samples
+        samplesType (string): 'train', 'valid' or 'test'
+        dense (bool): if True, sparse signals are converted to dense tensors
+            when building the batch (default: False)
+
+    Methods:
+
+    x, y, targets = .collate(inds): builds the batch made of samples inds. Items
+        of the dataset are just the sample indices, so this is meant to be used
+        as the collate_fn of the DataLoader, and the whole batch (including any
+        sparse tensor assembly) is built in a single call inside the worker.
+    """
+
+    def __init__(self, data, samplesType, dense=False):
+        assert samplesType == 'train' or samplesType == 'valid' \
+               or samplesType == 'test'
+        self.data = data
+        self.samplesType = samplesType
+        self.dense = dense
+
+    def __len__(self):
+        return self.data.samples[self.samplesType]['targets'].shape[0]
+
+    def __getitem__(self, ind):
+        return int(ind)
+
+    def collate(self, inds):
+        x, y, targets = self.data.getBatch(self.samplesType, list(inds))
+        if self.dense and x.is_sparse:
+            x = x.to_dense()
+        return x, y, targets
+
+
+class epochBatchSampler(torch.utils.data.Sampler):
+    """
+    epochBatchSampler: Yields the batches of one epoch, following the batch
+        sizes used by the trainers. Every time it is iterated over (i.e., every
+        epoch), a new random permutation of the samples is drawn.
+
+    Initialization:
+
+    Input:
+        nSamples (int): number of samples in the split
+        batchIndex (list of int): first and last sample of each batch, as built
+            by the trainers (batchIndex[b]:batchIndex[b+1] is batch b)
+    """
+
+    def __init__(self, nSamples, batchIndex):
+        self.nSamples = nSamples
+        self.batchIndex = batchIndex
+
+    def __len__(self):
+        return len(self.batchIndex) - 1
+
+    def __iter__(self):
+        randomPermutation = np.random.permutation(self.nSamples)
+        for b in range(len(self)):
+            yield [int(i) for i in randomPermutation[self.batchIndex[b]:self.batchIndex[b + 1]]]
+
+
+# Creates the DataLoader for a split of the data object. The workers are kept alive between epochs, and each of them
+# keeps prefetchFactor batches ready, so that building the batches overlaps with the forward/backward pass.
+def makeDataLoader(data, samplesType, batchSampler, numWorkers=0, pinMemory=False, prefetchFactor=2, dense=False):
+    dataset = data.getDataset(samplesType, dense=dense)
+    loaderOptions = {}
+    if numWorkers > 0:
+        loaderOptions['prefetch_factor'] = prefetchFactor
+        loaderOptions['persistent_workers'] = True
+    return torch.utils.data.DataLoader(dataset, batch_sampler=batchSampler, collate_fn=dataset.collate,
+                                       num_workers=numWorkers, pin_memory=pinMemory, **loaderOptions)
@@ -3,6 +3,7 @@ import pickle
 import torch
 from Utils import *
 from Hypergraphs import *
+from Operator_Cache import OperatorCache, save_operators
 from Source_Localization import hypergraphSources
 
 if __name__ == '__main__':
@@ -17,16 +18,11 @@ if __name__ == '__main__':
     num_steps = 20
     useGPU = True
 
-    GSOs = [H.clique_laplacian(), H.line_laplacian()]
-    print('Generated GSOs.')
-    incidence_matrix = [H.incidence_matrix()]
-    print('Created incidence matrix.')
+    GSOs, incidence_matrix = OperatorCache().get_operators(H, ['clique', 'line'])
+    print('Generated GSOs and incidence matrix.')
     data = hypergraphSources(H, nTrain, nValid, nTest, sourceHyperedges, tMax=num_steps, dataType=torch.float64,
                              device='cuda:0' if (useGPU and torch.cuda.is_available()) else 'cpu')
     print('Generated sources.')
-    with open('../Learning/data/sourceLoc/sourceLoc_GSOs.pkl','wb') as f:
-        pickle.dump(GSOs, f)
-    with open('../Learning/data/sourceLoc/sourceLoc_incidence_matrices.pkl', 'wb') as f:
-        pickle.dump(incidence_matrix, f)
+    save_operators('../Learning/data/sourceLoc/sourceLoc', GSOs, incidence_matrix)
     with open('../Learning/data/sourceLoc/sourceLoc_data.pkl', 'wb') as f:
         pickle.dump(data, f)
@@ -5,6 +5,7 @@ from Utils import *
 from Source_Localization import hypergraphSources
 from Simplicial_Complexes import *
 from Hypergraphs import *
+from Operator_Cache import OperatorCache, save_operators
 import numpy as np
 import tadasets
 
@@ -38,13 +39,10 @@ if __name__ == '__main__':
     # plot_2d_sc(SC, '../Learning/data/sourceLoc/')
     # plot_2d_hg(H, None, sourceHyperedges, '../Learning/data/sourceLoc/')
 
-    # Generate the GSOs for the clique and line expansion
-    print('Generating GSOs...')
-    GSOs = [H.clique_laplacian(), H.line_laplacian()]
-
-    # Compute the incidence matrix
-    print('Creating incidence matrix...')
-    incidence_matrix = [H.incidence_matrix()]
+    # Generate the GSOs for the clique and line expansion, and the incidence matrix (or load them from the cache, if
+    # they were already built for this hypergraph)
+    print('Generating GSOs and incidence matrix...')
+    GSOs, incidence_matrix = OperatorCache().get_operators(H, ['clique', 'line'])
 
     # Create the samples for source localization
     mu = np.zeros(H.N)          # mean of multivariate normal measurement noise
@@ -58,9 +56,6 @@ if __name__ == '__main__':
 
     # Save everythingclear
     print('Saving...')
-    with open('../Learning/data/sourceLoc/sourceLoc_GSOs.pkl','wb') as f:
-        pickle.dump(GSOs, f)
-    with open('../Learning/data/sourceLoc/sourceLoc_incidence_matrices.pkl', 'wb') as f:
-        pickle.dump(incidence_matrix, f)
+    save_operators('../Learning/data/sourceLoc/sourceLoc', GSOs, incidence_matrix)
     with open('../Learning/data/sourceLoc/sourceLoc_data.pkl', 'wb') as f:
         pickle.dump(data, f)
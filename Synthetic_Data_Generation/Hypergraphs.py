@@ -1,10 +1,16 @@
+import os
+import sys
 import numpy as np
+import scipy.sparse
 import torch
 import networkx as nx
 from Simplicial_Complexes import SimplicialComplex
 from tqdm import tqdm
 import csv
 
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Learning'))
+from sparseGraphML import FactoredGSO
+
 
 # Computes a maximal hypergraph from the simplicial complex. In other words, takes all nodes from the SC,
 # and adds hyperedges corresponding to the largest-order simplices in the SC (ignoring lower-order faces).
@@ -14,38 +20,242 @@ def from_SC(S : SimplicialComplex):
 
 # Loads hyperedges from a CSV
 def from_CSV(fname):
+    return Hypergraph(read_CSV(fname))
+
+
+# Reads the hyperedges in a CSV, one per row (skipping those with more than 25 nodes). These can also be added to an
+# existing hypergraph, with Hypergraph.add_hyperedges
+def read_CSV(fname):
     hyperedge_list = []
     with open(fname, newline='') as csvfile:
         reader = csv.reader(csvfile, delimiter=',')
         for row in reader:
             if len(row) <= 25:
                 hyperedge_list.append(row)
-    return Hypergraph(hyperedge_list)
+    return hyperedge_list
+
+
+# Sparse (N x M) incidence matrix of the hyperedges given (lists of node indices)
+def sparse_incidence(hyperedges, N):
+    hyperedges = [sorted(set(hedge)) for hedge in hyperedges]
+    rows = np.array([v for hedge in hyperedges for v in hedge], dtype=np.int64)
+    cols = np.repeat(np.arange(len(hyperedges)), [len(hedge) for hedge in hyperedges])
+    return scipy.sparse.csc_matrix((np.ones(len(rows)), (rows, cols)), shape=(N, len(hyperedges)))
+
+
+# Weighted adjacency matrix where the weight between two rows of B is the number of columns where both are nonzero,
+# i.e., B B^T without the diagonal. For the incidence matrix B, this is the adjacency of the clique expansion, and for
+# B^T the one of the line expansion.
+def overlap_adjacency(B):
+    A = (B @ B.T).tocsr()
+    A.setdiag(0)
+    A.eliminate_zeros()
+    return A
+
+
+# Rows of the normalized Laplacian D^-1/2 (D - A) D^-1/2 of the adjacency A with degrees d, at the rows given (the same
+# as networkx.normalized_laplacian_matrix, so nodes without neighbors have a 0 in the diagonal). Returns them as a
+# sparse matrix with the shape of A, that is zero outside of those rows.
+def normalized_laplacian_rows(A, degrees, rows):
+    with np.errstate(divide='ignore'):
+        d_neghalf = np.where(degrees > 0, degrees, np.inf) ** (-1/2)
+    A_rows = A[rows].tocoo()
+    r = rows[A_rows.row]
+    values = -A_rows.data * d_neghalf[r] * d_neghalf[A_rows.col]
+    diagonal = (degrees[rows] > 0).astype(np.float64)
+    return scipy.sparse.csr_matrix((np.concatenate((values, diagonal)),
+                                    (np.concatenate((r, rows)), np.concatenate((A_rows.col, rows)))), shape=A.shape)
+
+
+# Brings a cached normalized Laplacian L up to date with the adjacency A and degrees d, recomputing only the rows and
+# columns that are dirty (those of the nodes whose edges, and so whose degree, changed); the rest of the entries only
+# depend on the degrees at both ends, which did not change. If L is None, it is computed from scratch.
+def refresh_laplacian(L, A, degrees, dirty):
+    if L is None:
+        return normalized_laplacian_rows(A, degrees, np.arange(A.shape[0]))
+    rows = np.nonzero(dirty)[0]
+    if len(rows) == 0:
+        return L
+    keep = scipy.sparse.diags((~dirty).astype(np.float64))
+    L_rows = normalized_laplacian_rows(A, degrees, rows)
+    # The Laplacian is symmetric, so the dirty columns are the transpose of the dirty rows (without counting the
+    # entries where both the row and the column are dirty twice)
+    L_both = L_rows[rows][:, rows].tocoo()
+    L_both = scipy.sparse.csr_matrix((L_both.data, (rows[L_both.row], rows[L_both.col])), shape=A.shape)
+    L = keep @ L @ keep + L_rows + L_rows.T - L_both
+    L.eliminate_zeros()
+    return L.tocsr()
+
+
+# Returns a (scipy) sparse matrix as a copy in a scipy sparse array, or as a torch sparse tensor
+def as_sparse_output(L, as_tensor):
+    L = scipy.sparse.csr_array(L)
+    if as_tensor:
+        L = L.tocoo()
+        return torch.sparse_coo_tensor(np.array([L.row, L.col]), torch.tensor(L.data), L.shape)
+    return L
 
 
-# Creates a normalized hypergraph Laplacian matrix from a hypergraph incidence matrix
+# Creates the normalized hypergraph Laplacian I - D_u^-1/2 B D_e^-1 B^T D_u^-1/2 of each hypergraph incidence matrix B
+# (a dense or sparse torch tensor), as an implicit 1 x N x N GSO (FactoredGSO) that only keeps B and the diagonal
+# scalings, so the N x N Laplacian is never formed. Nodes without hyperedges get a 1 in the diagonal (and hyperedges
+# without nodes are left out).
 def HG_normalized_Laplacian_from_incidence(B_list):
     L_list = []
 
     for B in B_list:
-        hedge_weights = torch.sum(B, axis=0)
-        D_e_inv = torch.float_power(hedge_weights, -1)
-        node_weights = torch.sum(B, axis=1)
-        D_u_neghalf = torch.float_power(node_weights, -1/2)
-        BD_u = (B.T * D_u_neghalf)
-        L = torch.eye(B.shape[0], device=B.device) - BD_u.T * D_e_inv @ BD_u
+        if not B.is_sparse:
+            B = B.to_sparse()
+        B = B.coalesce()
+        hedge_weights = torch.sparse.sum(B, dim=0).to_dense()
+        node_weights = torch.sparse.sum(B, dim=1).to_dense()
+        D_e_inv = torch.zeros(B.shape[1], dtype=B.dtype, device=B.device)
+        D_e_inv[hedge_weights > 0] = 1 / hedge_weights[hedge_weights > 0]
+        D_u_neghalf = torch.zeros(B.shape[0], dtype=B.dtype, device=B.device)
+        D_u_neghalf[node_weights > 0] = node_weights[node_weights > 0] ** (-1/2)
+        L = FactoredGSO(B, -D_e_inv, scale=D_u_neghalf, diagonal=torch.ones(B.shape[0], dtype=B.dtype, device=B.device))
         L_list.append(L)
     return L_list
 
+# Builders of the GSO (a scipy sparse matrix) of each expansion of a hypergraph H into a graph. They all start from the
+# same pass over the incidence matrix, H.incidence_pass(), or from the operators that H keeps up to date.
+
+# Normalized Laplacian of the clique expansion, where two nodes are adjacent with weight the number of hyperedges shared
+def clique_gso(H):
+    return H.clique_laplacian()
+
+
+# Normalized Laplacian of the line expansion, where two hyperedges are adjacent with weight the number of nodes shared
+def line_gso(H):
+    return H.line_laplacian()
+
+
+# Normalized Laplacian of the star (bipartite) expansion, on the nodes followed by the hyperedges, where each node is
+# adjacent to the hyperedges it is in
+def star_gso(H):
+    B, _, _ = H.incidence_pass()
+    A = scipy.sparse.bmat([[None, B], [B.T, None]], format='csr')
+    return normalized_laplacian_rows(A, np.asarray(A.sum(axis=1)).flatten(), np.arange(A.shape[0]))
+
+
+# Normalized Laplacian of the clique expansion where each hyperedge e adds 1/(|e|-1) to the weight between each pair of
+# its nodes, so that each node gets a total weight of 1 from each hyperedge it is in, whatever its size
+def weighted_clique_gso(H):
+    B, _, sizes = H.incidence_pass()
+    weights = np.zeros(len(sizes))
+    weights[sizes > 1] = 1 / (sizes[sizes > 1] - 1)
+    A = overlap_adjacency(B @ scipy.sparse.diags(np.sqrt(weights)))
+    return normalized_laplacian_rows(A, np.asarray(A.sum(axis=1)).flatten(), np.arange(A.shape[0]))
+
+
+# Normalized hypergraph Laplacian of Zhou et al., I - D_v^-1/2 B D_e^-1 B^T D_v^-1/2 (with unit hyperedge weights), the
+# formed (scipy) counterpart of HG_normalized_Laplacian_from_incidence. Nodes without hyperedges get a 1 in the
+# diagonal.
+def zhou_gso(H):
+    B, degrees, sizes = H.incidence_pass()
+    d_neghalf = np.zeros(len(degrees))
+    d_neghalf[degrees > 0] = degrees[degrees > 0] ** (-1/2)
+    e_inv = np.zeros(len(sizes))
+    e_inv[sizes > 0] = 1 / sizes[sizes > 0]
+    BD = scipy.sparse.diags(d_neghalf) @ B
+    return (scipy.sparse.eye(B.shape[0]) - BD @ scipy.sparse.diags(e_inv) @ BD.T).tocsr()
+
+
+# Expansions available, by name: the set the graph is on ('nodes', 'hyperedges', or 'both', i.e. the nodes followed by
+# the hyperedges) and the builder of its GSO. New expansions can be added with register_expansion.
+expansions = {'clique': ('nodes', clique_gso),
+              'line': ('hyperedges', line_gso),
+              'star': ('both', star_gso),
+              'weighted_clique': ('nodes', weighted_clique_gso),
+              'zhou': ('nodes', zhou_gso)}
+
+
+# Adds an expansion to the ones available, with builder(H) returning its GSO as a scipy sparse matrix
+def register_expansion(name, domain, builder):
+    assert domain in ['nodes', 'hyperedges', 'both']
+    expansions[name] = (domain, builder)
+
+
 class Hypergraph:
     def __init__(self, hyperedges=[], signals=None):
         self.N = 0
         self.node_map = {}
         self.hyperedges = list(map(lambda hedge: sorted([self.map_node(v) for v in hedge]), hyperedges))
         self.M = len(self.hyperedges)
-        self.B = self.incidence_matrix()
+        # The sparse incidence matrix, the adjacencies of the clique and line expansions and their degrees are kept up
+        # to date by add_nodes, add_hyperedges and remove_hyperedges. The normalized Laplacians are only computed when
+        # asked for, and then only at the rows marked as dirty since the last time.
+        self.incidence = sparse_incidence(self.hyperedges, self.N)
+        self.reset_operators()
+        self.build_expansions()
         self.laplacian = self.laplacian_operator
 
+    # Hypergraph on the nodes 0, ..., N-1 with the given (N x M, scipy sparse) incidence matrix, whose nonzero entries
+    # are taken as ones. Unlike the constructor, it does not go through the nodes of each hyperedge one by one, and the
+    # expansions are only built when they are first needed (see build_expansions), so it is the way to make large
+    # hypergraphs (e.g. the ones in Random_Hypergraphs).
+    @classmethod
+    def from_incidence(cls, B):
+        H = cls.__new__(cls)
+        B = scipy.sparse.csc_matrix(B, dtype=np.float64)
+        B.sum_duplicates()
+        B.eliminate_zeros()
+        B.data[:] = 1
+        B.sort_indices()
+        H.N, H.M = B.shape
+        H.node_map = dict(zip(range(H.N), range(H.N)))
+        H.hyperedges = [hedge.tolist() for hedge in np.split(B.indices, B.indptr[1:-1])] if H.M > 0 else []
+        H.incidence = B
+        H.reset_operators()
+        H.laplacian = H.laplacian_operator
+        return H
+
+    # Drops the operators derived from the incidence matrix, so that they are built again when needed
+    def reset_operators(self):
+        self.clique_adjacency, self.line_adjacency = None, None
+        self.clique_degrees, self.line_degrees = None, None
+        self.clique_dirty, self.line_dirty = None, None
+        self.clique_L, self.line_L = None, None
+        # See incidence_pass
+        self.incidence_stats = None
+
+    # Builds the adjacencies of the clique and line expansions and their degrees, if they are not built yet. From then
+    # on, they are kept up to date as the hypergraph changes.
+    def build_expansions(self):
+        if self.clique_adjacency is not None:
+            return
+        self.clique_adjacency = overlap_adjacency(self.incidence)
+        self.line_adjacency = overlap_adjacency(self.incidence.T)
+        self.clique_degrees = np.asarray(self.clique_adjacency.sum(axis=1)).flatten()
+        self.line_degrees = np.asarray(self.line_adjacency.sum(axis=1)).flatten()
+        self.clique_dirty = np.zeros(self.N, dtype=bool)
+        self.line_dirty = np.zeros(self.M, dtype=bool)
+
+    # One pass over the incidence matrix, shared by the builders of the expansions: the incidence matrix in CSR format,
+    # the degree of each node (number of hyperedges it is in) and the size of each hyperedge. Kept until the hypergraph
+    # changes.
+    def incidence_pass(self):
+        if self.incidence_stats is None:
+            B = self.incidence.tocsr()
+            self.incidence_stats = (B, np.asarray(B.sum(axis=1)).flatten(), np.asarray(B.sum(axis=0)).flatten())
+        return self.incidence_stats
+
+    # GSO of the expansion with the given name (see expansions), as a scipy sparse array or as a torch sparse tensor
+    def expansion_gso(self, name, as_tensor=False):
+        if name not in expansions:
+            raise ValueError('expansion {} not available'.format(name))
+        return as_sparse_output(expansions[name][1](self), as_tensor)
+
+    # GSOs of the expansions with the given names, built from the same incidence pass, as torch sparse tensors (or as
+    # scipy sparse arrays)
+    def expansion_gsos(self, names, as_tensor=True):
+        return [self.expansion_gso(name, as_tensor) for name in names]
+
+    # Dense incidence matrix
+    @property
+    def B(self):
+        return self.incidence_matrix()
+
     # Maps nodes. If it's been seen before, this assigns the old value, otherwise increments node count.
     # node_map is the same as a defaultdict object, but faster with large datasets.
     def map_node(self, v):
@@ -54,6 +264,96 @@ class Hypergraph:
             self.N += 1
         return self.node_map[v]
 
+    # Adds nodes (without hyperedges) to the hypergraph. Nodes that are already in it are ignored.
+    def add_nodes(self, nodes):
+        for v in nodes:
+            self.map_node(v)
+        self.grow_nodes()
+
+    # Pads the operators on the nodes with the nodes mapped since they were last updated, which have no neighbors
+    def grow_nodes(self):
+        N_old = self.incidence.shape[0]
+        if self.N == N_old:
+            return
+        self.incidence.resize((self.N, self.M))
+        self.incidence_stats = None
+        if self.clique_adjacency is None:
+            return
+        self.clique_adjacency.resize((self.N, self.N))
+        self.clique_degrees = np.concatenate((self.clique_degrees, np.zeros(self.N - N_old)))
+        self.clique_dirty = np.concatenate((self.clique_dirty, np.zeros(self.N - N_old, dtype=bool)))
+        # Nodes without neighbors have a zero row (and column) in the normalized Laplacian
+        if self.clique_L is not None:
+            self.clique_L.resize((self.N, self.N))
+
+    # Adds hyperedges (lists of nodes, new or not) to the hypergraph. The adjacency of the clique expansion changes by
+    # B_new B_new^T (without the diagonal), and the line expansion gains the rows and columns of the new hyperedges,
+    # B^T B_new; only the nodes and hyperedges whose degree changed are marked as dirty in the Laplacians.
+    def add_hyperedges(self, hyperedges):
+        new_hyperedges = [sorted([self.map_node(v) for v in hedge]) for hedge in hyperedges]
+        self.grow_nodes()
+        if len(new_hyperedges) == 0:
+            return
+        B_new = sparse_incidence(new_hyperedges, self.N)
+        if self.clique_adjacency is not None:
+            self.add_to_expansions(B_new)
+        # And the incidence matrix
+        self.incidence = scipy.sparse.hstack((self.incidence, B_new), format='csc')
+        self.incidence_stats = None
+        self.hyperedges += new_hyperedges
+        self.M = len(self.hyperedges)
+
+    # Updates the expansions with the hyperedges of the incidence matrix B_new, before they are added to the hypergraph
+    def add_to_expansions(self, B_new):
+        # Clique expansion
+        delta = overlap_adjacency(B_new)
+        self.clique_adjacency = (self.clique_adjacency + delta).tocsr()
+        self.clique_degrees += np.asarray(delta.sum(axis=1)).flatten()
+        self.clique_dirty[np.unique(delta.tocoo().row)] = True
+        # Line expansion
+        M_old = self.M
+        overlap = (self.incidence.T @ B_new).tocsr()
+        self.line_adjacency = scipy.sparse.bmat([[self.line_adjacency, overlap],
+                                                 [overlap.T, overlap_adjacency(B_new.T)]], format='csr')
+        self.line_degrees = np.asarray(self.line_adjacency.sum(axis=1)).flatten()
+        self.line_dirty = np.concatenate((self.line_dirty, np.ones(B_new.shape[1], dtype=bool)))
+        self.line_dirty[np.unique(overlap.tocoo().row)] = True
+        if self.line_L is not None:
+            self.line_L.resize((M_old + B_new.shape[1], M_old + B_new.shape[1]))
+
+    # Removes the hyperedges at the given indices (the nodes stay, even if left without hyperedges). The hyperedges
+    # after them are renumbered, keeping their order.
+    def remove_hyperedges(self, indices):
+        removed = np.zeros(self.M, dtype=bool)
+        removed[np.asarray(indices, dtype=np.int64)] = True
+        if not np.any(removed):
+            return
+        keep = np.nonzero(~removed)[0]
+        if self.clique_adjacency is not None:
+            self.remove_from_expansions(self.incidence[:, np.nonzero(removed)[0]], keep)
+        # And the incidence matrix
+        self.incidence = self.incidence[:, keep]
+        self.incidence_stats = None
+        self.hyperedges = [self.hyperedges[i] for i in keep]
+        self.M = len(self.hyperedges)
+
+    # Updates the expansions with the removal of the hyperedges of the incidence matrix B_removed, keeping the rest
+    # (keep, the indices of the hyperedges left), before they are removed from the hypergraph
+    def remove_from_expansions(self, B_removed, keep):
+        # Clique expansion
+        delta = overlap_adjacency(B_removed)
+        self.clique_adjacency = (self.clique_adjacency - delta).tocsr()
+        self.clique_adjacency.eliminate_zeros()
+        self.clique_degrees -= np.asarray(delta.sum(axis=1)).flatten()
+        self.clique_dirty[np.unique(delta.tocoo().row)] = True
+        # Line expansion: the hyperedges that shared nodes with the removed ones lose those neighbors
+        self.line_dirty[np.unique((self.incidence.T @ B_removed).tocoo().row)] = True
+        self.line_adjacency = self.line_adjacency[keep][:, keep]
+        self.line_degrees = np.asarray(self.line_adjacency.sum(axis=1)).flatten()
+        self.line_dirty = self.line_dirty[keep]
+        if self.line_L is not None:
+            self.line_L = self.line_L[keep][:, keep]
+
     '''
     # The following code computes the Laplacian operator using the autodifferentiation package JAX.
     # There were several errors in how it computed the gradient, so this should not be used.
@@ -116,63 +416,37 @@ class Hypergraph:
 
         return x
 
-    # Returns the clique expansion graph of the hypergraph
+    # Returns the clique expansion graph of the hypergraph, where two nodes are adjacent with weight the number of
+    # hyperedges they share
     def clique_expansion(self):
-        G = nx.Graph()
-        G.add_nodes_from(np.arange(self.N))
+        self.build_expansions()
+        return nx.from_scipy_sparse_array(self.clique_adjacency)
 
-        # Go through hyperedges, and add edges between nodes
-        # within the same hyperedge.
-        for hedge in self.hyperedges:
-            for i in range(len(hedge)):
-                for j in range(i+1, len(hedge)):
-                    if not hedge[i] == hedge[j]:
-                        if G.has_edge(hedge[i], hedge[j]):
-                            G.edges[hedge[i], hedge[j]]['weight'] += 1
-                        else:
-                            G.add_edge(hedge[i], hedge[j], weight=1)
-        return G
-
-    # Returns the Laplacian of the clique expansion of the hypergraph
+    # Returns the Laplacian of the clique expansion of the hypergraph (the normalized Laplacian of clique_expansion())
     def clique_laplacian(self, as_tensor=False):
-        L_c = nx.normalized_laplacian_matrix(self.clique_expansion())
+        self.build_expansions()
+        self.clique_L = refresh_laplacian(self.clique_L, self.clique_adjacency, self.clique_degrees, self.clique_dirty)
+        self.clique_dirty[:] = False
         # Return a sparse tensor
-        if as_tensor:
-            indices = np.nonzero(L_c)
-            values = torch.tensor(L_c[indices]).squeeze()
-            return torch.sparse_coo_tensor(np.array(indices), values, (L_c.shape[0], L_c.shape[1]))
-        else:
-            return L_c
+        return as_sparse_output(self.clique_L, as_tensor)
 
-    # Returns the line expansion graph of the hypergraph
+    # Returns the line expansion graph of the hypergraph, where two hyperedges are adjacent with weight the number of
+    # nodes they share
     def line_expansion(self):
-        G = nx.Graph()
-        G.add_nodes_from(np.arange(self.M))
-
-        # Go through hyperedges, and add edges between them if they
-        # share nodes, with weight proportional to the size of the
-        # intersection.
-        for i in range(self.M):
-            for j in range(i+1, self.M):
-                G.add_edge(i, j, weight=len(set(self.hyperedges[i]).intersection(self.hyperedges[j])))
-        return G
-
-    # Returns the Laplacian of the line expansion of the hypergraph
+        self.build_expansions()
+        return nx.from_scipy_sparse_array(self.line_adjacency)
+
+    # Returns the Laplacian of the line expansion of the hypergraph (the normalized Laplacian of line_expansion())
     def line_laplacian(self, as_tensor=False):
-        L_l = nx.normalized_laplacian_matrix(self.line_expansion())
+        self.build_expansions()
+        self.line_L = refresh_laplacian(self.line_L, self.line_adjacency, self.line_degrees, self.line_dirty)
+        self.line_dirty[:] = False
         # Return a sparse tensor
-        if as_tensor:
-            indices = np.nonzero(L_l)
-            values = torch.tensor(L_l[indices]).squeeze()
-            return torch.sparse_coo_tensor(np.array(indices), values, (L_l.shape[0], L_l.shape[1]))
-        else:
-            return L_l
+        return as_sparse_output(self.line_L, as_tensor)
 
     # Returns the incidence matrix of the hypergraph
     def incidence_matrix(self, as_tensor=False):
-        B = np.zeros((self.N, self.M))
-        for i in range(self.M):
-            B[self.hyperedges[i], i] = 1
+        B = self.incidence.toarray()
         # Return a sparse tensor
         if as_tensor:
             indices = np.nonzero(B)
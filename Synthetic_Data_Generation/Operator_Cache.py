@@ -0,0 +1,181 @@
+import os
+import hashlib
+import pickle
+import numpy as np
+import scipy.sparse
+from Hypergraphs import normalized_laplacian_rows, expansions as expansion_registry
+
+# Options of the operators on each expansion. Any registered expansion (see Hypergraphs.expansions) can be used with
+# the default normalization and weighting, which is how its builder makes it; the rest of them are only available for
+# the clique and line expansions.
+normalizations = ['normalized', 'combinatorial', 'adjacency']
+weightings = ['overlap', 'binary']
+
+
+# Fingerprint of the structure of a hypergraph: SHA-256 of its incidence matrix in canonical CSR format (sorted column
+# indices, no duplicates, fixed integer and float types), so it does not depend on how the hypergraph was built
+def incidence_fingerprint(H):
+    B = scipy.sparse.csr_matrix(H.incidence)
+    B.sum_duplicates()
+    B.sort_indices()
+    digest = hashlib.sha256()
+    digest.update(np.array(B.shape, dtype=np.int64).tobytes())
+    digest.update(B.indptr.astype(np.int64).tobytes())
+    digest.update(B.indices.astype(np.int64).tobytes())
+    digest.update(B.data.astype(np.float64).tobytes())
+    return digest.hexdigest()
+
+
+# GSO of one expansion of the hypergraph H, as a scipy sparse array:
+#   normalization: 'normalized' (D^-1/2 (D - A) D^-1/2, the same as Hypergraph.clique_laplacian and line_laplacian),
+#       'combinatorial' (D - A) or 'adjacency' (A)
+#   weighting: 'overlap' (the weight of each edge is the number of hyperedges, or nodes, shared) or 'binary'
+def expansion_operator(H, expansion, normalization='normalized', weighting='overlap'):
+    if expansion not in expansion_registry:
+        raise ValueError('expansion type {} not available'.format(expansion))
+    if normalization not in normalizations:
+        raise ValueError('normalization {} not available'.format(normalization))
+    if weighting not in weightings:
+        raise ValueError('weighting {} not available'.format(weighting))
+    if normalization == 'normalized' and weighting == 'overlap':
+        # Built by the registered builder (which, for the clique and line expansions, is kept up to date incrementally
+        # by the hypergraph itself)
+        return H.expansion_gso(expansion)
+    if expansion not in ['clique', 'line']:
+        raise ValueError('only the clique and line expansions can be normalized and weighted differently')
+    H.build_expansions()
+    A = H.clique_adjacency if expansion == 'clique' else H.line_adjacency
+    if weighting == 'binary':
+        A = A.sign()
+    degrees = np.asarray(A.sum(axis=1)).flatten()
+    if normalization == 'normalized':
+        L = normalized_laplacian_rows(A, degrees, np.arange(A.shape[0]))
+    elif normalization == 'combinatorial':
+        L = scipy.sparse.diags(degrees) - A
+    else:
+        L = A
+    return scipy.sparse.csr_array(L)
+
+
+# GSOs of the given sequence of expansions of the hypergraph H (e.g. ['clique', 'line'], as in LocalGNNCliqueLine),
+# along with the incidence matrices to pool between each consecutive pair of them (B from an expansion on the nodes to
+# one on the hyperedges, and B^T the other way around), in the format read by load_operators
+def build_operators(H, expansions=('clique', 'line'), normalization='normalized', weighting='overlap'):
+    GSOs = [expansion_operator(H, expansion, normalization, weighting) for expansion in expansions]
+    domains = [expansion_registry[expansion][0] for expansion in expansions]
+    incidence_matrices = []
+    for i in range(len(expansions) - 1):
+        if sorted([domains[i], domains[i + 1]]) != ['hyperedges', 'nodes']:
+            raise ValueError('consecutive expansions have to be on the nodes and on the hyperedges')
+        B = H.incidence_matrix()
+        incidence_matrices.append(B if domains[i] == 'nodes' else B.T)
+    return GSOs, incidence_matrices
+
+
+# Saves the GSOs and incidence matrices as matrix_path + '_GSOs.pkl' and matrix_path + '_incidence_matrices.pkl', the
+# files given to train.py through matrix_path
+def save_operators(matrix_path, GSOs, incidence_matrices):
+    with open(matrix_path + '_GSOs.pkl', 'wb') as f:
+        pickle.dump(GSOs, f)
+    with open(matrix_path + '_incidence_matrices.pkl', 'wb') as f:
+        pickle.dump(incidence_matrices, f)
+
+
+# Loads the GSOs and incidence matrices saved with save_operators (the GSOs are None if not gsos, e.g. when they are
+# built from the incidence matrices instead)
+def load_operators(matrix_path, gsos=True):
+    GSOs = None
+    if gsos:
+        with open(matrix_path + '_GSOs.pkl', 'rb') as f:
+            GSOs = pickle.load(f)
+    with open(matrix_path + '_incidence_matrices.pkl', 'rb') as f:
+        incidence_matrices = pickle.load(f)
+    return GSOs, incidence_matrices
+
+
+class OperatorCache:
+    """
+    OperatorCache: on-disk, content addressed cache of the GSOs and incidence
+        matrices of hypergraphs, so that repeated experiments on the same
+        hypergraph skip building them. Each entry is keyed by the fingerprint
+        of the incidence matrix (incidence_fingerprint) along with the options
+        of the operators (expansions, normalization and weighting), so any
+        change in the hypergraph or in the options gives a different entry.
+
+    Initialization:
+
+    Input:
+        cache_dir (string): directory where the entries are saved, one pickle
+            per entry named after its key (default: '../Learning/data/operator_cache')
+        max_size (int): largest total size (in bytes) of the entries; when it
+            is exceeded, the least recently used entries are removed (default:
+            2**30, i.e. 1 GiB)
+
+    Methods:
+
+    GSOs, incidence_matrices = .get_operators(H, expansions = ('clique', 'line'),
+                                              normalization = 'normalized',
+                                              weighting = 'overlap')
+        returns the operators of the hypergraph H (see build_operators), from
+        the cache if they are there, or building (and caching) them otherwise.
+
+    key = .key(H, expansions, normalization, weighting): key of the entry.
+
+    size = .size(): total size (in bytes) of the entries in the cache.
+
+    .evict(keep = None): removes the least recently used entries (other than
+        keep) until the cache fits in max_size.
+
+    .clear(): removes all the entries.
+    """
+
+    def __init__(self, cache_dir='../Learning/data/operator_cache', max_size=2**30):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, H, expansions=('clique', 'line'), normalization='normalized', weighting='overlap'):
+        options = repr((list(expansions), normalization, weighting))
+        return hashlib.sha256((incidence_fingerprint(H) + options).encode()).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def entries(self):
+        return [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith('.pkl')]
+
+    def get_operators(self, H, expansions=('clique', 'line'), normalization='normalized', weighting='overlap'):
+        key = self.key(H, expansions, normalization, weighting)
+        fname = self.entry_path(key)
+        if os.path.exists(fname):
+            with open(fname, 'rb') as f:
+                operators = pickle.load(f)
+            # Mark it as recently used
+            os.utime(fname)
+            return operators
+        operators = build_operators(H, expansions, normalization, weighting)
+        # Written to a temporary file first, so that concurrent experiments never read a partial entry
+        tmp_fname = fname + '.%d.tmp' % os.getpid()
+        with open(tmp_fname, 'wb') as f:
+            pickle.dump(operators, f)
+        os.replace(tmp_fname, fname)
+        self.evict(keep=fname)
+        return operators
+
+    def size(self):
+        return sum([os.path.getsize(fname) for fname in self.entries()])
+
+    def evict(self, keep=None):
+        entries = sorted(self.entries(), key=os.path.getmtime)
+        total = sum([os.path.getsize(fname) for fname in entries])
+        for fname in entries:
+            if total <= self.max_size:
+                break
+            if fname == keep:
+                continue
+            total -= os.path.getsize(fname)
+            os.remove(fname)
+
+    def clear(self):
+        for fname in self.entries():
+            os.remove(fname)
@@ -0,0 +1,158 @@
+import numpy as np
+import scipy.sparse
+import scipy.special
+from Hypergraphs import Hypergraph
+
+# Random hypergraph models, to benchmark (and test the scaling of) the architectures on hypergraphs of any size. All of
+# them are vectorized, building the incidence matrix directly from arrays of (node, hyperedge) pairs, and return a
+# Hypergraph made with Hypergraph.from_incidence, so millions of incidences take seconds. Every generator takes a seed
+# (or a numpy Generator), and gives the same hypergraph for the same seed.
+
+
+# Hypergraph with the incidences given as arrays of the node and the hyperedge of each one (repeated pairs count once)
+def incidence_hypergraph(nodes, hyperedges, N, M):
+    B = scipy.sparse.csc_matrix((np.ones(len(nodes)), (nodes, hyperedges)), shape=(N, M))
+    return Hypergraph.from_incidence(B)
+
+
+# Positions of the incidences that repeat a (node, hyperedge) pair already at an earlier position
+def repeated_incidences(nodes, hyperedges):
+    order = np.lexsort((nodes, hyperedges))
+    repeated = np.zeros(len(nodes), dtype=bool)
+    repeated[order[1:]] = (nodes[order[1:]] == nodes[order[:-1]]) & (hyperedges[order[1:]] == hyperedges[order[:-1]])
+    return np.nonzero(repeated)[0]
+
+
+# Nodes of hyperedges with the given sizes, each drawn with draw(rng, hyperedges) (the node of one incidence of each of
+# the hyperedges given), with no node repeated in a hyperedge: the repeated ones are drawn again until there are none
+# left (or max_rounds is reached, and then they are dropped). Returns the node and hyperedge of each incidence.
+def draw_hyperedges(sizes, draw, rng, max_rounds=100):
+    hyperedges = np.repeat(np.arange(len(sizes)), sizes)
+    nodes = draw(rng, hyperedges)
+    for _ in range(max_rounds):
+        repeated = repeated_incidences(nodes, hyperedges)
+        if len(repeated) == 0:
+            break
+        nodes[repeated] = draw(rng, hyperedges[repeated])
+    return nodes, hyperedges
+
+
+# Sizes of M hyperedges: all of them the same if size is an integer, drawn from the distribution given as an array of
+# probabilities (of size 0, 1, 2, ...) otherwise
+def hyperedge_sizes(M, size, rng):
+    if np.isscalar(size):
+        return np.full(M, size, dtype=np.int64)
+    size = np.asarray(size, dtype=np.float64)
+    return rng.choice(len(size), size=M, p=size / np.sum(size))
+
+
+# Erdos-Renyi hypergraph on N nodes, where each set of k nodes is a hyperedge with probability p. For a non-uniform
+# hypergraph, k and p are lists, with the probability for each size. The number of hyperedges of each size is drawn
+# from the Poisson approximation of the binomial with comb(N, k) trials, and then that many random k-sets are taken
+# (the repeated ones only once).
+def erdos_renyi_hypergraph(N, p, k=3, seed=None):
+    rng = np.random.default_rng(seed)
+    ks, ps = np.atleast_1d(k), np.atleast_1d(p)
+    assert len(ks) == len(ps) and np.all(ks <= N)
+    node_sets = []
+    for k_i, p_i in zip(ks, ps):
+        sizes = np.full(rng.poisson(scipy.special.comb(N, k_i) * p_i), k_i, dtype=np.int64)
+        nodes, _ = draw_hyperedges(sizes, lambda rng, hyperedges: rng.integers(0, N, size=len(hyperedges)), rng)
+        # The nodes are in the order of the hyperedges, k_i per hyperedge
+        node_sets.append(np.unique(np.sort(nodes.reshape(len(sizes), k_i), axis=1), axis=0))
+    sizes = np.concatenate([np.full(len(node_set), node_set.shape[1], dtype=np.int64) for node_set in node_sets])
+    nodes = np.concatenate([node_set.flatten() for node_set in node_sets])
+    return incidence_hypergraph(nodes, np.repeat(np.arange(len(sizes)), sizes), N, len(sizes))
+
+
+# Erdos-Renyi hypergraph with N nodes and exactly M hyperedges, with the given size (an integer, or the probabilities
+# of each size, see hyperedge_sizes), each one on a set of nodes drawn uniformly at random
+def random_hypergraph(N, M, size=3, seed=None):
+    rng = np.random.default_rng(seed)
+    sizes = hyperedge_sizes(M, size, rng)
+    assert np.all(sizes <= N)
+    nodes, hyperedges = draw_hyperedges(sizes, lambda rng, hyperedges: rng.integers(0, N, size=len(hyperedges)), rng)
+    return incidence_hypergraph(nodes, hyperedges, N, M)
+
+
+# Hypergraph stochastic block model with M hyperedges on nodes split into blocks of the given sizes: each hyperedge is
+# assigned to a block (with probability proportional to its size), and each of its nodes is drawn from that block with
+# probability p_within, and from all the nodes otherwise. The hyperedge sizes are as in random_hypergraph. Returns the
+# hypergraph and the block of each node.
+def stochastic_block_hypergraph(block_sizes, M, p_within=0.9, size=3, seed=None):
+    rng = np.random.default_rng(seed)
+    block_sizes = np.asarray(block_sizes, dtype=np.int64)
+    N = np.sum(block_sizes)
+    offsets = np.concatenate(([0], np.cumsum(block_sizes)[:-1]))
+    sizes = hyperedge_sizes(M, size, rng)
+    assert np.all(sizes <= np.min(block_sizes))
+    blocks = rng.choice(len(block_sizes), size=M, p=block_sizes / N)
+
+    def draw(rng, hyperedges):
+        b = blocks[hyperedges]
+        within = rng.random(len(hyperedges)) < p_within
+        return np.where(within, offsets[b] + rng.integers(0, block_sizes[b]), rng.integers(0, N, size=len(hyperedges)))
+
+    nodes, hyperedges = draw_hyperedges(sizes, draw, rng)
+    return incidence_hypergraph(nodes, hyperedges, N, M), np.repeat(np.arange(len(block_sizes)), block_sizes)
+
+
+# Configuration model: hypergraph with the given degree of each node and size of each hyperedge (which have to add up
+# to the same number of incidences), matching the node stubs to the hyperedge stubs at random. Stubs that repeat a node
+# in a hyperedge are swapped with distinct random stubs among the rest (max_rounds times at most), and the few left are
+# dropped, so the degrees and sizes are kept exactly unless both are very skewed.
+def configuration_hypergraph(degrees, sizes, max_rounds=100, seed=None):
+    rng = np.random.default_rng(seed)
+    degrees, sizes = np.asarray(degrees, dtype=np.int64), np.asarray(sizes, dtype=np.int64)
+    if np.sum(degrees) != np.sum(sizes):
+        raise ValueError('the degrees and the hyperedge sizes add up to {} and {} incidences'.format(
+            np.sum(degrees), np.sum(sizes)))
+    nodes = rng.permutation(np.repeat(np.arange(len(degrees)), degrees))
+    hyperedges = np.repeat(np.arange(len(sizes)), sizes)
+    for _ in range(max_rounds):
+        repeated = repeated_incidences(nodes, hyperedges)
+        if len(repeated) == 0:
+            break
+        # Swapping node stubs keeps both the degrees and the sizes, as long as each stub is in one swap at most
+        candidates = np.setdiff1d(np.arange(len(nodes)), repeated, assume_unique=True)
+        n_swaps = min(len(repeated), len(candidates))
+        repeated = rng.permutation(repeated)[:n_swaps]
+        others = rng.choice(candidates, size=n_swaps, replace=False)
+        nodes[repeated], nodes[others] = nodes[others], nodes[repeated]
+    return incidence_hypergraph(nodes, hyperedges, len(degrees), len(sizes))
+
+
+# Sequence of n integers in [minimum, maximum] drawn from a (discrete) power law with the given exponent, P(d) ~ d^-a,
+# e.g. the degrees or hyperedge sizes for configuration_hypergraph
+def power_law_sequence(n, exponent, minimum=1, maximum=None, seed=None):
+    rng = np.random.default_rng(seed)
+    maximum = n if maximum is None else maximum
+    values = np.arange(minimum, maximum + 1)
+    p = values.astype(np.float64) ** (-exponent)
+    return rng.choice(values, size=n, p=p / np.sum(p))
+
+
+# Preferential attachment hypergraph with M hyperedges, the first one on its own nodes and each of the rest made of one
+# new node and size - 1 nodes already in the hypergraph, drawn with probability proportional to their degree (with
+# hyperedge sizes as in random_hypergraph). Drawing proportionally to the degree is the same as taking the node of an
+# earlier incidence uniformly at random, so each incidence either is a new node or points to an earlier incidence, and
+# the pointers are followed all at once by pointer jumping, instead of adding the hyperedges one by one. Nodes drawn
+# twice in a hyperedge count once.
+def preferential_attachment_hypergraph(M, size=3, seed=None):
+    rng = np.random.default_rng(seed)
+    sizes = np.maximum(hyperedge_sizes(M, size, rng), 1)
+    hyperedges = np.repeat(np.arange(M), sizes)
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    position = np.arange(len(hyperedges)) - starts[hyperedges]
+    # The nodes of the first hyperedge, and the first node of each of the rest, are new
+    new = (hyperedges == 0) | (position == 0)
+    nodes = np.cumsum(new) - 1
+    # The rest point to a uniformly random incidence of the earlier hyperedges
+    pointers = np.arange(len(hyperedges))
+    pointers[~new] = np.floor(rng.random(np.sum(~new)) * starts[hyperedges[~new]]).astype(np.int64)
+    while True:
+        jumped = pointers[pointers]
+        if np.array_equal(jumped, pointers):
+            break
+        pointers = jumped
+    return incidence_hypergraph(nodes[pointers], hyperedges, np.sum(new), M)
@@ -6,6 +6,7 @@ from sklearn.metrics import f1_score
 from scipy.special import softmax
 from tqdm import tqdm
 from Utils import plot_diffusions_hg
+from Data_Loaders import hypergraphDataset
 
 
 def generate_hypergraph_diffusion(sc, n_samples, n_sources, source_upper, timesteps):
@@ -192,7 +193,7 @@ class hypergraphSources(_dataForClassification):
             # covariance = np.mean(np.abs(sampled_signals), axis=1) * cov_multiplier
             noise = np.random.multivariate_normal(mu, np.eye(H.N)*cov_multiplier, size=self.nTotal)  # np.array([np.random.multivariate_normal(mu, np.eye(H.N) * covariance[i]) for i in range(nTotal)])
         else:
-            noise = np.zeros(self.nTotal, H.N)
+            noise = np.zeros((self.nTotal, H.N))
 
         # Now, we have the signals and the labels
         signals = np.expand_dims(sampled_signals + noise, axis=1)  # nTotal x 1 x N
@@ -323,6 +324,16 @@ class hypergraphSources(_dataForClassification):
     def getTargets(self, inds):
         return None
 
+    # Returns the signals, labels and readout targets of the samples inds, so that a whole batch is built in one call
+    # (e.g. by a DataLoader worker process)
+    def getBatch(self, samplesType, inds):
+        x, y = self.getSamples(samplesType, inds)
+        return x, y, self.getTargets(inds)
+
+    # Exposes the samplesType split as a torch Dataset, to be consumed by a DataLoader
+    def getDataset(self, samplesType, dense=False):
+        return hypergraphDataset(self, samplesType, dense)
+
     def evaluate(self, yHat, y, tol=1e-9):
         """
         Return the accuracy (ratio of yHat = y)
@@ -6,21 +6,11 @@ from matplotlib.patches import Polygon
 from mpl_toolkits.mplot3d.art3d import Poly3DCollection
 from matplotlib.collections import PatchCollection
 import os
+import sys
 
-
-# Compute the spectral similarity between two square, symmetric, positive semi-definite, irreducible
-# matrices of the same size.
-# Finds the largest value epsilon (eps) such that (1 - eps)*lambda_i(A) <= lambda_i(B) <= (1 + eps)*lambda_i(A)
-def spectral_similarity(A, B):
-    # Compute eigenvalues, ignoring the smallest (since it is zero, up to numerical precision)
-    eigs_A = np.linalg.eigvalsh(A)[1:]
-    eigs_B = np.linalg.eigvalsh(B)[1:]
-
-    # For each pair in ascending order, compute the lower bound for epsilon
-    eps_vals = (eigs_B - eigs_A) / eigs_A
-
-    # Pick the greatest lower bound
-    return np.max(eps_vals)
+# The spectral similarity is shared with the sparsifiers in Approximation
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Approximation'))
+from Graph_Approximation import spectral_similarity
 
 
 # Plots the diffusion of the signal x on the hypergraph H, according to L_H
@@ -0,0 +1,18 @@
+import sys
+import os
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Synthetic_Data_Generation'))
+
+from Random_Hypergraphs import configuration_hypergraph
+
+
+# The configuration model keeps the degree of each node and the size of each hyperedge, also when most stubs repeat a
+# node in their hyperedge at first and have to be swapped (few nodes, with large degrees)
+def test_configuration_hypergraph_keeps_degrees_and_sizes():
+    degrees = np.full(30, 50)
+    sizes = np.full(300, 5)
+    for seed in range(10):
+        B = configuration_hypergraph(degrees, sizes, seed=seed).incidence
+        assert np.array_equal(np.asarray(B.sum(axis=1)).flatten(), degrees)
+        assert np.array_equal(np.sort(np.asarray(B.sum(axis=0)).flatten()), sizes)
@@ -0,0 +1,76 @@
+import sys
+import os
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Learning'))
+
+import sparseGraphML as spgml
+import partitionedGraphML as ppgml
+
+nNodes = 60
+nEdges = 25
+batchSize = 3
+edgeFeatures = 2
+dimFeatures = 4
+
+
+# Random hypergraph (the same on all ranks) and its clique expansion as a sparse GSO with two edge features
+def randomHypergraph():
+    generator = torch.Generator().manual_seed(0)
+    B = (torch.rand(nNodes, nEdges, generator=generator) < 0.1).double() \
+        * torch.rand(nNodes, nEdges, generator=generator, dtype=torch.float64)
+    A = ((B @ B.t()) != 0).double()
+    S = torch.stack((A, A * torch.rand(nNodes, nNodes, generator=generator, dtype=torch.float64))).to_sparse()
+    return S, B
+
+
+# Signal at all the nodes and weights of the outputs in the loss, the same on all ranks
+def randomSignal(shape, outputShape):
+    generator = torch.Generator().manual_seed(1)
+    return torch.randn(shape, generator=generator, dtype=torch.float64), \
+        torch.randn(outputShape, generator=generator, dtype=torch.float64)
+
+
+def partitionedWorker(rank, worldSize, initFile):
+    dist.init_process_group('gloo', init_method='file://' + initFile, rank=rank, world_size=worldSize)
+    try:
+        S, B = randomHypergraph()
+        # Shift over the GSO, with the nodes split in reverse Cuthill-McKee order
+        parts = ppgml.bandwidthPartition(S, worldSize)
+        plan = ppgml.shiftPlan(S, parts, rank)
+        x, weights = randomSignal((batchSize, edgeFeatures, dimFeatures, nNodes),
+                                  (batchSize, edgeFeatures, dimFeatures, nNodes))
+        x.requires_grad_()
+        y = spgml.graphShift(x, S)
+        (y * weights).sum().backward()
+        xOwned = x.detach()[..., plan.ownedInputs].requires_grad_()
+        yOwned = ppgml.partitionedShift(xOwned, ppgml.localGSO(S, plan), plan)
+        (yOwned * weights[..., plan.ownedOutputs]).sum().backward()
+        torch.testing.assert_close(yOwned, y.detach()[..., plan.ownedOutputs])
+        torch.testing.assert_close(xOwned.grad, x.grad[..., plan.ownedInputs])
+        # Pooling into the hyperedges, with the nodes split at random (so most of them are in the halo)
+        nodeIndex, edgeIndex, values = spgml.incidenceIndex(B)
+        nodeParts = torch.randperm(nNodes, generator=torch.Generator().manual_seed(2)) % worldSize
+        edgeParts = ppgml.hyperedgePartition(nodeIndex, edgeIndex, nNodes, nEdges, worldSize)
+        plan = ppgml.incidencePlan(nodeIndex, edgeIndex, nodeParts, edgeParts, rank)
+        x, weights = randomSignal((batchSize, dimFeatures, nNodes), (batchSize, dimFeatures, nEdges))
+        x.requires_grad_()
+        y = spgml.incidencePool(x, nodeIndex, edgeIndex, values, nEdges)
+        (y * weights).sum().backward()
+        xOwned = x.detach()[..., plan.ownedInputs].requires_grad_()
+        yOwned = ppgml.partitionedIncidencePool(xOwned, values[plan.entries], plan)
+        (yOwned * weights[..., plan.ownedOutputs]).sum().backward()
+        torch.testing.assert_close(yOwned, y.detach()[..., plan.ownedOutputs])
+        torch.testing.assert_close(xOwned.grad, x.grad[..., plan.ownedInputs])
+    finally:
+        dist.destroy_process_group()
+
+
+# The partitioned shift and pooling give, at the nodes (and hyperedges) of each rank, the same outputs as the
+# unpartitioned ones, and the same gradients at the owned inputs, once the halo gradients are sent back
+def test_partitioned_operations_match_unpartitioned(tmp_path):
+    for worldSize in [2, 3]:
+        initFile = str(tmp_path / ('init%d' % worldSize))
+        mp.spawn(partitionedWorker, args=(worldSize, initFile), nprocs=worldSize)